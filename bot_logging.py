@@ -0,0 +1,142 @@
+import asyncio
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import queue
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from metrics import handler_latency, handler_updates
+
+# Стандартные поля LogRecord. Всё остальное пришло через extra и попадает в JSON отдельными ключами
+STANDARD_RECORD_FIELDS = set(logging.makeLogRecord({}).__dict__) | {'message', 'asctime', 'taskName'}
+
+# Замер текущего обработчика обновления. Копируется в поток БД вместе с контекстом (см. database.run_db)
+current_timing = contextvars.ContextVar('current_timing', default=None)
+
+# Одна строка лога - один JSON-объект: время, уровень, логгер, текст, поля из extra и трейсбек
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in STANDARD_RECORD_FIELDS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+# QueueHandler, который сохраняет структуру записи: текст и трейсбек готовятся в вызывающем
+# потоке (пока жив exc_info), а JSON собирается уже в потоке QueueListener
+class StructuredQueueHandler(QueueHandler):
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+# Добавляет к записям имя обработчика, в котором они сделаны, и отмечает ошибки в его замере
+class HandlerContextFilter(logging.Filter):
+    def filter(self, record):
+        timing = current_timing.get()
+        if timing is not None:
+            if not hasattr(record, 'handler'):
+                record.handler = timing.name
+            if record.levelno >= logging.ERROR:
+                timing.failed = True
+        return True
+
+# Настраивает логирование: запись в файл с ротацией идёт в отдельном потоке QueueListener,
+# а обработчики только кладут запись в очередь. Возвращает запущенный QueueListener
+def setup_logging(filename, level='INFO', max_bytes=10 * 1024 * 1024, backup_count=5):
+    file_handler = RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    file_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(HandlerContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    # При выходе дописываем оставшиеся в очереди записи
+    atexit.register(listener.stop)
+    return listener
+
+# Замер одного вызова обработчика: время, число SQL-запросов и были ли ошибки
+class HandlerTiming:
+    def __init__(self, name):
+        self.name = name
+        self.queries = 0
+        self.failed = False
+
+# Считает SQL-запрос в замере текущего обработчика (событие before_cursor_execute движка)
+def count_query(*args):
+    timing = current_timing.get()
+    if timing is not None:
+        timing.queries += 1
+
+# Декоратор обработчика обновлений: пишет в лог длительность, число запросов к БД и исход
+# и учитывает вызов в метриках. Вложенный обработчик (например, cancel из equipment)
+# добавляет свои запросы к внешнему
+def timed_handler(func):
+    logger = logging.getLogger(func.__module__)
+    # Метрики обработчика получаем один раз, на горячем пути только увеличиваем счётчики
+    latency = handler_latency.labels(func.__name__)
+    updates = {outcome: handler_updates.labels(func.__name__, outcome) for outcome in ('ok', 'error', 'cancelled')}
+
+    @functools.wraps(func)
+    async def wrapper(update, context, *args, **kwargs):
+        parent = current_timing.get()
+        timing = HandlerTiming(func.__name__)
+        token = current_timing.set(timing)
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = await func(update, context, *args, **kwargs)
+            outcome = 'error' if timing.failed else 'ok'
+            return result
+        except BaseException as e:
+            outcome = 'cancelled' if isinstance(e, asyncio.CancelledError) else 'error'
+            raise
+        finally:
+            current_timing.reset(token)
+            if parent is not None:
+                parent.queries += timing.queries
+                parent.failed = parent.failed or timing.failed
+            duration = time.perf_counter() - started
+            latency.observe(duration)
+            updates[outcome].inc()
+            duration_ms = duration * 1000
+            user = getattr(update, 'effective_user', None)
+            logger.info(
+                f"Обработчик {timing.name}: {outcome} за {duration_ms:.1f} мс, запросов к БД {timing.queries}",
+                extra={
+                    'handler': timing.name,
+                    'duration_ms': round(duration_ms, 3),
+                    'db_queries': timing.queries,
+                    'outcome': outcome,
+                    'user_id': user.id if user else None,
+                },
+            )
+
+    return wrapper
@@ -0,0 +1,114 @@
+import base64
+import hashlib
+import hmac
+import os
+import re
+import struct
+import time
+from collections import namedtuple
+
+# Формат callback_data inline-кнопок. Кнопка несёт упакованные поля
+# (версия, код операции, аргумент, доп. поле, час выпуска) и подпись HMAC, всё в base64url.
+# Подпись проверяется до любых обращений к БД: поддельные и повреждённые кнопки отбрасываются сразу.
+# При изменении формата увеличьте PROTOCOL_VERSION - кнопки старой версии будут считаться устаревшими
+PROTOCOL_VERSION = 1
+
+# Коды операций
+OP_COMPLETE = 1
+OP_CANCEL = 2
+OP_RESTORE_COMPLETED = 3
+OP_RESTORE_CANCELLED = 4
+OP_DELETE_COMPLETED = 5
+OP_DELETE_CANCELLED = 6
+OP_PAGE = 7  # аргумент - id граничной заявки, доп. поле - список и направление
+OP_SEARCH = 8  # аргумент - смещение в результатах поиска
+
+# Действия с заявкой по коду операции (аргумент - id заявки)
+REQUEST_ACTIONS = {
+    OP_COMPLETE: 'complete',
+    OP_CANCEL: 'cancel',
+    OP_RESTORE_COMPLETED: 'restore_completed',
+    OP_RESTORE_CANCELLED: 'restore_cancelled',
+    OP_DELETE_COMPLETED: 'delete_completed',
+    OP_DELETE_CANCELLED: 'delete_cancelled',
+}
+ACTION_OPCODES = {action: opcode for opcode, action in REQUEST_ACTIONS.items()}
+OPCODES = frozenset(REQUEST_ACTIONS) | {OP_PAGE, OP_SEARCH}
+
+# Списки заявок для кнопок листания: номер списка хранится в доп. поле
+PAGE_VIEWS = ('active', 'completed', 'cancelled')
+
+# версия, код операции, аргумент (uint32), доп. поле, час выпуска (часы с начала эпохи)
+PAYLOAD = struct.Struct('>BBIBI')
+MAC_SIZE = 8
+# Длина callback_data в base64url без '=' (Telegram допускает до 64 байт)
+ENCODED_SIZE = len(base64.urlsafe_b64encode(bytes(PAYLOAD.size + MAC_SIZE)).rstrip(b'='))
+ENCODED_PATTERN = re.compile(rf'[A-Za-z0-9_-]{{{ENCODED_SIZE}}}')
+MAX_ARG = 2 ** 32 - 1
+
+# Через сколько часов кнопка считается устаревшей (0 - срок не ограничен)
+CALLBACK_MAX_AGE_HOURS = int(os.getenv('CALLBACK_MAX_AGE_HOURS', str(30 * 24)))
+
+# Ключ подписи. Если CALLBACK_SECRET не задан, выводится из токена бота: он секретный
+# и не меняется между перезапусками, поэтому уже отправленные кнопки продолжают работать
+CALLBACK_KEY = hashlib.sha256(
+    b'callback_data:' + (os.getenv('CALLBACK_SECRET') or os.getenv('TELEGRAM_BOT_TOKEN', '')).encode()
+).digest()
+
+Callback = namedtuple('Callback', ['opcode', 'arg', 'aux', 'issued'])
+
+# Кнопка не прошла проверку. reason: malformed (не наш формат), forged (неверная подпись),
+# stale (другая версия формата или истёк срок)
+class CallbackDataError(ValueError):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+def current_hour(now=None):
+    return int((time.time() if now is None else now) // 3600)
+
+def sign(payload, key):
+    return hmac.new(key, payload, hashlib.sha256).digest()[:MAC_SIZE]
+
+# Упаковывает и подписывает callback_data
+def encode_callback(opcode, arg=0, aux=0, key=CALLBACK_KEY, now=None):
+    if opcode not in OPCODES or not 0 <= arg <= MAX_ARG or not 0 <= aux <= 255:
+        raise ValueError(f"Некорректная кнопка: {opcode}, {arg}, {aux}")
+    payload = PAYLOAD.pack(PROTOCOL_VERSION, opcode, arg, aux, current_hour(now))
+    return base64.urlsafe_b64encode(payload + sign(payload, key)).rstrip(b'=').decode('ascii')
+
+# Проверяет и распаковывает callback_data. Возвращает Callback или бросает CallbackDataError.
+# Работает только с самой строкой, без обращений к БД
+def decode_callback(data, key=CALLBACK_KEY, now=None, max_age_hours=CALLBACK_MAX_AGE_HOURS):
+    if not isinstance(data, str) or not ENCODED_PATTERN.fullmatch(data):
+        raise CallbackDataError('malformed')
+    raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    payload, mac = raw[:PAYLOAD.size], raw[PAYLOAD.size:]
+    if len(mac) != MAC_SIZE or not hmac.compare_digest(mac, sign(payload, key)):
+        raise CallbackDataError('forged')
+    version, opcode, arg, aux, issued = PAYLOAD.unpack(payload)
+    if version != PROTOCOL_VERSION:
+        raise CallbackDataError('stale')
+    if opcode not in OPCODES:
+        raise CallbackDataError('malformed')
+    if max_age_hours and current_hour(now) - issued > max_age_hours:
+        raise CallbackDataError('stale')
+    return Callback(opcode, arg, aux, issued)
+
+# Кнопка действия с заявкой
+def request_callback(action, request_id):
+    return encode_callback(ACTION_OPCODES[action], request_id)
+
+# Кнопка листания списка: backwards - назад от cursor_id
+def page_callback(view, backwards, cursor_id):
+    return encode_callback(OP_PAGE, cursor_id, PAGE_VIEWS.index(view) << 1 | int(backwards))
+
+# Список и направление из кнопки листания: (список или None, назад ли)
+def parse_page_callback(callback):
+    view_index = callback.aux >> 1
+    view = PAGE_VIEWS[view_index] if view_index < len(PAGE_VIEWS) else None
+    return view, bool(callback.aux & 1)
+
+# Кнопка листания результатов поиска
+def search_callback(offset):
+    return encode_callback(OP_SEARCH, offset)
@@ -0,0 +1,91 @@
+import argparse
+import csv
+import os
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from rendering import STATUS_LABELS, PRIORITY_LABELS, format_datetime
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # XLSX необязателен: CSV работает и без openpyxl
+    Workbook = None
+
+# Выгрузка заявок в CSV и XLSX. Строки пишутся в файл по мере чтения из БД,
+# поэтому память не зависит от числа заявок
+EXPORT_FORMATS = ('csv', 'xlsx')
+
+EXPORT_HEADERS = [
+    'Номер', 'Оборудование', 'Количество', 'Описание', 'Приоритет', 'Статус',
+    'Создана', 'Выполнена', 'Автор', 'Принял', 'Отклонил/отменил', 'Заметки',
+]
+
+# Превращает строку services.iter_export_rows() в ячейки таблицы
+def format_export_row(row):
+    (request_id, equipment_name, quantity, description, priority, status,
+     created_at, completed_at, author, completed_by, cancelled_by, notes) = row
+    return [
+        request_id, equipment_name, quantity, description,
+        PRIORITY_LABELS.get(priority, priority), STATUS_LABELS.get(status, status),
+        format_datetime(created_at), format_datetime(completed_at) if completed_at else '',
+        author or '', completed_by or '', cancelled_by or '', notes or '',
+    ]
+
+# Пишет строки в CSV по мере поступления. UTF-8 с BOM, чтобы Excel распознал кодировку
+def write_csv(path, rows):
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(EXPORT_HEADERS)
+        for row in rows:
+            writer.writerow(format_export_row(row))
+            count += 1
+    return count
+
+# Можно ли выгружать в XLSX (установлен ли openpyxl)
+def xlsx_available():
+    return Workbook is not None
+
+# Пишет строки в XLSX в режиме openpyxl write-only: строки сразу уходят на диск
+def write_xlsx(path, rows):
+    if Workbook is None:
+        raise RuntimeError("Для выгрузки в XLSX нужен openpyxl (pip install openpyxl)")
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Заявки')
+    sheet.append(EXPORT_HEADERS)
+    count = 0
+    for row in rows:
+        sheet.append(format_export_row(row))
+        count += 1
+    workbook.save(path)
+    return count
+
+# Пишет строки заявок в файл CSV или XLSX. Возвращает число выгруженных заявок
+def export_requests(path, rows, export_format='csv'):
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {export_format}")
+    writer = write_xlsx if export_format == 'xlsx' else write_csv
+    return writer(path, rows)
+
+# Превращает 'ГГГГ-ММ' в диапазон [первый день месяца, первый день следующего месяца)
+def month_range(month):
+    since = datetime.strptime(month, '%Y-%m')
+    until = since.replace(year=since.year + 1, month=1) if since.month == 12 else since.replace(month=since.month + 1)
+    return since, until
+
+if __name__ == "__main__":
+    # Переменные окружения загружаем до того, как модули бота прочитают настройки
+    load_dotenv()
+    # Импорт здесь: сам бот использует этот модуль для /export
+    from services import iter_export_rows
+
+    parser = argparse.ArgumentParser(description="Export requests to CSV or XLSX.")
+    parser.add_argument('path', help="output file, the format is taken from the extension (.csv or .xlsx)")
+    parser.add_argument('--month', help="export only requests created in this month (YYYY-MM)")
+    args = parser.parse_args()
+
+    export_format = os.path.splitext(args.path)[1].lstrip('.').lower() or 'csv'
+    since, until = month_range(args.month) if args.month else (None, None)
+    count = export_requests(args.path, iter_export_rows(since, until), export_format)
+    print(f"Exported {count} requests to {args.path}")
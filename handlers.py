@@ -0,0 +1,999 @@
+import asyncio
+import logging
+import os
+import re
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent, InputFile
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes, ConversationHandler
+
+from bot_logging import timed_handler
+from callbacks import (
+    OP_PAGE, OP_SEARCH, REQUEST_ACTIONS, CallbackDataError, decode_callback, parse_page_callback,
+)
+from database import run_db, run_export
+from export import EXPORT_FORMATS, month_range, xlsx_available
+from importer import ImportFileError, read_import_file
+from outbox import outbox
+from rendering import get_status_emoji, STATUS_LABELS, format_request_stats
+from services import (
+    RETENTION_DAYS, VIEW_EMPTY_TEXTS,
+    get_request_buttons, build_page_message, build_search_message,
+    get_user, register_user, save_request, import_requests, load_page, search_terms, search_requests,
+    inline_lookup, process_callback, load_request_stats, export_to_file, load_request_card,
+    begin_fan_out, finish_fan_out, load_unfinished_fan_outs, create_delivery_batch, record_delivery_results,
+    register_page_cards, forget_cards, build_card_updates,
+    purge_expired_requests, reconcile_request_stats,
+)
+from validation import PRIORITY_BUTTONS, ValidationError, parse_quantity, parse_priority
+
+logger = logging.getLogger(__name__)
+
+# Импорт заявок из таблицы: максимум заявок в файле, размер файла (Bot API отдаёт файлы до 20 МБ)
+# и сколько ошибок перечислять в отчёте
+IMPORT_MAX_ROWS = int(os.getenv('IMPORT_MAX_ROWS', '500'))
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024
+IMPORT_REPORT_LIMIT = 30
+
+# Inline-режим (@бот #123 или @бот дрель): сколько секунд Telegram и сам бот хранят ответ,
+# и пауза, после которой запрос считается набранным до конца
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '30'))
+INLINE_CACHE_SIZE = int(os.getenv('INLINE_CACHE_SIZE', '1024'))
+INLINE_DEBOUNCE = float(os.getenv('INLINE_DEBOUNCE', '0.4'))
+# Задержка перед обновлением карточек: изменения за это время уходят одной пачкой
+CARD_UPDATE_DELAY = float(os.getenv('CARD_UPDATE_DELAY', '1'))
+
+# Состояния для создания заявки
+EQUIPMENT, QUANTITY, DESCRIPTION, PRIORITY = range(4)
+# Состояние диалога импорта заявок: ждём файл
+IMPORT_FILE = 4
+
+# Функция для создания клавиатуры главного меню
+def get_main_menu_keyboard(is_admin):
+    if is_admin:
+        keyboard = [
+            ["📝 Создать заявку", "📋 Активные заявки"],
+            ["✅ Выполненные заявки", "❌ Отмененные заявки"],
+            ["❓ Помощь"]
+        ]
+    else:
+        keyboard = [
+            ["📋 Мои заявки"],
+            ["❓ Помощь"]
+        ]
+    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+# Кэш ответов на inline-запросы: (telegram_id, текст запроса) -> результаты, с TTL.
+# Используется только из event loop, поэтому без блокировки
+class InlineResultCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # ключ -> (результаты, истекает_в)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        if entry is not None:
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, results):
+        self._entries[key] = (results, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    # Заявки изменились - сохранённые ответы больше не актуальны
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+inline_cache = InlineResultCache(maxsize=INLINE_CACHE_SIZE, ttl=INLINE_CACHE_TIME)
+# Номер последнего inline-запроса каждого пользователя, ожидающего паузы в наборе
+inline_sequences = {}
+
+# Обработчик команды /start
+@timed_handler
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        # Ищем пользователя в базе, если не найден - создаем нового
+        user, created = await run_db(
+            register_user, update.effective_user.id, update.effective_user.username
+        )
+
+        if created:
+            await outbox.reply_text(
+                update.message,
+                "👋 Добро пожаловать! Вы зарегистрированы как сотрудник. Используйте меню для работы с заявками.",
+                reply_markup=get_main_menu_keyboard(False)
+            )
+        else:
+            # Если пользователь уже есть, приветствуем его
+            role = "администратор" if user.is_admin else "сотрудник"
+            await outbox.reply_text(
+                update.message,
+                f"👋 Здравствуйте, {role}! Для работы с заявками используйте меню ниже.",
+                reply_markup=get_main_menu_keyboard(user.is_admin)
+            )
+
+    except Exception as e:
+        # Если что-то пошло не так, пишем в лог и сообщаем пользователю
+        logger.exception(f"Ошибка в start: {e}")
+        await outbox.reply_text(update.message, "Произошла ошибка при запуске. Попробуйте ещё раз или обратитесь к администратору.")
+
+# Обработчик команды /help
+@timed_handler
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        user = await run_db(get_user, update.effective_user.id)
+        is_admin = user.is_admin if user else False
+
+        if is_admin:
+            help_text = (
+                "ℹ️ <b>Справка администратора</b>\n\n"
+                "• Создавайте заявки через '📝 Создать заявку'\n"
+                "• Просматривайте все заявки через '📋 Активные заявки'\n"
+                "• Смотрите выполненные и отменённые заявки через соответствующие пункты меню\n"
+                "• Для помощи используйте кнопку '❓ Помощь'\n\n"
+                "Доступные команды:\n/start — начать заново\n/help — справка\n/search — поиск заявок\n/stats — статистика\n/export — выгрузка заявок\n/import — загрузка заявок из таблицы\n/cancel — отменить действие"
+            )
+        else:
+            help_text = (
+                "ℹ️ <b>Справка пользователя</b>\n\n"
+                "• Просматривайте все активные заявки через '📋 Активные заявки'\n"
+                "• Принимайте или отклоняйте заявки\n"
+                "• Смотрите выполненные и отменённые заявки через соответствующие пункты меню\n"
+                "• Для помощи используйте кнопку '❓ Помощь'\n\n"
+                "Доступные команды:\n/start — начать заново\n/help — справка\n/search — поиск заявок\n/cancel — отменить действие"
+            )
+
+        await outbox.reply_text(
+            update.message,
+            help_text,
+            parse_mode='HTML',
+            reply_markup=get_main_menu_keyboard(is_admin)
+        )
+    except Exception as e:
+        logger.exception(f"Ошибка в help: {e}")
+        await outbox.reply_text(update.message, "Произошла ошибка при загрузке справки. Попробуйте позже.")
+
+# Обработчик создания заявки
+@timed_handler
+async def create_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        user = await run_db(get_user, update.effective_user.id)
+
+        # Проверяем, админ ли пользователь
+        if not user or not user.is_admin:
+            await outbox.reply_text(
+                update.message,
+                "Доступ к созданию заявок разрешён только администраторам. Если вам нужна помощь, обратитесь к администратору.",
+                reply_markup=get_main_menu_keyboard(False)
+            )
+            return ConversationHandler.END
+
+        # Очищаем старые данные
+        context.user_data.clear()
+
+        # Просим ввести название оборудования
+        await outbox.reply_text(
+            update.message,
+            "Введите, пожалуйста, название оборудования или материала:"
+        )
+        return EQUIPMENT
+
+    except Exception as e:
+        logger.exception(f"Ошибка в create_request: {e}")
+        await outbox.reply_text(update.message, "Произошла ошибка при создании заявки. Попробуйте позже.")
+        return ConversationHandler.END
+
+# Обработчик ввода оборудования
+@timed_handler
+async def equipment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        # Проверяем, не отменил ли пользователь
+        if update.message.text == "❌ Отмена":
+            return await cancel(update, context)
+
+        # Сохраняем название оборудования
+        context.user_data['equipment'] = update.message.text
+
+        # Просим ввести количество
+        await outbox.reply_text(
+            update.message,
+            "Пожалуйста, введите количество (целое число больше нуля):"
+        )
+        return QUANTITY
+
+    except Exception as e:
+        logger.exception(f"Ошибка в equipment: {e}")
+        await outbox.reply_text(update.message, "Произошла ошибка. Попробуйте ещё раз.")
+        return ConversationHandler.END
+
+# Обработчик ввода количества
+@timed_handler
+async def quantity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        if update.message.text == "❌ Отмена":
+            return await cancel(update, context)
+
+        # Проверяем, что введено целое число больше нуля
+        try:
+            context.user_data['quantity'] = parse_quantity(update.message.text)
+        except ValidationError as e:
+            await outbox.reply_text(update.message, f"Пожалуйста, {e}:")
+            return QUANTITY
+
+        await outbox.reply_text(
+            update.message,
+            "Теперь опишите, пожалуйста, суть заявки:"
+        )
+        return DESCRIPTION
+
+    except Exception as e:
+        logger.exception(f"Ошибка в quantity: {e}")
+        await outbox.reply_text(update.message, "Произошла ошибка. Попробуйте ещё раз.")
+        return ConversationHandler.END
+
+# Обработчик ввода описания
+@timed_handler
+async def description(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        if update.message.text == "❌ Отмена":
+            return await cancel(update, context)
+
+        # Сохраняем описание
+        context.user_data['description'] = update.message.text
+
+        # Показываем кнопки выбора приоритета
+        high, medium, low = PRIORITY_BUTTONS
+        keyboard = [
+            [high, medium],
+            [low, "❌ Отмена"]
+        ]
+        await outbox.reply_text(
+            update.message,
+            "Выберите приоритет заявки: 🔴 Высокий, 🟡 Средний или 🟢 Низкий.",
+            reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        )
+        return PRIORITY
+
+    except Exception as e:
+        logger.exception(f"Ошибка в description: {e}")
+        await outbox.reply_text(update.message, "Произошла ошибка. Попробуйте ещё раз.")
+        return ConversationHandler.END
+
+# Обработчик выбора приоритета
+@timed_handler
+async def priority(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        if update.message.text == "❌ Отмена":
+            return await cancel(update, context)
+
+        # Преобразуем текст приоритета в значение для базы данных
+        try:
+            context.user_data['priority'] = parse_priority(update.message.text)
+        except ValidationError as e:
+            await outbox.reply_text(update.message, f"Пожалуйста, {e}.")
+            return PRIORITY
+
+        # Сохраняем заявку в базу данных
+        user, request_id = await run_db(save_request, update.effective_user.id, dict(context.user_data))
+        if not user:
+            await outbox.reply_text(update.message, "Пользователь не найден в системе.")
+            return ConversationHandler.END
+
+        # Рассылка сотрудникам идёт в фоне и не задерживает ответ
+        notification_pipeline.notify(request_id)
+        inline_cache.clear()
+
+        # Очищаем данные
+        context.user_data.clear()
+
+        await outbox.reply_text(
+            update.message,
+            "Ваша заявка успешно создана и появится в списке активных заявок.",
+            reply_markup=get_main_menu_keyboard(user.is_admin)
+        )
+        return ConversationHandler.END
+
+    except Exception as e:
+        logger.exception(f"Ошибка в priority: {e}")
+        await outbox.reply_text(update.message, "Произошла ошибка при сохранении заявки. Попробуйте позже.")
+        return ConversationHandler.END
+
+# Обработчик команды /import: администратор присылает таблицу с заявками
+@timed_handler
+async def import_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        user = await run_db(get_user, update.effective_user.id)
+        if not user or not user.is_admin:
+            await outbox.reply_text(update.message, "🔒 Импорт заявок доступен только администраторам.")
+            return ConversationHandler.END
+
+        await outbox.reply_text(
+            update.message,
+            "📥 Пришлите файл CSV или XLSX с заявками.\n\n"
+            "В первой строке - названия колонок: Оборудование, Количество, Описание, Приоритет "
+            "и, по желанию, Заметки. Каждая следующая строка - одна заявка. "
+            "Приоритет: Высокий, Средний или Низкий.\n\n"
+            "Для отмены отправьте /cancel.",
+            reply_markup=ReplyKeyboardRemove()
+        )
+        return IMPORT_FILE
+
+    except Exception as e:
+        logger.exception(f"Ошибка в import_start: {e}")
+        await outbox.reply_text(update.message, "Произошла ошибка. Попробуйте ещё раз.")
+        return ConversationHandler.END
+
+# Текст отчёта об импорте: сколько заявок добавлено и ошибки по строкам
+def format_import_report(created, errors):
+    lines = [f"📥 Импорт заявок: добавлено {created}, строк с ошибками {len(errors)}."]
+    if errors:
+        lines.append("")
+        lines.extend(f"Строка {number}: {problem}" for number, problem in errors[:IMPORT_REPORT_LIMIT])
+        if len(errors) > IMPORT_REPORT_LIMIT:
+            lines.append(f"…и ещё {len(errors) - IMPORT_REPORT_LIMIT}")
+    return '\n'.join(lines)
+
+# Обработчик файла с заявками: проверяет все строки и сохраняет корректные одним пакетом
+@timed_handler
+async def import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        document = update.message.document
+        if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+            await outbox.reply_text(update.message, "Файл слишком большой. Пришлите файл до 20 МБ.")
+            return IMPORT_FILE
+
+        with tempfile.TemporaryDirectory() as directory:
+            # Расширение файла определяет формат, поэтому имя берём из присланного документа
+            path = os.path.join(directory, os.path.basename(document.file_name or 'requests.csv'))
+            telegram_file = await document.get_file()
+            await telegram_file.download_to_drive(path)
+            try:
+                requests, errors = await run_db(read_import_file, path, IMPORT_MAX_ROWS)
+            except ImportFileError as e:
+                await outbox.reply_text(update.message, f"⚠️ Файл не импортирован: {e}.")
+                return IMPORT_FILE
+
+        request_ids = await run_db(import_requests, update.effective_user.id, requests) if requests else []
+        if request_ids is None:
+            await outbox.reply_text(update.message, "Пользователь не найден в системе.")
+            return ConversationHandler.END
+
+        # Новые заявки рассылаются сотрудникам так же, как созданные через диалог
+        for request_id in request_ids:
+            notification_pipeline.notify(request_id)
+        if request_ids:
+            inline_cache.clear()
+
+        await outbox.reply_text(
+            update.message,
+            format_import_report(len(request_ids), errors),
+            reply_markup=get_main_menu_keyboard(True)
+        )
+        return ConversationHandler.END
+
+    except Exception as e:
+        logger.exception(f"Ошибка в import_file: {e}")
+        await outbox.reply_text(
+            update.message,
+            "Произошла ошибка при импорте заявок. Попробуйте позже.",
+            reply_markup=get_main_menu_keyboard(True)
+        )
+        return ConversationHandler.END
+
+# Обработчик отмены
+@timed_handler
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        user = await run_db(get_user, update.effective_user.id)
+
+        # Очищаем данные
+        context.user_data.clear()
+
+        await outbox.reply_text(
+            update.message,
+            "Создание заявки отменено. Вы можете начать заново в любое время.",
+            reply_markup=get_main_menu_keyboard(user.is_admin if user else False)
+        )
+        return ConversationHandler.END
+
+    except Exception as e:
+        logger.exception(f"Ошибка в cancel: {e}")
+        await outbox.reply_text(update.message, "Произошла ошибка. Попробуйте ещё раз.")
+        return ConversationHandler.END
+
+# Обработчик просмотра активных заявок (не выполненных и не удаленных)
+@timed_handler
+async def list_active_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = None
+    try:
+        user = await run_db(get_user, update.effective_user.id)
+
+        if not user:
+            await outbox.reply_text(
+                update.message,
+                "У вас нет активных заявок.",
+                reply_markup=get_main_menu_keyboard(False)
+            )
+            return
+
+        # Показываем первую страницу активных заявок одним сообщением
+        await send_requests_page(update, 'active', user.is_admin)
+
+    except Exception as e:
+        logger.exception(f"Ошибка в list_active_requests: {e}")
+        await outbox.reply_text(
+            update.message,
+            "Произошла ошибка при получении списка заявок. Попробуйте позже.",
+            reply_markup=get_main_menu_keyboard(user.is_admin if user else False)
+        )
+
+# Обработчик просмотра выполненных заявок
+@timed_handler
+async def show_completed_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        user = await run_db(get_user, update.effective_user.id)
+
+        if not user or not user.is_admin:
+            await outbox.reply_text(
+                update.message,
+                "Доступ к выполненным заявкам разрешён только администраторам.",
+                reply_markup=get_main_menu_keyboard(False)
+            )
+            return
+
+        # Показываем первую страницу выполненных заявок за срок хранения
+        await send_requests_page(update, 'completed', True)
+
+    except Exception as e:
+        logger.exception(f"Ошибка в show_completed_requests: {e}")
+        await outbox.reply_text(update.message, "Произошла ошибка при получении выполненных заявок. Попробуйте позже.")
+
+# Обработчик просмотра отмененных заявок
+@timed_handler
+async def show_cancelled_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        user = await run_db(get_user, update.effective_user.id)
+
+        if not user or not user.is_admin:
+            await outbox.reply_text(
+                update.message,
+                "Доступ к отменённым заявкам разрешён только администраторам.",
+                reply_markup=get_main_menu_keyboard(False)
+            )
+            return
+
+        # Показываем первую страницу отмененных заявок за срок хранения
+        await send_requests_page(update, 'cancelled', True)
+
+    except Exception as e:
+        logger.exception(f"Ошибка в show_cancelled_requests: {e}")
+        await outbox.reply_text(update.message, "Произошла ошибка при получении отменённых заявок. Попробуйте позже.")
+
+# Отправляет первую страницу списка заявок новым сообщением
+async def send_requests_page(update, view, is_admin):
+    page = await run_db(load_page, view)
+
+    if not page[0]:
+        await outbox.reply_text(
+            update.message,
+            VIEW_EMPTY_TEXTS[view],
+            reply_markup=get_main_menu_keyboard(is_admin)
+        )
+        return
+
+    text, reply_markup, shown_ids = build_page_message(view, page, is_admin)
+    message = await outbox.reply_text(
+        update.message,
+        text,
+        parse_mode='HTML',
+        reply_markup=reply_markup
+    )
+    # Запоминаем страницу, чтобы обновлять её при смене статуса показанных заявок
+    await run_db(register_page_cards, message.chat_id, message.message_id, view, None, False, shown_ids)
+
+# Обработчик кнопок ◀/▶: перелистывает список заявок в том же сообщении
+@timed_handler
+async def handle_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, callback):
+    try:
+        query = update.callback_query
+        await query.answer()
+
+        # Аргумент кнопки - id граничной заявки, доп. поле - список и направление
+        view, backwards = parse_page_callback(callback)
+        cursor_id = callback.arg
+
+        user = await run_db(get_user, update.effective_user.id)
+        if not user or (view != 'active' and not user.is_admin):
+            await outbox.edit_message_text(query, "🔒 Доступ ограничен\n\nЭтот список доступен только администраторам.")
+            return
+
+        page = await run_db(load_page, view, cursor_id, backwards)
+        if not page[0]:
+            await run_db(forget_cards, query.message.chat_id, query.message.message_id)
+            await outbox.edit_message_text(query, VIEW_EMPTY_TEXTS[view])
+            return
+
+        text, reply_markup, shown_ids = build_page_message(view, page, user.is_admin)
+        await run_db(
+            register_page_cards, query.message.chat_id, query.message.message_id, view, cursor_id, backwards, shown_ids
+        )
+        try:
+            await outbox.edit_message_text(query, text, parse_mode='HTML', reply_markup=reply_markup)
+        except BadRequest as e:
+            # Страница не изменилась - редактировать нечего
+            if 'not modified' not in str(e):
+                raise
+
+    except Exception as e:
+        logger.exception(f"Ошибка в handle_page_callback: {e}")
+        await outbox.edit_message_text(query, "😔 Произошла ошибка при получении списка заявок. Пожалуйста, попробуйте позже.")
+
+# Обработчик команды /search <слова>: поиск заявок по оборудованию, описанию и заметкам
+@timed_handler
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        user = await run_db(get_user, update.effective_user.id)
+        if not user:
+            await outbox.reply_text(update.message, "Сначала зарегистрируйтесь командой /start.")
+            return
+
+        query_text = ' '.join(context.args).strip()
+        if not search_terms(query_text):
+            await outbox.reply_text(
+                update.message,
+                "🔍 Укажите, что искать, например: /search дрель",
+                reply_markup=get_main_menu_keyboard(user.is_admin)
+            )
+            return
+
+        page = await run_db(search_requests, query_text, user.is_admin)
+        if not page[0]:
+            await outbox.reply_text(
+                update.message,
+                "По вашему запросу заявок не найдено.",
+                reply_markup=get_main_menu_keyboard(user.is_admin)
+            )
+            return
+
+        # Запрос запоминаем для листания результатов кнопками ◀/▶
+        context.user_data['search_query'] = query_text
+        text, reply_markup = build_search_message(query_text, 0, page, user.is_admin)
+        await outbox.reply_text(update.message, text, parse_mode='HTML', reply_markup=reply_markup)
+
+    except Exception as e:
+        logger.exception(f"Ошибка в search_command: {e}")
+        await outbox.reply_text(update.message, "Произошла ошибка при поиске заявок. Попробуйте позже.")
+
+# Обработчик кнопок ◀/▶ в результатах поиска
+@timed_handler
+async def handle_search_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, callback):
+    try:
+        query = update.callback_query
+        await query.answer()
+
+        # Аргумент кнопки - смещение в результатах поиска
+        offset = callback.arg
+        query_text = context.user_data.get('search_query')
+        user = await run_db(get_user, update.effective_user.id)
+        if not user or not query_text:
+            await outbox.edit_message_text(query, "🔍 Результаты поиска устарели. Повторите поиск командой /search.")
+            return
+
+        page = await run_db(search_requests, query_text, user.is_admin, offset)
+        if not page[0]:
+            await outbox.edit_message_text(query, "По вашему запросу заявок не найдено.")
+            return
+
+        text, reply_markup = build_search_message(query_text, offset, page, user.is_admin)
+        try:
+            await outbox.edit_message_text(query, text, parse_mode='HTML', reply_markup=reply_markup)
+        except BadRequest as e:
+            # Страница не изменилась - редактировать нечего
+            if 'not modified' not in str(e):
+                raise
+
+    except Exception as e:
+        logger.exception(f"Ошибка в handle_search_callback: {e}")
+        await outbox.edit_message_text(query, "😔 Произошла ошибка при поиске заявок. Пожалуйста, попробуйте позже.")
+
+# Обработчик inline-запросов (@бот #123 или @бот дрель). Ответы кэшируются на стороне Telegram
+# (cache_time, is_personal) и в боте. Пока пользователь печатает, промежуточные запросы
+# не доходят до БД: отвечает только запрос, после которого была пауза INLINE_DEBOUNCE
+@timed_handler
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query
+    telegram_id = query.from_user.id
+    query_text = ' '.join(query.query.split())
+    try:
+        if not query_text:
+            await query.answer([], cache_time=INLINE_CACHE_TIME, is_personal=True)
+            return
+
+        key = (telegram_id, query_text.lower())
+        results = inline_cache.get(key)
+        if results is None:
+            sequence = inline_sequences.get(telegram_id, 0) + 1
+            inline_sequences[telegram_id] = sequence
+            await asyncio.sleep(INLINE_DEBOUNCE)
+            if inline_sequences.get(telegram_id) != sequence:
+                # Пользователь продолжил печатать - ответит более новый запрос
+                return
+            del inline_sequences[telegram_id]
+
+            found = await run_db(inline_lookup, telegram_id, query_text)
+            results = [
+                InlineQueryResultArticle(
+                    id=str(request_id),
+                    title=f"#{request_id} · {equipment_name}",
+                    description=f"{get_status_emoji(status)} {STATUS_LABELS.get(status, status)}",
+                    input_message_content=InputTextMessageContent(text, parse_mode='HTML'),
+                )
+                for request_id, status, equipment_name, text in found
+            ]
+            inline_cache.put(key, results)
+
+        await query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True)
+
+    except Exception as e:
+        logger.exception(f"Ошибка в inline_query: {e}")
+
+# Обработчик команды /stats: сводная статистика по заявкам для администраторов
+@timed_handler
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        user = await run_db(get_user, update.effective_user.id)
+        if not user or not user.is_admin:
+            await outbox.reply_text(update.message, "🔒 Статистика доступна только администраторам.")
+            return
+
+        stats = await run_db(load_request_stats)
+        await outbox.reply_text(
+            update.message,
+            format_request_stats(stats, RETENTION_DAYS),
+            parse_mode='HTML',
+            reply_markup=get_main_menu_keyboard(True)
+        )
+    except Exception as e:
+        logger.exception(f"Ошибка в stats_command: {e}")
+        await outbox.reply_text(update.message, "Произошла ошибка при получении статистики. Попробуйте позже.")
+
+# Обработчик команды /export [csv|xlsx] [ГГГГ-ММ]: выгрузка заявок файлом для администраторов
+@timed_handler
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        user = await run_db(get_user, update.effective_user.id)
+        if not user or not user.is_admin:
+            await outbox.reply_text(update.message, "🔒 Выгрузка заявок доступна только администраторам.")
+            return
+
+        export_format, month = 'csv', None
+        for arg in context.args:
+            if arg.lower() in EXPORT_FORMATS:
+                export_format = arg.lower()
+            elif re.fullmatch(r'\d{4}-\d{2}', arg):
+                month = arg
+            else:
+                await outbox.reply_text(
+                    update.message,
+                    "📤 Использование: /export [csv|xlsx] [ГГГГ-ММ]\nНапример: /export xlsx 2024-05"
+                )
+                return
+        since, until = month_range(month) if month else (None, None)
+
+        caption = ""
+        if export_format == 'xlsx' and not xlsx_available():
+            # На сервере нет openpyxl - выгружаем в CSV, его тоже открывает Excel
+            export_format = 'csv'
+            caption = "⚠️ XLSX недоступен на сервере (не установлен openpyxl), файл выгружен в CSV.\n"
+
+        filename = f"requests_{month or 'all'}.{export_format}"
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, filename)
+            count = await run_export(export_to_file, path, export_format, since, until)
+            if count == 0:
+                await outbox.reply_text(update.message, "Заявок для выгрузки не найдено.")
+                return
+            # Файл читается целиком до отправки: повтор после 429 загрузит то же содержимое,
+            # а не остаток уже прочитанного файла
+            with open(path, 'rb') as file:
+                document = InputFile(file, filename=filename)
+        await outbox.send(
+            update.message.chat_id, update.message.reply_document, document,
+            caption=f"{caption}📤 Выгружено заявок: {count}"
+        )
+
+    except Exception as e:
+        logger.exception(f"Ошибка в export_command: {e}")
+        await outbox.reply_text(update.message, "Произошла ошибка при выгрузке заявок. Попробуйте позже.")
+
+# Обработчик нажатий на кнопки меню
+@timed_handler
+async def handle_menu_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        if update.message.text == "📝 Создать заявку":
+            return await create_request(update, context)
+        elif update.message.text == "📋 Активные заявки":
+            return await list_active_requests(update, context)
+        elif update.message.text == "📋 Мои заявки":
+            return await list_active_requests(update, context)
+        elif update.message.text == "✅ Выполненные заявки":
+            return await show_completed_requests(update, context)
+        elif update.message.text == "❌ Отмененные заявки":
+            return await show_cancelled_requests(update, context)
+        elif update.message.text == "❓ Помощь":
+            return await help_command(update, context)
+        else:
+            await outbox.reply_text(
+                update.message,
+                "Команда не распознана. Пожалуйста, используйте меню или кнопку '❓ Помощь'."
+            )
+    except Exception as e:
+        logger.exception(f"Ошибка в handle_menu_click: {e}")
+        await outbox.reply_text(update.message, "Произошла ошибка при обработке команды. Попробуйте позже.")
+
+# Обработчик кнопок действий с заявкой: принять, отменить, восстановить, удалить
+@timed_handler
+async def handle_request_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, callback):
+    try:
+        query = update.callback_query
+        await query.answer()
+
+        # Вся работа с базой выполняется в потоке БД
+        text, parse_mode, changed_id = await run_db(
+            process_callback, update.effective_user.id, REQUEST_ACTIONS[callback.opcode], callback.arg
+        )
+
+        # Сообщение с кнопкой заменяется результатом действия и больше не показывает заявки
+        if query.message is not None:
+            await run_db(forget_cards, query.message.chat_id, query.message.message_id)
+        # Остальные сообщения с этой заявкой обновятся в фоне
+        if changed_id is not None:
+            card_updater.mark_changed(changed_id)
+            inline_cache.clear()
+
+        await outbox.edit_message_text(query, text, parse_mode=parse_mode)
+
+    except Exception as e:
+        logger.exception(f"Ошибка в handle_request_callback: {e}")
+        await outbox.edit_message_text(query, "😔 Произошла ошибка при выполнении действия. Пожалуйста, попробуйте позже.")
+
+# Обработчики inline-кнопок по коду операции из callback_data
+CALLBACK_HANDLERS = {
+    **{opcode: handle_request_callback for opcode in REQUEST_ACTIONS},
+    OP_PAGE: handle_page_callback,
+    OP_SEARCH: handle_search_callback,
+}
+
+# Ответы на кнопки, не прошедшие проверку
+CALLBACK_REJECT_TEXTS = {
+    'stale': "⌛ Кнопка устарела. Откройте список заново.",
+    'forged': "😔 Неизвестное действие. Пожалуйста, попробуйте еще раз.",
+    'malformed': "😔 Неизвестное действие. Пожалуйста, попробуйте еще раз.",
+}
+
+# Обработчик для inline кнопок: проверяет подпись и срок callback_data и передаёт кнопку
+# обработчику её операции. Устаревшие и поддельные кнопки отклоняются без обращения к БД
+async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    try:
+        callback = decode_callback(query.data)
+    except CallbackDataError as e:
+        logger.warning(f"Отклонена кнопка ({e.reason}) от пользователя {update.effective_user.id}: {query.data!r:.80}")
+        await query.answer(CALLBACK_REJECT_TEXTS[e.reason], show_alert=True)
+        return
+    await CALLBACK_HANDLERS[callback.opcode](update, context, callback)
+
+# Фоновая рассылка новых заявок сотрудникам. Обработчик только ставит заявку в очередь,
+# а рассылка идёт пачками получателей с ограничением числа одновременных отправок
+class NotificationPipeline:
+    def __init__(self, batch_size, concurrency):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.sent = 0
+        self.failed = 0
+        self._bot = None
+        self._queue = None
+        self._task = None
+
+    def start(self, bot):
+        self._bot = bot
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # Ставит новую заявку в очередь на рассылку
+    def notify(self, request_id):
+        if self._queue is None:
+            logger.warning(f"Рассылка не запущена, уведомление о заявке #{request_id} пропущено")
+            return
+        self._queue.put_nowait(request_id)
+
+    async def _run(self):
+        # Сначала продолжаем рассылки, прерванные перезапуском бота
+        try:
+            for request_id in await run_db(load_unfinished_fan_outs):
+                self._queue.put_nowait(request_id)
+        except Exception as e:
+            logger.exception(f"Не удалось загрузить незавершённые рассылки: {e}")
+        while True:
+            request_id = await self._queue.get()
+            try:
+                await self._fan_out(request_id)
+            except Exception as e:
+                logger.exception(f"Ошибка рассылки заявки #{request_id}: {e}")
+
+    async def _fan_out(self, request_id):
+        after_user_id = await run_db(begin_fan_out, request_id)
+        if after_user_id is None:
+            # Рассылка уже завершена (заявка попала в очередь дважды)
+            return
+        card = await run_db(load_request_card, request_id)
+        if card is None or card[0] not in ('new', 'in_progress'):
+            # Заявку уже удалили или обработали - рассылать нечего
+            await run_db(finish_fan_out, request_id)
+            return
+        status, text = card
+        text = "🔔 <b>Новая заявка</b>\n\n" + text
+        buttons = get_request_buttons('active', request_id, status, False)
+        reply_markup = InlineKeyboardMarkup([buttons]) if buttons else None
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        while True:
+            batch = await run_db(create_delivery_batch, request_id, after_user_id, self.batch_size)
+            if not batch:
+                break
+            results = await asyncio.gather(*[
+                self._deliver(semaphore, delivery_id, telegram_id, text, reply_markup)
+                for delivery_id, _, telegram_id in batch
+            ])
+            sent_messages = [
+                (telegram_id, result['message_id'])
+                for result, (_, _, telegram_id) in zip(results, batch) if result['status'] == 'sent'
+            ]
+            after_user_id = batch[-1][1]
+            await run_db(record_delivery_results, request_id, results, sent_messages, after_user_id)
+        await run_db(finish_fan_out, request_id)
+
+    # Отправляет карточку одному сотруднику и возвращает результат для журнала доставки.
+    # Рассылка идёт с низким приоритетом и не задерживает ответы на нажатия кнопок
+    async def _deliver(self, semaphore, delivery_id, telegram_id, text, reply_markup):
+        async with semaphore:
+            try:
+                message = await outbox.send_message(
+                    self._bot, telegram_id, text, background=True, parse_mode='HTML', reply_markup=reply_markup
+                )
+                self.sent += 1
+                return {'id': delivery_id, 'status': 'sent', 'message_id': message.message_id,
+                        'error': None, 'sent_at': datetime.now(timezone.utc)}
+            except Exception as e:
+                self.failed += 1
+                return {'id': delivery_id, 'status': 'failed', 'message_id': None,
+                        'error': str(e), 'sent_at': None}
+
+notification_pipeline = NotificationPipeline(
+    batch_size=int(os.getenv('NOTIFY_BATCH_SIZE', '100')),
+    concurrency=int(os.getenv('NOTIFY_CONCURRENCY', '20')),
+)
+
+# Обновляет на месте уже отправленные карточки заявок после смены статуса.
+# Изменения копятся CARD_UPDATE_DELAY секунд и применяются одной пачкой
+class CardUpdater:
+    def __init__(self, delay):
+        self.delay = delay
+        self.edited = 0
+        self._bot = None
+        self._pending = set()
+        self._wakeup = None
+        self._task = None
+
+    def start(self, bot):
+        self._bot = bot
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # Отмечает, что заявка изменилась и её карточки нужно обновить
+    def mark_changed(self, request_id):
+        if self._wakeup is None:
+            return
+        self._pending.add(request_id)
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Ждём, чтобы собрать в одну пачку изменения, пришедшие почти одновременно
+            await asyncio.sleep(self.delay)
+            self._wakeup.clear()
+            request_ids, self._pending = self._pending, set()
+            try:
+                updates = await run_db(build_card_updates, request_ids)
+                await asyncio.gather(*[self._edit(*card_update) for card_update in updates])
+            except Exception as e:
+                logger.exception(f"Ошибка обновления карточек заявок: {e}")
+
+    # Правки карточек идут с низким приоритетом, как и рассылка
+    async def _edit(self, chat_id, message_id, text, reply_markup):
+        try:
+            await outbox.edit_background(
+                chat_id, message_id, self._bot.edit_message_text, text,
+                chat_id=chat_id, message_id=message_id, parse_mode='HTML', reply_markup=reply_markup
+            )
+            self.edited += 1
+        except BadRequest as e:
+            if 'not modified' in str(e):
+                return
+            # Сообщение удалено или его больше нельзя редактировать - забываем его
+            logger.warning(f"Не удалось обновить карточку {chat_id}/{message_id}: {e}")
+            await run_db(forget_cards, chat_id, message_id)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить карточку {chat_id}/{message_id}: {e}")
+
+card_updater = CardUpdater(delay=CARD_UPDATE_DELAY)
+
+# Периодическая задача очистки старых отмененных и выполненных заявок
+async def retention_job(context: ContextTypes.DEFAULT_TYPE):
+    started = time.monotonic()
+    try:
+        removed = await run_db(purge_expired_requests)
+        logger.info(
+            f"Очистка старых заявок: удалено {removed['cancelled'] + removed['completed']} "
+            f"(отменённых {removed['cancelled']}, выполненных {removed['completed']}), "
+            f"записей об уведомлениях {removed['notifications']}, карточек {removed['cards']} "
+            f"за {time.monotonic() - started:.2f} с"
+        )
+    except Exception as e:
+        logger.exception(f"Ошибка при автоматической очистке старых заявок: {e}")
+
+# Периодическая сверка сводной статистики
+async def stats_reconcile_job(context: ContextTypes.DEFAULT_TYPE):
+    started = time.monotonic()
+    try:
+        drift = await run_db(reconcile_request_stats)
+        if drift is None:
+            logger.warning("Сверка статистики заявок отложена: заявки менялись во время пересчёта")
+            return
+        log = logger.warning if drift else logger.info
+        log(f"Сверка статистики заявок: расхождений {drift}, за {time.monotonic() - started:.2f} с")
+    except Exception as e:
+        logger.exception(f"Ошибка при сверке статистики заявок: {e}")
+
+# Периодическая запись состояния диалогов на диск одной пачкой
+async def flush_persistence_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await context.application.persistence.flush()
+    except Exception as e:
+        logger.exception(f"Ошибка при сохранении состояния диалогов: {e}")
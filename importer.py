@@ -0,0 +1,113 @@
+import csv
+import os
+
+from validation import ValidationError, parse_text, parse_quantity, parse_priority
+
+try:
+    from openpyxl import load_workbook
+except ImportError:  # Импорт из XLSX необязателен, CSV работает и без openpyxl
+    load_workbook = None
+
+IMPORT_FORMATS = ('csv', 'xlsx')
+
+# Колонки таблицы: названия в заголовке (как в выгрузке /export или по-английски) -> поле заявки
+IMPORT_COLUMNS = {
+    'оборудование': 'equipment',
+    'equipment': 'equipment',
+    'количество': 'quantity',
+    'quantity': 'quantity',
+    'описание': 'description',
+    'description': 'description',
+    'приоритет': 'priority',
+    'priority': 'priority',
+    'заметки': 'notes',
+    'notes': 'notes',
+}
+REQUIRED_COLUMNS = ('equipment', 'quantity', 'description', 'priority')
+
+# Проверка каждого обязательного поля и его название в отчёте об ошибках
+FIELD_PARSERS = [
+    ('equipment', 'оборудование', parse_text),
+    ('quantity', 'количество', parse_quantity),
+    ('description', 'описание', parse_text),
+    ('priority', 'приоритет', parse_priority),
+]
+
+# Файл нельзя импортировать целиком: неизвестный формат, нет нужных колонок, слишком много строк
+class ImportFileError(Exception):
+    pass
+
+# CSV по умолчанию, если разделитель не удалось определить (так сохраняет русский Excel)
+class SemicolonDialect(csv.excel):
+    delimiter = ';'
+
+# Строки CSV. Разделитель (; , или табуляция) определяется по началу файла.
+# Excel в русской локали сохраняет CSV в cp1251, поэтому она - запасная кодировка
+def read_csv_rows(path):
+    for encoding in ('utf-8-sig', 'cp1251'):
+        try:
+            with open(path, newline='', encoding=encoding) as f:
+                sample = f.read(4096)
+                f.seek(0)
+                try:
+                    dialect = csv.Sniffer().sniff(sample, delimiters=';,\t')
+                except csv.Error:
+                    dialect = SemicolonDialect
+                return list(csv.reader(f, dialect))
+        except UnicodeDecodeError:
+            continue
+    raise ImportFileError("не удалось определить кодировку файла, сохраните его в UTF-8")
+
+# Строки первого листа XLSX
+def read_xlsx_rows(path):
+    if load_workbook is None:
+        raise ImportFileError("импорт из XLSX недоступен (не установлен openpyxl), пришлите CSV")
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        return [list(row) for row in workbook.worksheets[0].iter_rows(values_only=True)]
+    finally:
+        workbook.close()
+
+# Проверяет строки таблицы по правилам диалога создания заявки.
+# Возвращает (заявки [{поле: значение}], ошибки [(номер строки, текст)])
+def validate_rows(rows, max_rows):
+    if not rows:
+        raise ImportFileError("файл пуст")
+
+    header = [IMPORT_COLUMNS.get(str(cell).strip().lower()) if cell is not None else None for cell in rows[0]]
+    if any(column not in header for column in REQUIRED_COLUMNS):
+        raise ImportFileError(
+            "в первой строке должны быть колонки Оборудование, Количество, Описание и Приоритет"
+        )
+    positions = {field: header.index(field) for field in set(header) if field}
+
+    data = [(number, row) for number, row in enumerate(rows[1:], start=2) if any(
+        cell is not None and str(cell).strip() for cell in row
+    )]
+    if len(data) > max_rows:
+        raise ImportFileError(f"слишком много заявок в файле: {len(data)}, можно не больше {max_rows}")
+
+    requests, errors = [], []
+    for number, row in data:
+        cells = {field: row[position] if position < len(row) else None for field, position in positions.items()}
+        request, problems = {}, []
+        for field, title, parse in FIELD_PARSERS:
+            try:
+                request[field] = parse(cells[field])
+            except ValidationError as e:
+                problems.append(f"{title}: {e}")
+        notes = cells.get('notes')
+        request['notes'] = (str(notes).strip() or None) if notes is not None else None
+        if problems:
+            errors.append((number, '; '.join(problems)))
+        else:
+            requests.append(request)
+    return requests, errors
+
+# Читает и проверяет файл с заявками. Формат определяется по расширению
+def read_import_file(path, max_rows):
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    if extension not in IMPORT_FORMATS:
+        raise ImportFileError("поддерживаются только файлы CSV и XLSX")
+    rows = read_xlsx_rows(path) if extension == 'xlsx' else read_csv_rows(path)
+    return validate_rows(rows, max_rows)
@@ -0,0 +1,777 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Tasker', 'username': 'tasker_loadtest_bot'}
+# Telegram ID синтетических пользователей: сначала администраторы, затем сотрудники
+FIRST_USER_ID = 100000
+PRIORITY_TEXTS = ("🔴 Высокий", "🟡 Средний", "🟢 Низкий")
+# Модули бота, время импорта которых показывает замер запуска
+STARTUP_MODULES = ('models', 'database', 'services', 'handlers', 'bot')
+# Выполняется в новом интерпретаторе: импорт бота, миграция схемы и сборка приложения -
+# всё, что делает main() до приёма обновлений
+STARTUP_SCRIPT = '''
+import json, time
+started = time.perf_counter()
+import bot, database
+imported = time.perf_counter()
+database.migrate(database.get_engine())
+migrated = time.perf_counter()
+bot.build_application()
+built = time.perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1000, 'migrate_ms': (migrated - imported) * 1000,
+                  'build_ms': (built - migrated) * 1000, 'ready_ms': (built - started) * 1000}))
+'''
+# То, что нужно manage_admins.py и export.py: модели и движок БД, без Telegram
+SCRIPT_IMPORT = 'import models, database, sys; print(int("telegram" in sys.modules))'
+
+# Транспорт Bot API, который отвечает на все вызовы локально, как ответил бы Telegram
+class FakeBotApi(BaseRequest):
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        parameters = request_data.parameters if request_data is not None else {}
+        return 200, json.dumps({'ok': True, 'result': self._result(endpoint, parameters)}).encode()
+
+    def _result(self, endpoint, parameters):
+        if endpoint == 'getMe':
+            return BOT_USER
+        if 'chat_id' not in parameters:
+            return True
+        message_id = parameters.get('message_id') or next(self._message_ids)
+        return {
+            'message_id': int(message_id),
+            'date': int(time.time()),
+            'chat': {'id': int(parameters['chat_id']), 'type': 'private'},
+            'from': BOT_USER,
+            'text': parameters.get('text', ''),
+        }
+
+# Задача БД с имитацией задержки сети или диска (секунды): поток спит, как при ожидании ответа СУБД
+def with_latency(fn, latency):
+    if not latency:
+        return fn
+
+    def delayed(*args, **kwargs):
+        time.sleep(latency)
+        return fn(*args, **kwargs)
+
+    return delayed
+
+# Пул потоков, который запоминает, сколько каждая задача БД ждала свободного потока
+class TimedExecutor(ThreadPoolExecutor):
+    def __init__(self, *args, latency=0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latency = latency
+        self.waits = []
+
+    def submit(self, fn, /, *args, **kwargs):
+        queued = time.perf_counter()
+        fn = with_latency(fn, self.latency)
+
+        def timed():
+            self.waits.append(time.perf_counter() - queued)
+            return fn(*args, **kwargs)
+
+        return super().submit(timed)
+
+# Исполнитель, который выполняет задачу БД сразу в вызывающем потоке, то есть в event loop.
+# Так бот работал до пула потоков БД: --inline-db замеряет задержки "до"
+class InlineExecutor(Executor):
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.waits = []
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        self.waits.append(0.0)
+        try:
+            future.set_result(with_latency(fn, self.latency)(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+# Равномерно распределяет обновления с заданной частотой (в секунду, 0 - без ограничения)
+class Pacer:
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next = time.monotonic()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(self.next, now)
+        self.next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+# Перцентиль отсортированного списка (ближайший ранг)
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))]
+
+# Перцентили задержек (секунды) в миллисекундах
+def latency_ms(values):
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50) * 1000,
+        'p95': percentile(values, 95) * 1000,
+        'p99': percentile(values, 99) * 1000,
+        'max': (values[-1] if values else 0.0) * 1000,
+    }
+
+# Обновления, обработчики которых завершились ошибкой
+def handler_errors():
+    from metrics import handler_updates
+
+    return sum(child.value for (_, outcome), child in handler_updates._children.items() if outcome == 'error')
+
+# Подаёт синтетические обновления прямо в Application.process_update и замеряет время их обработки
+class LoadTest:
+    def __init__(self, application, rate, concurrency):
+        self.application = application
+        self.pacer = Pacer(rate)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.latencies = {}
+        self.phases = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def message(self, user_id, text):
+        entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}] if text.startswith('/') else []
+        return {
+            'update_id': next(self._update_ids),
+            'message': {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'User', 'username': f'user{user_id}'},
+                'text': text,
+                'entities': entities,
+            },
+        }
+
+    def callback(self, user_id, data):
+        return {
+            'update_id': next(self._update_ids),
+            'callback_query': {
+                'id': str(next(self._update_ids)),
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'User', 'username': f'user{user_id}'},
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': next(self._message_ids),
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': BOT_USER,
+                    'text': 'card',
+                },
+            },
+        }
+
+    async def send(self, kind, data):
+        await self.pacer.wait()
+        update = Update.de_json(data, self.application.bot)
+        started = time.perf_counter()
+        await self.application.process_update(update)
+        self.latencies.setdefault(kind, []).append(time.perf_counter() - started)
+
+    # Запускает сценарии пользователей параллельно и запоминает пропускную способность фазы
+    async def run_phase(self, name, scenarios):
+        async def limited(scenario):
+            async with self.semaphore:
+                await scenario
+
+        before = sum(len(values) for values in self.latencies.values())
+        started = time.perf_counter()
+        await asyncio.gather(*[limited(scenario) for scenario in scenarios])
+        elapsed = time.perf_counter() - started
+        updates = sum(len(values) for values in self.latencies.values()) - before
+        self.phases.append({'phase': name, 'updates': updates, 'seconds': elapsed,
+                            'updates_per_second': updates / elapsed if elapsed else 0.0})
+
+    async def start(self, user_id):
+        await self.send('start', self.message(user_id, '/start'))
+
+    async def create_requests(self, user_id, count):
+        for number in range(count):
+            steps = [
+                ('create', "📝 Создать заявку"),
+                ('equipment', f"Перфоратор {user_id}-{number}"),
+                ('quantity', str(random.randint(1, 20))),
+                ('description', f"Нагрузочный тест, заявка {number} от {user_id}"),
+                ('priority', random.choice(PRIORITY_TEXTS)),
+            ]
+            for kind, text in steps:
+                await self.send(kind, self.message(user_id, text))
+
+    async def press_buttons(self, user_id, request_ids, count, cancel_share):
+        from callbacks import request_callback
+
+        for _ in range(count):
+            action = 'cancel' if random.random() < cancel_share else 'complete'
+            await self.send(action, self.callback(user_id, request_callback(action, random.choice(request_ids))))
+
+# Создаёт администраторов напрямую в БД, как manage_admins.py
+def register_admins(telegram_ids):
+    from database import Session
+    from models import User, bump_users_version
+
+    session = Session()
+    try:
+        session.add_all([User(telegram_id=telegram_id, username=f'admin{telegram_id}', is_admin=True)
+                         for telegram_id in telegram_ids])
+        bump_users_version(session)
+        session.commit()
+    finally:
+        session.close()
+
+def new_request_ids():
+    from database import Session
+    from models import Request
+
+    session = Session()
+    try:
+        return [request_id for (request_id,) in session.query(Request.id).filter(Request.status == 'new')]
+    finally:
+        session.close()
+
+# Ждёт, пока фоновая рассылка доставит expected уведомлений
+async def wait_for_notifications(pipeline, expected, timeout):
+    started = time.perf_counter()
+    while pipeline.sent + pipeline.failed < expected and time.perf_counter() - started < timeout:
+        await asyncio.sleep(0.05)
+    return time.perf_counter() - started
+
+async def run(args):
+    # Импорт здесь: модули бота читают настройки из окружения, подготовленного в main()
+    import bot
+    import database
+    from handlers import CARD_UPDATE_DELAY, card_updater, notification_pipeline
+    from metrics import db_session_seconds
+
+    bot.init_logging()
+    database.migrate(database.get_engine())
+    if args.inline_db:
+        executor = InlineExecutor(latency=args.db_latency / 1000)
+    else:
+        executor = TimedExecutor(max_workers=database.DB_WORKERS, thread_name_prefix='db', latency=args.db_latency / 1000)
+    database.db_executor = executor
+    api = FakeBotApi(latency=args.api_latency / 1000)
+    application = bot.build_application(request=api)
+
+    admins = [FIRST_USER_ID + number for number in range(args.admins)]
+    workers = [FIRST_USER_ID + args.admins + number for number in range(args.users - args.admins)]
+    await asyncio.get_running_loop().run_in_executor(None, register_admins, admins)
+
+    await application.initialize()
+    await application.post_init(application)
+    load = LoadTest(application, args.rate, args.concurrency)
+    started = time.perf_counter()
+    try:
+        await load.run_phase('start', [load.start(user_id) for user_id in admins + workers])
+        await load.run_phase('create', [load.create_requests(user_id, args.requests) for user_id in admins])
+        request_ids = await asyncio.get_running_loop().run_in_executor(None, new_request_ids)
+        fan_out_seconds = await wait_for_notifications(notification_pipeline, len(request_ids) * len(workers), args.drain_timeout)
+        if request_ids:
+            await load.run_phase('buttons', [
+                load.press_buttons(user_id, request_ids, args.actions, args.cancel_share) for user_id in workers
+            ])
+        # Даём обновлению карточек отправить последнюю пачку правок
+        await asyncio.sleep(CARD_UPDATE_DELAY * 2)
+    finally:
+        total_seconds = time.perf_counter() - started
+        await application.post_shutdown(application)
+        await application.shutdown()
+
+    session_metric = db_session_seconds.labels()
+    waits = sorted(executor.waits)
+    return {
+        'users': args.users,
+        'admins': args.admins,
+        'db_mode': 'inline' if args.inline_db else 'thread pool',
+        'total_seconds': total_seconds,
+        'updates': sum(len(values) for values in load.latencies.values()),
+        'phases': load.phases,
+        'latency_ms': {kind: latency_ms(values) for kind, values in load.latencies.items()},
+        'handler_errors': handler_errors(),
+        'notifications': {
+            'sent': notification_pipeline.sent,
+            'failed': notification_pipeline.failed,
+            'seconds': fan_out_seconds,
+        },
+        'cards_edited': card_updater.edited,
+        'db': {
+            'jobs': len(waits),
+            'queue_wait_ms_p50': percentile(waits, 50) * 1000,
+            'queue_wait_ms_p95': percentile(waits, 95) * 1000,
+            'queue_wait_ms_max': (waits[-1] if waits else 0.0) * 1000,
+            'session_ms_avg': session_metric.sum / session_metric.count * 1000 if session_metric.count else 0.0,
+            'pool': database.get_engine().pool.status(),
+        },
+        'bot_api_calls': dict(sorted(api.calls.items())),
+    }
+
+# Свободный TCP-порт на localhost для webhook-сервера
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+# Приём обновлений через webhook: бот запускается, как main() в режиме webhook (встроенный сервер,
+# здесь на localhost), и получает args.webhook подписанных POST-запросов не более чем по
+# args.concurrency одновременно. Пропускная способность - от первого запроса до обработки последнего обновления
+async def run_webhook(args):
+    import bot
+    import database
+    from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+
+    bot.init_logging()
+    database.migrate(database.get_engine())
+    api = FakeBotApi(latency=args.api_latency / 1000)
+    application = bot.build_application(request=api)
+    options = bot.webhook_options(bot.get_allowed_updates(application))
+    url = f"http://{options['listen']}:{options['port']}/{options['url_path']}"
+    headers = {'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': options['secret_token']}
+
+    # Каждый пользователь сначала регистрируется (/start), затем открывает справку
+    load = LoadTest(application, args.rate, args.concurrency)
+    users = [FIRST_USER_ID + number for number in range(min(args.users, args.webhook))]
+    updates = [
+        load.message(users[number % len(users)], '/start' if number < len(users) else '/help')
+        for number in range(args.webhook)
+    ]
+
+    # Время от отправки запроса до конца обработки обновления ботом
+    posted, processed = {}, []
+    process_update = application.process_update
+
+    async def timed_process_update(update):
+        try:
+            await process_update(update)
+        finally:
+            processed.append(time.perf_counter() - posted[update.update_id])
+
+    application.process_update = timed_process_update
+
+    client = AsyncHTTPClient(force_instance=True, max_clients=args.concurrency)
+    acks, statuses = [], {}
+
+    async def post(update):
+        await load.pacer.wait()
+        async with load.semaphore:
+            started = posted[update['update_id']] = time.perf_counter()
+            response = await client.fetch(
+                HTTPRequest(url, method='POST', headers=headers, body=json.dumps(update)), raise_error=False
+            )
+            acks.append(time.perf_counter() - started)
+            statuses[response.code] = statuses.get(response.code, 0) + 1
+
+    await application.initialize()
+    await application.post_init(application)
+    await application.updater.start_webhook(**options)
+    await application.start()
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*[post(update) for update in updates])
+        post_seconds = time.perf_counter() - started
+        # Сервер ответил на все запросы - ждём, пока бот обработает всё, что попало в очередь
+        await application.update_queue.join()
+        total_seconds = time.perf_counter() - started
+    finally:
+        client.close()
+        await application.updater.stop()
+        await application.stop()
+        await application.post_shutdown(application)
+        await application.shutdown()
+
+    return {
+        'updates': len(updates),
+        'users': len(users),
+        'concurrency': args.concurrency,
+        'statuses': dict(sorted(statuses.items())),
+        'post_seconds': post_seconds,
+        'total_seconds': total_seconds,
+        'requests_per_second': len(updates) / post_seconds if post_seconds else 0.0,
+        'updates_per_second': len(processed) / total_seconds if total_seconds else 0.0,
+        'latency_ms': {'response': latency_ms(acks), 'processed': latency_ms(processed)},
+        'handler_errors': handler_errors(),
+        'bot_api_calls': dict(sorted(api.calls.items())),
+    }
+
+def print_webhook_report(report):
+    print(f"Webhook: {report['updates']} updates from {report['users']} users, "
+          f"up to {report['concurrency']} requests at a time, HTTP statuses {report['statuses']}")
+    print(f"  received in {report['post_seconds']:.2f} s ({report['requests_per_second']:.1f} requests/s), "
+          f"processed in {report['total_seconds']:.2f} s ({report['updates_per_second']:.1f} updates/s)")
+    print(f"  {'latency, ms':<12} {'count':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for kind, stats in report['latency_ms'].items():
+        print(f"  {kind:<12} {stats['count']:>7} {stats['p50']:8.2f} {stats['p95']:8.2f} "
+              f"{stats['p99']:8.2f} {stats['max']:8.2f}")
+    print(f"Handler errors: {report['handler_errors']}")
+    print(f"Bot API calls: {report['bot_api_calls']}")
+
+# Прогоняет один и тот же сценарий дважды, каждый раз в новом интерпретаторе: с работой БД
+# прямо в event loop (как до пула потоков) и через пул потоков БД
+def compare_db_modes(argv):
+    here = os.path.dirname(os.path.abspath(__file__))
+    reports = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for mode, extra in (('inline', ['--inline-db']), ('thread pool', [])):
+            path = os.path.join(directory, 'report.json')
+            subprocess.run([sys.executable, os.path.join(here, 'loadtest.py'), *argv, *extra, '--json', path],
+                           stdout=subprocess.DEVNULL, check=True)
+            with open(path, encoding='utf-8') as file:
+                reports[mode] = json.load(file)
+    return reports
+
+# Синтетическая заявка для замера отрисовки: объект модели без БД, с исполнителями
+def synthetic_request(number, status, workers):
+    from datetime import datetime, timedelta, timezone
+    from models import Request
+
+    created_at = datetime(2024, 5, 1, 9, 30, tzinfo=timezone.utc) + timedelta(minutes=number)
+    worker = workers[number % len(workers)]
+    return Request(
+        id=number, user_id=1, status=status, priority=('high', 'medium', 'low')[number % 3],
+        equipment_name=f"Перфоратор <Bosch> №{number}", quantity=number % 20 + 1,
+        description=f"Нагрузочный тест & проверка, заявка {number}", notes=None if number % 2 else "Срочно",
+        created_at=created_at, updated_at=created_at + timedelta(hours=1),
+        completed_at=created_at + timedelta(hours=1) if status == 'completed' else None,
+        completed_by_id=worker.id if status == 'completed' else None, completed_by=worker if status == 'completed' else None,
+        cancelled_by_id=worker.id if status == 'cancelled' else None, cancelled_by=worker if status == 'cancelled' else None,
+    )
+
+# Замеряет отрисовку count карточек каждого вида, нс на карточку: сама отрисовка шаблона,
+# отрисовка через кэш, когда все заявки разные (промахи), и повторный показ одних и тех же (попадания)
+def measure_render(count):
+    from models import User
+    from rendering import (
+        render_cache, format_request_details, format_completed_request, format_cancelled_request,
+        _render_details, _render_completed, _render_cancelled,
+    )
+
+    workers = [User(id=number, telegram_id=FIRST_USER_ID + number, username=f'worker{number}') for number in range(1, 51)]
+    kinds = [
+        ('details', ('new', 'in_progress', 'completed', 'cancelled'), _render_details, format_request_details),
+        ('completed', ('completed',), _render_completed, lambda request: format_completed_request(request, 30)),
+        ('cancelled', ('cancelled',), _render_cancelled, lambda request: format_cancelled_request(request, 30)),
+    ]
+    # Сколько разных заявок показывать повторно: половина кэша, чтобы всё в нём поместилось
+    working_set = max(1, render_cache.maxsize // 2)
+
+    def per_card(render, requests):
+        started = time.perf_counter_ns()
+        for request in requests:
+            render(request)
+        return (time.perf_counter_ns() - started) / len(requests)
+
+    report = {'cards': count, 'cache_size': render_cache.maxsize, 'ns_per_card': {}}
+    for kind, statuses, render, cached in kinds:
+        requests = [synthetic_request(number, statuses[number % len(statuses)], workers) for number in range(1, count + 1)]
+        repeated = [requests[number % working_set] for number in range(count)]
+        render_cache.clear()
+        uncached = per_card(render, requests)
+        render_cache.clear()
+        miss = per_card(cached, requests)
+        render_cache.clear()
+        per_card(cached, repeated[:working_set])
+        hit = per_card(cached, repeated)
+        report['ns_per_card'][kind] = {'uncached': uncached, 'cache_miss': miss, 'cache_hit': hit}
+    return report
+
+def print_render_report(report):
+    print(f"Card rendering, ns per card ({report['cards']} cards of each kind, cache size {report['cache_size']}):")
+    print(f"  {'kind':<10} {'uncached':>10} {'cache miss':>11} {'cache hit':>10}")
+    for kind, values in report['ns_per_card'].items():
+        print(f"  {kind:<10} {values['uncached']:10.0f} {values['cache_miss']:11.0f} {values['cache_hit']:10.0f}")
+
+# Слова синтетических заявок для замера поиска. В нижнем регистре: на SQLite lower() и LIKE
+# не меняют регистр кириллицы, а сравнивать FTS и LIKE нужно на одинаковых совпадениях
+SEARCH_WORDS = (
+    'перфоратор', 'дрель', 'шуруповёрт', 'болгарка', 'лобзик', 'рубанок', 'фрезер', 'степлер', 'краскопульт',
+    'компрессор', 'генератор', 'сварочный', 'нивелир', 'дальномер', 'пылесос', 'миксер', 'плиткорез', 'стремянка',
+    'леса', 'тепловая', 'пушка', 'отбойный', 'молоток', 'бетономешалка', 'виброплита', 'триммер', 'газонокосилка',
+    'бензопила', 'цепная', 'торцовочная', 'пила', 'ленточная', 'шлифмашина', 'полировальная', 'гравер', 'паяльник',
+    'фен', 'клеевой', 'пистолет', 'домкрат', 'лебёдка', 'тачка', 'лопата', 'лом', 'кувалда', 'удлинитель',
+    'прожектор', 'рация', 'каска', 'респиратор',
+)
+# Поисковые запросы замера: частое слово, префикс, два слова и редкий серийный номер
+SEARCH_QUERIES = ('перфоратор', 'перф', 'дрель срочно', 'sn123456')
+
+# Заполняет таблицу заявок rows строками одним INSERT ... SELECT. Полнотекстовый индекс
+# обновляют триггеры миграции, как при обычной работе бота
+def generate_search_requests(engine, rows):
+    words = ', '.join(f"({number}, '{word}')" for number, word in enumerate(SEARCH_WORDS))
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            f"""INSERT INTO requests (user_id, equipment_name, quantity, description, priority, status,
+                                      created_at, updated_at, is_deleted, notes)
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?),
+                 words(number, word) AS (VALUES {words})
+            SELECT 1, equipment.word || ' ' || (n.i % 7 + 1), n.i % 10 + 1,
+                   'нужен ' || equipment.word || ' и ' || extra.word || ' для объекта ' || (n.i % 500),
+                   'medium', CASE n.i % 4 WHEN 0 THEN 'completed' WHEN 1 THEN 'cancelled' ELSE 'new' END,
+                   datetime('2024-01-01', '+' || n.i || ' minutes'), datetime('2024-01-01', '+' || n.i || ' minutes'),
+                   0, CASE WHEN n.i % 3 = 0 THEN 'срочно sn' || n.i ELSE 'sn' || n.i END
+            FROM n
+            JOIN words AS equipment ON equipment.number = n.i % {len(SEARCH_WORDS)}
+            JOIN words AS extra ON extra.number = (n.i * 7 + 3) % {len(SEARCH_WORDS)}""",
+            (rows,)
+        )
+
+# Сравнивает поиск через FTS5 и через LIKE на таблице из rows синтетических заявок:
+# медиана времени первой страницы результатов (SEARCH_PAGE_SIZE + 1 строк) из repeats запусков
+def measure_search(rows, repeats=3):
+    import database
+    from services import SEARCH_PAGE_SIZE, fts_search_query, like_search_query, search_terms, searchable_requests
+
+    engine = database.get_engine()
+    database.migrate(engine)
+    register_admins([FIRST_USER_ID])
+    started = time.perf_counter()
+    generate_search_requests(engine, rows)
+    generated = time.perf_counter() - started
+
+    def page_ms(search, query_text, is_admin):
+        samples, found = [], 0
+        for _ in range(repeats):
+            session = database.Session()
+            try:
+                started = time.perf_counter()
+                query = search(searchable_requests(session, is_admin), search_terms(query_text))
+                found = len(query.limit(SEARCH_PAGE_SIZE + 1).all())
+                samples.append((time.perf_counter() - started) * 1000)
+            finally:
+                session.close()
+        return statistics.median(samples), found
+
+    results = []
+    for query_text in SEARCH_QUERIES:
+        for is_admin in (True, False):
+            fts_ms, fts_found = page_ms(fts_search_query, query_text, is_admin)
+            like_ms, like_found = page_ms(like_search_query, query_text, is_admin)
+            results.append({'query': query_text, 'admin': is_admin, 'fts_ms': fts_ms, 'like_ms': like_ms,
+                            'fts_found': fts_found, 'like_found': like_found})
+    return {'rows': rows, 'generate_seconds': generated, 'repeats': repeats, 'queries': results}
+
+def print_search_report(report):
+    print(f"Search over {report['rows']} requests (table generated in {report['generate_seconds']:.1f} s), "
+          f"first page, median of {report['repeats']} runs, ms:")
+    print(f"  {'query':<14} {'user':<7} {'FTS5':>9} {'LIKE':>10} {'found':>6}")
+    for result in report['queries']:
+        found = str(result['fts_found']) if result['fts_found'] == result['like_found'] \
+            else f"{result['fts_found']}/{result['like_found']}"
+        print(f"  {result['query']:<14} {'admin' if result['admin'] else 'worker':<7} "
+              f"{result['fts_ms']:9.2f} {result['like_ms']:10.2f} {found:>6}")
+
+# Суммарное время импорта модулей (мс) из вывода python -X importtime
+def parse_importtime(stderr, modules):
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        name = name.strip()
+        if name in modules and cumulative.strip().isdigit():
+            times[name] = int(cumulative) / 1000
+    return times
+
+def run_python(code):
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=here,
+                            capture_output=True, text=True, check=True)
+    return result.stdout, result.stderr
+
+# Замеряет время импорта и готовности бота в новых интерпретаторах (медиана из runs запусков)
+def measure_startup(runs):
+    # Первый запуск создаёт схему, замеряются перезапуски с уже существующей БД
+    run_python(STARTUP_SCRIPT)
+    samples, imports = [], []
+    for _ in range(runs):
+        stdout, stderr = run_python(STARTUP_SCRIPT)
+        samples.append(json.loads(stdout.strip().splitlines()[-1]))
+        imports.append(parse_importtime(stderr, STARTUP_MODULES))
+    stdout, stderr = run_python(SCRIPT_IMPORT)
+    return {
+        'runs': runs,
+        'startup_ms': {key: statistics.median(sample[key] for sample in samples) for key in samples[0]},
+        'import_ms': {
+            name: statistics.median(sample.get(name, 0.0) for sample in imports) for name in STARTUP_MODULES
+        },
+        'script_import_ms': sum(parse_importtime(stderr, ('models', 'database')).values()),
+        'script_imports_telegram': stdout.strip() == '1',
+    }
+
+def print_startup_report(report):
+    startup = report['startup_ms']
+    print(f"Startup, median of {report['runs']} runs: ready in {startup['ready_ms']:.1f} ms "
+          f"(import {startup['import_ms']:.1f}, migrate {startup['migrate_ms']:.1f}, "
+          f"build application {startup['build_ms']:.1f})")
+    print("Cumulative import time, ms: " + ', '.join(
+        f"{name} {value:.1f}" for name, value in report['import_ms'].items()
+    ))
+    print(f"Scripts (models + database): {report['script_import_ms']:.1f} ms, "
+          f"imports telegram: {'yes' if report['script_imports_telegram'] else 'no'}")
+
+def print_report(report):
+    print(f"Users: {report['users']} ({report['admins']} admins), updates: {report['updates']}, "
+          f"total {report['total_seconds']:.2f} s, DB: {report['db_mode']}")
+    print("\nThroughput:")
+    for phase in report['phases']:
+        print(f"  {phase['phase']:<10} {phase['updates']:>7} updates  {phase['seconds']:8.2f} s  "
+              f"{phase['updates_per_second']:9.1f} updates/s")
+    print("\nLatency per update, ms:")
+    print(f"  {'kind':<12} {'count':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for kind, stats in report['latency_ms'].items():
+        print(f"  {kind:<12} {stats['count']:>7} {stats['p50']:8.2f} {stats['p95']:8.2f} "
+              f"{stats['p99']:8.2f} {stats['max']:8.2f}")
+    notifications = report['notifications']
+    print(f"\nNotifications: sent {notifications['sent']}, failed {notifications['failed']} "
+          f"in {notifications['seconds']:.2f} s; live cards edited: {report['cards_edited']}")
+    db = report['db']
+    print(f"DB: {db['jobs']} jobs, thread pool wait p50 {db['queue_wait_ms_p50']:.2f} ms, "
+          f"p95 {db['queue_wait_ms_p95']:.2f} ms, max {db['queue_wait_ms_max']:.2f} ms; "
+          f"connection held {db['session_ms_avg']:.2f} ms on average")
+    print(f"    {db['pool']}")
+    print(f"Handler errors: {report['handler_errors']}")
+    print(f"Bot API calls: {report['bot_api_calls']}")
+
+def print_db_comparison(reports):
+    before, after = reports['inline'], reports['thread pool']
+    print("Handler latency, ms: DB in the event loop (before) vs DB thread pool (after)")
+    print(f"  {'kind':<12} {'count':>7} {'p50 before':>11} {'p50 after':>10} {'p99 before':>11} {'p99 after':>10}")
+    for kind, stats in after['latency_ms'].items():
+        old = before['latency_ms'].get(kind)
+        if old is None:
+            continue
+        print(f"  {kind:<12} {stats['count']:>7} {old['p50']:11.2f} {stats['p50']:10.2f} "
+              f"{old['p99']:11.2f} {stats['p99']:10.2f}")
+    print(f"Total: {before['total_seconds']:.2f} s before, {after['total_seconds']:.2f} s after")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Offline load test: replays synthetic users against the bot with a fake Bot API."
+    )
+    parser.add_argument('--users', type=int, default=1000, help="synthetic users, admins included (default 1000)")
+    parser.add_argument('--admins', type=int, default=10, help="admins that create requests (default 10)")
+    parser.add_argument('--requests', type=int, default=2, help="requests created by each admin (default 2)")
+    parser.add_argument('--actions', type=int, default=1, help="accept/cancel presses per worker (default 1)")
+    parser.add_argument('--cancel-share', type=float, default=0.2, help="share of cancel presses (default 0.2)")
+    parser.add_argument('--rate', type=float, default=0, help="updates per second, 0 - as fast as possible")
+    parser.add_argument('--concurrency', type=int, default=100, help="users active at the same time (default 100)")
+    parser.add_argument('--api-latency', type=float, default=0, help="simulated Bot API latency, ms")
+    parser.add_argument('--drain-timeout', type=float, default=120,
+                        help="seconds to wait for new-request notifications to go out")
+    parser.add_argument('--database-url', help="database to test against (default: a fresh SQLite file)")
+    parser.add_argument('--keep-rate-limits', action='store_true',
+                        help="keep the outbox rate limits from the environment instead of disabling them")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default 0)")
+    parser.add_argument('--json', help="also write the report to this JSON file")
+    parser.add_argument('--db-latency', type=float, default=0,
+                        help="simulated database round trip added to every DB job, ms")
+    parser.add_argument('--inline-db', action='store_true',
+                        help="run database work in the event loop, as before the DB thread pool")
+    parser.add_argument('--compare-db', action='store_true',
+                        help="run the scenario with --inline-db and with the DB thread pool and compare latencies")
+    parser.add_argument('--render', type=int, metavar='CARDS', nargs='?', const=100000,
+                        help="measure card rendering instead of the load test, ns per card (default 100000 cards)")
+    parser.add_argument('--search', type=int, metavar='ROWS', nargs='?', const=1000000,
+                        help="compare FTS5 and LIKE search on a synthetic table instead of the load test "
+                             "(default 1000000 rows)")
+    parser.add_argument('--startup', type=int, metavar='RUNS', nargs='?', const=5,
+                        help="measure import time and startup instead of the load test (median of RUNS, default 5)")
+    parser.add_argument('--webhook', type=int, metavar='UPDATES', nargs='?', const=10000,
+                        help="post UPDATES signed updates to the bot's webhook server on localhost instead of "
+                             "the load test and measure throughput (default 10000; uses --users, --concurrency, --rate)")
+    args = parser.parse_args()
+    if not 0 < args.admins < args.users:
+        parser.error("--admins must be between 1 and --users - 1")
+    random.seed(args.seed)
+    if args.compare_db:
+        # Те же параметры сценария, но без самого --compare-db и без --json
+        argv, skip = [], False
+        for arg in sys.argv[1:]:
+            if not skip and arg != '--compare-db' and not arg.startswith('--json'):
+                argv.append(arg)
+            skip = arg == '--json'
+        reports = compare_db_modes(argv)
+        print_db_comparison(reports)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as file:
+                json.dump(reports, file, ensure_ascii=False, indent=2)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Всё, что пишет бот, попадает во временный каталог; к Telegram никто не обращается
+        os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(directory, 'loadtest.db')}"
+        os.environ['PERSISTENCE_FILE'] = os.path.join(directory, 'state.pickle')
+        os.environ['LOG_FILE'] = os.path.join(directory, 'bot.log')
+        os.environ['TELEGRAM_BOT_TOKEN'] = '123456:loadtest'
+        os.environ['METRICS_PORT'] = '0'
+        if not args.keep_rate_limits:
+            # С лимитами Telegram узким местом была бы очередь отправки, а не сам бот
+            for name in ('OUTBOX_GLOBAL_RATE', 'OUTBOX_CHAT_RATE', 'OUTBOX_CHAT_BURST'):
+                os.environ[name] = '1000000'
+        if args.webhook:
+            # Встроенный webhook-сервер на свободном локальном порту; адрес для Telegram не используется
+            os.environ['WEBHOOK_LISTEN'] = '127.0.0.1'
+            os.environ['WEBHOOK_PORT'] = str(free_port())
+            os.environ['WEBHOOK_URL'] = 'https://loadtest.invalid'
+        if args.startup:
+            report = measure_startup(args.startup)
+        elif args.render:
+            report = measure_render(args.render)
+        elif args.search:
+            report = measure_search(args.search)
+        elif args.webhook:
+            report = asyncio.run(run_webhook(args))
+        else:
+            report = asyncio.run(run(args))
+
+    if args.startup:
+        print_startup_report(report)
+    elif args.render:
+        print_render_report(report)
+    elif args.search:
+        print_search_report(report)
+    elif args.webhook:
+        print_webhook_report(report)
+    else:
+        print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
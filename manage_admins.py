@@ -1,15 +1,12 @@
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from bot import Base, User
 
-# Load environment variables
+# Load environment variables before the database module reads DATABASE_URL
 load_dotenv()
 
-# Database setup
-engine = create_engine('sqlite:///requests.db')
-Session = sessionmaker(bind=engine)
+# Only the models and the lazy engine: importing them does not start the bot or touch the database
+from database import Session, get_engine, migrate
+from models import User, bump_users_version
 
 def add_admin(telegram_id: int, username: str) -> None:
     """Add a new administrator."""
@@ -27,6 +24,8 @@ def add_admin(telegram_id: int, username: str) -> None:
         user = User(telegram_id=telegram_id, username=username, is_admin=True)
         session.add(user)
     
+    # Bump the cache version so running bots drop their cached roles
+    bump_users_version(session)
     session.commit()
     session.close()
     print(f"Administrator {username} (ID: {telegram_id}) has been added.")
@@ -38,6 +37,7 @@ def remove_admin(telegram_id: int) -> None:
     
     if user:
         user.is_admin = False
+        bump_users_version(session)
         session.commit()
         print(f"Administrator privileges have been removed from user {user.username} (ID: {telegram_id})")
     else:
@@ -59,7 +59,12 @@ def list_admins() -> None:
     
     session.close()
 
-if __name__ == "__main__":
+def main() -> None:
+    """Interactive administrator management."""
+    # Same DATABASE_URL and pool settings as the bot. On a fresh database the admin is
+    # usually added before the bot's first start, so create the schema here too
+    migrate(get_engine())
+
     while True:
         print("\nAdministrator Management")
         print("1. Add administrator")
@@ -86,4 +91,7 @@ if __name__ == "__main__":
             break
         
         else:
-            print("Invalid choice. Please try again.") 
\ No newline at end of file
+            print("Invalid choice. Please try again.") 
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import asyncio
+import bisect
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Адрес и порт HTTP-сервера метрик (0 - сервер не запускается). Снаружи порт открывать не нужно
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+# Границы корзин гистограмм задержек (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Экранирование значения метки в текстовом формате Prometheus
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+# Метки в виде {name="value",...}; extra - дополнительные пары (например, le у гистограммы)
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+# Значение метрики: +Inf для бесконечности, целые - без дробной части
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# Семейство метрик с метками. labels() возвращает дочернюю метрику для набора значений меток
+# (для метрики без меток - labels() без аргументов). Дочернюю метрику стоит получить заранее
+# и хранить, тогда на горячем пути остаётся только увеличение счётчика.
+# Без блокировок: увеличение числа - одна операция под GIL, редкая потеря инкремента допустима
+class MetricFamily:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, child in list(self._children.items()):
+            lines.extend(child.render(self.name, format_labels(self.labelnames, values), self.labelnames, values))
+        return lines
+
+# Значение счётчика для одного набора меток
+class CounterValue:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def render(self, name, labels, labelnames, values):
+        return [f'{name}{labels} {format_value(self.value)}']
+
+# Значение, которое можно установить (текущее состояние)
+class GaugeValue(CounterValue):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+# Гистограмма для одного набора меток: число значений по корзинам, сумма и количество
+class HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # Последняя ячейка - значения больше верхней границы (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Корзины в формате Prometheus накопительные, поэтому суммируем при выдаче, а не при записи
+    def render(self, name, labels, labelnames, values):
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            bucket_labels = format_labels(labelnames, values, [('le', format_value(bound))])
+            lines.append(f'{name}_bucket{bucket_labels} {total}')
+        lines.append(f'{name}_sum{labels} {format_value(self.sum)}')
+        lines.append(f'{name}_count{labels} {self.count}')
+        return lines
+
+# Счётчик, который только растёт
+class Counter(MetricFamily):
+    kind = 'counter'
+
+    def _new_child(self):
+        return CounterValue()
+
+# Текущее значение (очередь, число заявок)
+class Gauge(MetricFamily):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return GaugeValue()
+
+# Распределение значений по корзинам buckets (по умолчанию - задержки)
+class Histogram(MetricFamily):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return HistogramValue(self.buckets)
+
+# Набор метрик, отдаваемых сервером
+class Registry:
+    def __init__(self):
+        self._families = []
+
+    def register(self, family):
+        self._families.append(family)
+        return family
+
+    def render(self):
+        lines = []
+        for family in self._families:
+            lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+handler_updates = registry.register(Counter(
+    'tasker_handler_updates_total', 'Обработанные обновления по обработчикам и исходу', ['handler', 'outcome']
+))
+handler_latency = registry.register(Histogram(
+    'tasker_handler_duration_seconds', 'Время обработки обновления', ['handler']
+))
+db_session_seconds = registry.register(Histogram(
+    'tasker_db_session_seconds', 'Сколько сессия БД держала соединение из пула'
+))
+bot_api_latency = registry.register(Histogram(
+    'tasker_bot_api_duration_seconds', 'Время вызова Bot API через очередь отправки', ['method']
+))
+bot_api_throttled = registry.register(Counter(
+    'tasker_bot_api_throttled_total', 'Ответы 429 (RetryAfter) от Bot API', ['method']
+))
+active_conversations = registry.register(Gauge(
+    'tasker_active_conversations', 'Незавершённые диалоги ConversationHandler', ['conversation']
+))
+requests_by_status = registry.register(Gauge(
+    'tasker_requests', 'Заявки по статусам (в пределах срока хранения)', ['status']
+))
+requests_by_priority = registry.register(Gauge(
+    'tasker_requests_by_priority', 'Заявки по приоритетам (в пределах срока хранения)', ['priority']
+))
+
+# HTTP-сервер метрик в текстовом формате Prometheus. Работает в том же event loop, что и бот.
+# refresh - корутина, обновляющая вычисляемые метрики перед каждой выдачей
+class MetricsServer:
+    def __init__(self, registry, listen=METRICS_LISTEN, port=METRICS_PORT, refresh=None):
+        self.registry = registry
+        self.listen = listen
+        self.port = port
+        self.refresh = refresh
+        self._server = None
+
+    async def start(self):
+        if not self.port:
+            return
+        self._server = await asyncio.start_server(self._handle, self.listen, self.port)
+        logger.info(f"Метрики доступны на http://{self.listen}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Заголовки запроса не нужны, но их надо дочитать
+            while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2 or parts[0] != 'GET' or parts[1].split('?')[0] != '/metrics':
+                status, body = '404 Not Found', 'Not found\n'
+            else:
+                if self.refresh is not None:
+                    try:
+                        await self.refresh()
+                    except Exception as e:
+                        logger.warning(f"Не удалось обновить метрики: {e}")
+                status, body = '200 OK', self.registry.render()
+            payload = body.encode('utf-8')
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                "Connection: close\r\n\r\n".encode('latin-1') + payload
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
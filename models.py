@@ -0,0 +1,208 @@
+from collections import namedtuple
+from datetime import timezone
+
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Boolean, Text, Index, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy.sql import func
+
+# Базовый класс моделей. Модуль не создаёт движок и не обращается к БД при импорте,
+# поэтому его могут подключать скрипты вроде manage_admins.py
+Base = declarative_base()
+
+# Класс для пользователей в базе данных
+class User(Base):
+    __tablename__ = 'users'
+    id = Column(Integer, primary_key=True)
+    telegram_id = Column(BigInteger, unique=True)
+    username = Column(String)
+    is_admin = Column(Boolean, default=False)  # По умолчанию пользователь не админ
+    created_at = Column(DateTime, default=func.now())
+    # Основные заявки пользователя
+    requests = relationship('Request', back_populates='user', foreign_keys='Request.user_id')
+    # Заявки, которые пользователь принял
+    completed_requests = relationship('Request', foreign_keys='Request.completed_by_id')
+    # Заявки, которые пользователь отклонил/отменил
+    cancelled_requests = relationship('Request', foreign_keys='Request.cancelled_by_id')
+
+# Класс для заявок в базе данных
+class Request(Base):
+    __tablename__ = 'requests'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'))
+    equipment_name = Column(String)
+    quantity = Column(Integer)
+    description = Column(Text)
+    priority = Column(String)
+    status = Column(String, default='new')  # new, in_progress, completed, cancelled
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    completed_at = Column(DateTime, nullable=True)
+    deleted_at = Column(DateTime, nullable=True)
+    is_deleted = Column(Boolean, default=False)
+    notes = Column(Text, nullable=True)  # Для дополнительных заметок
+    estimated_completion = Column(DateTime, nullable=True)  # Ожидаемая дата выполнения
+    # Новые поля для отслеживания действий
+    completed_by_id = Column(Integer, ForeignKey('users.id'), nullable=True)  # Кто принял
+    cancelled_by_id = Column(Integer, ForeignKey('users.id'), nullable=True)  # Кто отклонил/отменил
+    # Отношения
+    user = relationship('User', back_populates='requests', foreign_keys=[user_id])
+    completed_by = relationship('User', foreign_keys=[completed_by_id])
+    cancelled_by = relationship('User', foreign_keys=[cancelled_by_id])
+
+    # Индексы под меню активных, выполненных и отменённых заявок. Порядок колонок совпадает
+    # с сортировкой страниц (колонка, id), чтобы СУБД читала индекс по порядку, без сортировки
+    __table_args__ = (
+        Index('ix_requests_active_created', 'is_deleted', 'created_at', 'id'),
+        Index('ix_requests_status_completed', 'status', 'completed_at', 'id'),
+        Index('ix_requests_status_updated', 'status', 'updated_at', 'id'),
+    )
+
+# Класс для учёта применённых миграций схемы
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+    version = Column(Integer, primary_key=True)
+    applied_at = Column(DateTime, default=func.now())
+
+# Версии кэшей: счётчик увеличивается при изменениях, чтобы другие процессы сбросили свой кэш
+class CacheVersion(Base):
+    __tablename__ = 'cache_versions'
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+# Сводная статистика по заявкам. Счётчики меняются в той же транзакции, что и сами заявки:
+# status/<статус> и priority/<приоритет> - число заявок, accept/count и accept/seconds -
+# число принятых заявок и суммарное время до принятия, worker/<id пользователя> - принято сотрудником
+class RequestStat(Base):
+    __tablename__ = 'request_stats'
+    metric = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+# Доставка уведомления о новой заявке одному сотруднику
+class NotificationDelivery(Base):
+    __tablename__ = 'notification_deliveries'
+    id = Column(Integer, primary_key=True)
+    request_id = Column(Integer, ForeignKey('requests.id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    status = Column(String, default='pending')  # pending, sent, failed
+    message_id = Column(Integer, nullable=True)  # Сообщение с карточкой у получателя
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=func.now())
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('ix_notification_deliveries_request', 'request_id', 'status'),
+        Index('ix_notification_deliveries_created', 'created_at'),
+    )
+
+# Ход рассылки уведомлений о новой заявке: до какого пользователя (users.id) она дошла.
+# Сохраняется вместе с результатами каждой пачки, чтобы после перезапуска продолжить с того же места
+class NotificationFanout(Base):
+    __tablename__ = 'notification_fanouts'
+    id = Column(Integer, primary_key=True)
+    request_id = Column(Integer, nullable=False, unique=True)
+    after_user_id = Column(Integer, nullable=False, default=0)  # Последний получатель из сохранённых пачек
+    created_at = Column(DateTime, default=func.now())
+    finished_at = Column(DateTime, nullable=True)  # Пусто, пока рассылка не завершена
+
+    __table_args__ = (
+        Index('ix_notification_fanouts_finished', 'finished_at'),
+    )
+
+# Сообщение, в котором показана заявка: отдельная карточка (view пустой) или страница списка.
+# Нужен, чтобы при смене статуса обновить уже отправленные сообщения на месте
+class RequestCard(Base):
+    __tablename__ = 'request_cards'
+    id = Column(Integer, primary_key=True)
+    request_id = Column(Integer, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    message_id = Column(Integer, nullable=False)
+    view = Column(String, nullable=True)  # active, completed, cancelled - для страниц списков
+    cursor_id = Column(Integer, nullable=True)  # Граница, с которой строилась страница
+    backwards = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        Index('ix_request_cards_request', 'request_id'),
+        Index('ix_request_cards_message', 'chat_id', 'message_id'),
+        # Старые записи удаляются по времени создания (TTL)
+        Index('ix_request_cards_created', 'created_at'),
+    )
+
+# Поля заявки, от которых зависит сводная статистика
+STATS_COLUMNS = (Request.status, Request.priority, Request.created_at, Request.completed_at, Request.completed_by_id)
+StatsRow = namedtuple('StatsRow', ['status', 'priority', 'created_at', 'completed_at', 'completed_by_id'])
+
+def as_utc(dt):
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+# Вклад одной заявки в сводную статистику: {(metric, key): значение}.
+# Подходит всё, у чего есть поля StatsRow: объект Request, строка запроса, StatsRow
+def request_stat_contributions(row):
+    contributions = {('status', str(row.status)): 1, ('priority', str(row.priority)): 1}
+    if row.status == 'completed':
+        if row.completed_at and row.created_at:
+            contributions[('accept', 'count')] = 1
+            contributions[('accept', 'seconds')] = int((as_utc(row.completed_at) - as_utc(row.created_at)).total_seconds())
+        if row.completed_by_id:
+            contributions[('worker', str(row.completed_by_id))] = 1
+    return contributions
+
+# Разница в статистике после удаления строк removed и появления строк added
+def stats_delta(removed=(), added=()):
+    delta = {}
+    for rows, sign in ((added, 1), (removed, -1)):
+        for row in rows:
+            for key, value in request_stat_contributions(row).items():
+                delta[key] = delta.get(key, 0) + sign * value
+    return {key: value for key, value in delta.items() if value}
+
+# INSERT ... ON CONFLICT для СУБД, которые его поддерживают
+UPSERT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+# Применяет изменения к счётчикам в текущей транзакции (в порядке ключей, чтобы не было взаимных блокировок).
+# На SQLite и PostgreSQL это один INSERT ... ON CONFLICT DO UPDATE: новый счётчик, который
+# одновременно создают две транзакции, не приводит к ошибке уникальности
+def apply_stats_delta(session, delta):
+    if not delta:
+        return
+    upsert = UPSERT_INSERTS.get(session.get_bind().dialect.name)
+    if upsert is not None:
+        statement = upsert(RequestStat).values([
+            {'metric': metric, 'key': key, 'value': value} for (metric, key), value in sorted(delta.items())
+        ])
+        session.execute(statement.on_conflict_do_update(
+            index_elements=[RequestStat.metric, RequestStat.key],
+            set_={'value': RequestStat.value + statement.excluded.value}
+        ))
+        return
+    for (metric, key), value in sorted(delta.items()):
+        result = session.execute(
+            update(RequestStat).where(RequestStat.metric == metric, RequestStat.key == key)
+            .values(value=RequestStat.value + value)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            session.add(RequestStat(metric=metric, key=key, value=value))
+
+# Считает статистику заново по всей таблице заявок, читая её порциями
+def compute_request_stats(connection):
+    totals = {}
+    rows = connection.execute(select(*STATS_COLUMNS).execution_options(yield_per=1000))
+    for row in rows:
+        for key, value in request_stat_contributions(row).items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+# Читает текущую версию кэша пользователей из БД
+def read_users_version(session):
+    return session.query(CacheVersion.version).filter(CacheVersion.name == 'users').scalar() or 0
+
+# Увеличивает версию кэша пользователей. Вызывается в той же транзакции, что и изменение пользователей
+def bump_users_version(session):
+    result = session.execute(
+        update(CacheVersion).where(CacheVersion.name == 'users').values(version=CacheVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        session.add(CacheVersion(name='users', version=1))
@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from telegram.error import RetryAfter
+
+from metrics import bot_api_latency, bot_api_throttled
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram Bot API: около 30 сообщений в секунду на бота и 1 в секунду на чат
+GLOBAL_RATE = float(os.getenv('OUTBOX_GLOBAL_RATE', '30'))
+CHAT_RATE = float(os.getenv('OUTBOX_CHAT_RATE', '1'))
+CHAT_BURST = float(os.getenv('OUTBOX_CHAT_BURST', '3'))
+# Сколько раз повторять отправку после ответа 429 (retry_after)
+MAX_RETRIES = int(os.getenv('OUTBOX_MAX_RETRIES', '3'))
+# Сколько чатов помнить для ограничения скорости (самые давние забываются)
+MAX_TRACKED_CHATS = 10000
+# Доля лимитов, которую фоновые отправки (рассылка новых заявок, обновление карточек)
+# оставляют про запас ответам пользователям: фон не берёт токен, пока запас не накопится
+BACKGROUND_RESERVE = float(os.getenv('OUTBOX_BACKGROUND_RESERVE', '0.3'))
+
+# Корзина токенов: rate токенов в секунду, не больше capacity про запас
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        # Очереди ожидающих токен: asyncio.Lock будит их в порядке прихода.
+        # У фоновых отправок своя очередь, чтобы они не задерживали ответы пользователям
+        self.lock = asyncio.Lock()
+        self.background_lock = asyncio.Lock()
+
+    # Сколько секунд ждать до появления токена (0 - токен есть).
+    # reserve - сколько токенов должно остаться после взятия (запас для более важных отправок)
+    def delay(self, reserve=0.0):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1 + reserve:
+            return 0.0
+        return (1 + reserve - self.tokens) / self.rate
+
+    # Запас токенов для доли share ёмкости, но так, чтобы фону оставался хотя бы один токен
+    def reserve(self, share):
+        return max(0.0, min(self.capacity * share, self.capacity - 1))
+
+    def take(self):
+        self.tokens -= 1
+
+    # Запрещает отправку на заданное время (после ответа 429 от Telegram)
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+# Приоритет отправки: обычная (ответ пользователю) или фоновая
+class Lane:
+    def __init__(self, background):
+        self.background = background
+
+    # Пауза перед следующей попыткой взять токен
+    async def wait(self, delay):
+        await asyncio.sleep(delay)
+
+# Общие приоритеты отправок: их паузу ничто не прерывает, в отличие от PendingEdit
+INTERACTIVE = Lane(False)
+BACKGROUND = Lane(True)
+
+# Ещё не отправленное редактирование сообщения. Новые правки того же сообщения заменяют call,
+# а обычная правка поднимает приоритет ждущей фоновой
+class PendingEdit(Lane):
+    def __init__(self, call, background):
+        super().__init__(background)
+        self.call = call
+        self.future = asyncio.get_running_loop().create_future()
+        self._upgraded = asyncio.Event()
+
+    def upgrade(self):
+        self.background = False
+        self._upgraded.set()
+
+    # Повышение приоритета прерывает паузу: обычной правке запас лимитов не нужен
+    async def wait(self, delay):
+        try:
+            await asyncio.wait_for(self._upgraded.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+# Центральная очередь исходящих сообщений: все вызовы Bot API, отправляющие или
+# редактирующие сообщения, проходят через общий и початовый лимиты скорости.
+# Фоновые отправки не тратят запас лимитов (background_reserve), поэтому ответы
+# пользователям не ждут, пока разойдётся рассылка
+class Outbox:
+    def __init__(self, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST, max_retries=MAX_RETRIES,
+                 background_reserve=BACKGROUND_RESERVE):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.background_reserve = background_reserve
+        self._chat_buckets = OrderedDict()
+        self._pending_edits = {}
+        # Метрики Bot API по имени метода: (гистограмма задержки, счётчик ответов 429)
+        self._api_metrics = {}
+        # Метрики
+        self.depth = 0
+        self.deliveries = 0
+        self.sent = 0
+        self.throttled = 0
+        self.coalesced = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            while len(self._chat_buckets) > MAX_TRACKED_CHATS:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def _method_metrics(self, method):
+        name = getattr(method, '__name__', 'unknown')
+        metrics = self._api_metrics.get(name)
+        if metrics is None:
+            metrics = self._api_metrics[name] = (bot_api_latency.labels(name), bot_api_throttled.labels(name))
+        return metrics
+
+    # Ждёт, пока будут свободны и общий, и початовый лимиты, и забирает по токену из обоих.
+    # Сообщения одного приоритета в один чат уходят в порядке очереди.
+    # Фоновая отправка (lane.background) ждёт, пока в обоих лимитах не наберётся запас сверх токена
+    async def _acquire(self, chat_id, lane):
+        chat_bucket = self._chat_bucket(chat_id)
+        async with chat_bucket.background_lock if lane.background else chat_bucket.lock:
+            while True:
+                share = self.background_reserve if lane.background else 0.0
+                delay = max(
+                    chat_bucket.delay(chat_bucket.reserve(share)),
+                    self.global_bucket.delay(self.global_bucket.reserve(share))
+                )
+                if delay <= 0:
+                    chat_bucket.take()
+                    self.global_bucket.take()
+                    return
+                await lane.wait(delay)
+
+    # Отправляет вызов с учётом лимитов и повторяет его после 429.
+    # get_call вызывается после получения токенов и возвращает (метод, args, kwargs)
+    async def _deliver(self, chat_id, get_call, lane=INTERACTIVE):
+        self.depth += 1
+        started = time.monotonic()
+        try:
+            for attempt in range(self.max_retries + 1):
+                await self._acquire(chat_id, lane)
+                if attempt == 0:
+                    self.deliveries += 1
+                    waited = time.monotonic() - started
+                    self.wait_total += waited
+                    self.wait_max = max(self.wait_max, waited)
+                method, args, kwargs = get_call()
+                latency, throttled = self._method_metrics(method)
+                called = time.monotonic()
+                try:
+                    result = await method(*args, **kwargs)
+                    self.sent += 1
+                    return result
+                except RetryAfter as e:
+                    self.throttled += 1
+                    throttled.inc()
+                    if attempt == self.max_retries:
+                        raise
+                    retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                    logger.warning(f"Telegram ограничил отправку в чат {chat_id}, повтор через {retry_after} с")
+                    # Ограничение действует на весь бот, поэтому притормаживаем и общий лимит
+                    self._chat_bucket(chat_id).pause(retry_after)
+                    self.global_bucket.pause(retry_after)
+                finally:
+                    latency.observe(time.monotonic() - called)
+        finally:
+            self.depth -= 1
+
+    # Отправляет новое сообщение через метод Bot API (например, message.reply_text)
+    async def send(self, chat_id, method, /, *args, **kwargs):
+        return await self._deliver(chat_id, lambda: (method, args, kwargs))
+
+    # То же с низким приоритетом: для рассылок, которые не ждёт пользователь
+    async def send_background(self, chat_id, method, /, *args, **kwargs):
+        return await self._deliver(chat_id, lambda: (method, args, kwargs), BACKGROUND)
+
+    # Редактирует сообщение. Если предыдущая правка того же сообщения ещё ждёт в очереди,
+    # она заменяется новой, и оба вызова получают результат одной отправки
+    async def edit(self, chat_id, message_id, method, /, *args, **kwargs):
+        return await self._edit(chat_id, message_id, (method, args, kwargs), False)
+
+    # То же с низким приоритетом: для обновления карточек в фоне
+    async def edit_background(self, chat_id, message_id, method, /, *args, **kwargs):
+        return await self._edit(chat_id, message_id, (method, args, kwargs), True)
+
+    async def _edit(self, chat_id, message_id, call, background):
+        key = (chat_id, message_id)
+        pending = self._pending_edits.get(key)
+        if pending is not None:
+            pending.call = call
+            if not background:
+                pending.upgrade()
+            self.coalesced += 1
+            return await asyncio.shield(pending.future)
+
+        pending = self._pending_edits[key] = PendingEdit(call, background)
+
+        # После получения токенов правка уходит, и новые правки встают в очередь отдельно
+        def take_call():
+            if self._pending_edits.get(key) is pending:
+                del self._pending_edits[key]
+            return pending.call
+
+        try:
+            result = await self._deliver(chat_id, take_call, pending)
+            pending.future.set_result(result)
+            return result
+        except Exception as e:
+            pending.future.set_exception(e)
+            # Помечаем исключение как полученное, даже если других ожидающих нет
+            pending.future.exception()
+            raise
+        finally:
+            if self._pending_edits.get(key) is pending:
+                del self._pending_edits[key]
+            if not pending.future.done():
+                pending.future.cancel()
+
+    # Ответ на сообщение пользователя
+    async def reply_text(self, message, text, **kwargs):
+        return await self.send(message.chat_id, message.reply_text, text, **kwargs)
+
+    # Сообщение в чат по его ID. background=True - фоновая рассылка
+    async def send_message(self, bot, chat_id, text, background=False, **kwargs):
+        send = self.send_background if background else self.send
+        return await send(chat_id, bot.send_message, chat_id, text, **kwargs)
+
+    # Редактирование сообщения, к которому привязана нажатая inline-кнопка
+    async def edit_message_text(self, query, text, **kwargs):
+        if query.message is not None:
+            key = (query.message.chat_id, query.message.message_id)
+        else:
+            key = (None, query.inline_message_id)
+        return await self.edit(key[0], key[1], query.edit_message_text, text, **kwargs)
+
+    def stats(self):
+        return {
+            'depth': self.depth,
+            'sent': self.sent,
+            'throttled': self.throttled,
+            'coalesced': self.coalesced,
+            'wait_avg': self.wait_total / self.deliveries if self.deliveries else 0.0,
+            'wait_max': self.wait_max,
+        }
+
+# Очередь отправки, через которую работают все обработчики бота
+outbox = Outbox()
@@ -0,0 +1,336 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# Таблицы отображения статусов и приоритетов: эмодзи и подписи
+STATUS_EMOJIS = {
+    'new': '🆕',
+    'in_progress': '⏳',
+    'completed': '✅',
+    'cancelled': '❌'
+}
+
+STATUS_LABELS = {
+    'new': 'Новые',
+    'in_progress': 'В процессе',
+    'completed': 'Выполнено',
+    'cancelled': 'Отменено'
+}
+
+PRIORITY_EMOJIS = {
+    'high': '🔴',
+    'medium': '🟡',
+    'low': '🟢'
+}
+
+PRIORITY_LABELS = {
+    'high': 'Высокий',
+    'medium': 'Средний',
+    'low': 'Низкий'
+}
+
+DATETIME_FORMAT = "%d.%m.%Y %H:%M"
+
+# Шаблоны карточек. Подставляются через format_map, без разбора f-строк на каждый вызов
+DETAILS_TEMPLATE = (
+    "📋 <b>Заявка #{id}</b>\n\n"
+    "📦 <b>Оборудование:</b> {equipment_name}\n"
+    "🔢 <b>Количество:</b> {quantity}\n"
+    "📝 <b>Описание:</b> {description}\n"
+    "⚡️ <b>Приоритет:</b> {priority_emoji} {priority_label}\n"
+    "📊 <b>Статус:</b> {status_emoji} {status_label}\n\n"
+    "🕒 <b>Создано:</b> {created_at}\n"
+    "📅 <b>Обновлено:</b> {updated_at}\n"
+    "✅ <b>Выполнено:</b> {completed_at}\n"
+    "📌 <b>Заметки:</b> {notes}{action_info}"
+)
+
+COMPLETED_TEMPLATE = (
+    "✅ <b>Выполненная заявка #{id}</b>\n\n"
+    "📦 Оборудование: {equipment_name}\n"
+    "🔢 Количество: {quantity}\n"
+    "📝 Описание: {description}\n"
+    "{priority_emoji} Приоритет: {priority}\n"
+    "📅 Создана: {created_at}\n"
+    "✅ Выполнена: {completed_at}\n"
+    "👤 Принял: {actor}\n"
+)
+
+CANCELLED_TEMPLATE = (
+    "❌ <b>Отмененная заявка #{id}</b>\n\n"
+    "📦 Оборудование: {equipment_name}\n"
+    "🔢 Количество: {quantity}\n"
+    "📝 Описание: {description}\n"
+    "{priority_emoji} Приоритет: {priority}\n"
+    "📅 Создана: {created_at}\n"
+    "❌ Отменена: {updated_at}\n"
+    "👤 Отклонил/отменил: {actor}\n"
+)
+
+# Срок до автоудаления меняется каждый день, поэтому в кэш карточки не попадает
+DAYS_LEFT_TEMPLATE = "⏳ Автоудаление через: {days_left} дней\n"
+
+# Карточки отправляются с parse_mode='HTML': разметку даёт шаблон, а пользовательский
+# текст экранируется. Таблица для str.translate заменяет все спецсимволы за один проход
+HTML_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+# Разделитель полей при совместном экранировании. Символ не встречается в тексте из Telegram
+FIELD_SEPARATOR = '\x00'
+
+def escape_html(text):
+    return str(text).translate(HTML_ESCAPES)
+
+# Экранирует все поля карточки разом: склеивает их, прогоняет через translate один раз
+# и разрезает обратно. Если разделитель всё же попался в самих данных, экранирует поля по одному
+def escape_fields(*fields):
+    values = [str(field) for field in fields]
+    escaped = FIELD_SEPARATOR.join(values).translate(HTML_ESCAPES).split(FIELD_SEPARATOR)
+    if len(escaped) != len(values):
+        return [value.translate(HTML_ESCAPES) for value in values]
+    return escaped
+
+# Ограниченный LRU-кэш готовых текстов карточек. Вызывается из потоков БД, поэтому с блокировкой
+class RenderCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            text = self._entries.get(key)
+            if text is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def put(self, key, text):
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+render_cache = RenderCache(int(os.getenv('RENDER_CACHE_SIZE', '4096')))
+
+# Дата в формате ДД.ММ.ГГГГ ЧЧ:ММ
+def format_datetime(dt):
+    if dt:
+        # Убеждаемся, что дата имеет timezone
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.strftime(DATETIME_FORMAT)
+    return "Не указано"
+
+def get_status_emoji(status):
+    return STATUS_EMOJIS.get(status, '❓')
+
+def get_priority_emoji(priority):
+    return PRIORITY_EMOJIS.get(priority, '⚪️')
+
+# Кто выполнил действие с заявкой: @username, ID или "Неизвестно"
+def format_actor(user):
+    if not user:
+        return "Неизвестно"
+    return f"@{user.username}" if user.username else f"ID {user.telegram_id}"
+
+# Сколько дней осталось до автоудаления, считая от даты
+def days_left(since, retention_days):
+    if not since:
+        return 0
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return retention_days - (datetime.now(timezone.utc) - since).days
+
+# Берёт текст карточки из кэша или рисует его. Ключ - (вид, id, updated_at, статус, исполнители):
+# любое изменение заявки меняет updated_at, а статус и исполнители страхуют от правок в ту же секунду
+# (updated_at хранится с точностью до секунды: восстановление и принятие другим сотрудником)
+def render_cached(kind, request, render):
+    key = (kind, request.id, request.updated_at, request.status, request.completed_by_id, request.cancelled_by_id)
+    text = render_cache.get(key)
+    if text is None:
+        text = render(request)
+        render_cache.put(key, text)
+    return text
+
+def _render_details(request):
+    # Информация о том, кто принял или отклонил заявку
+    action_info = ""
+    if request.status == 'completed' and request.completed_by:
+        action_info = f"\n👤 Принял: {format_actor(request.completed_by)}"
+    elif request.status == 'cancelled' and request.cancelled_by:
+        action_info = f"\n👤 Отклонил/отменил: {format_actor(request.cancelled_by)}"
+
+    equipment_name, description, priority_label, status_label, notes, action_info = escape_fields(
+        request.equipment_name,
+        request.description,
+        PRIORITY_LABELS.get(request.priority, request.priority),
+        STATUS_LABELS.get(request.status, request.status),
+        request.notes if request.notes else 'Нет заметок',
+        action_info,
+    )
+    return DETAILS_TEMPLATE.format_map({
+        'id': request.id,
+        'equipment_name': equipment_name,
+        'quantity': request.quantity,
+        'description': description,
+        'priority_emoji': get_priority_emoji(request.priority),
+        'priority_label': priority_label,
+        'status_emoji': get_status_emoji(request.status),
+        'status_label': status_label,
+        'created_at': format_datetime(request.created_at),
+        'updated_at': format_datetime(request.updated_at),
+        'completed_at': format_datetime(request.completed_at),
+        'notes': notes,
+        'action_info': action_info,
+    })
+
+def _render_completed(request):
+    equipment_name, description, priority, actor = escape_fields(
+        request.equipment_name, request.description, request.priority, format_actor(request.completed_by)
+    )
+    return COMPLETED_TEMPLATE.format_map({
+        'id': request.id,
+        'equipment_name': equipment_name,
+        'quantity': request.quantity,
+        'description': description,
+        'priority_emoji': get_priority_emoji(request.priority),
+        'priority': priority,
+        'created_at': format_datetime(request.created_at),
+        'completed_at': format_datetime(request.completed_at),
+        'actor': actor,
+    })
+
+def _render_cancelled(request):
+    equipment_name, description, priority, actor = escape_fields(
+        request.equipment_name, request.description, request.priority, format_actor(request.cancelled_by)
+    )
+    return CANCELLED_TEMPLATE.format_map({
+        'id': request.id,
+        'equipment_name': equipment_name,
+        'quantity': request.quantity,
+        'description': description,
+        'priority_emoji': get_priority_emoji(request.priority),
+        'priority': priority,
+        'created_at': format_datetime(request.created_at),
+        'updated_at': format_datetime(request.updated_at),
+        'actor': actor,
+    })
+
+# Полная карточка заявки
+def format_request_details(request):
+    return render_cached('details', request, _render_details)
+
+# Карточка выполненной заявки для списка выполненных
+def format_completed_request(request, retention_days):
+    return render_cached('completed', request, _render_completed) + DAYS_LEFT_TEMPLATE.format(
+        days_left=days_left(request.completed_at, retention_days)
+    )
+
+# Карточка отменённой заявки для списка отменённых
+def format_cancelled_request(request, retention_days):
+    return render_cached('cancelled', request, _render_cancelled) + DAYS_LEFT_TEMPLATE.format(
+        days_left=days_left(request.updated_at, retention_days)
+    )
+
+# Сообщение для проигравшего в гонке: заявку уже успел изменить кто-то другой
+def format_transition_conflict(request):
+    if request.status == 'completed':
+        return f"⚠️ Заявка #{request.id} уже принята: {format_actor(request.completed_by)}"
+    if request.status == 'cancelled':
+        return f"⚠️ Заявка #{request.id} уже отклонена/отменена: {format_actor(request.cancelled_by)}"
+    return f"⚠️ Заявка #{request.id} уже активна, действие не требуется."
+
+# Сообщение об успешно выполненном действии с заявкой
+def format_transition_result(action, request_id, equipment_name, quantity, user):
+    now = datetime.now(timezone.utc).strftime(DATETIME_FORMAT)
+    equipment_name, actor = escape_fields(equipment_name, format_actor(user))
+    if action == 'complete':
+        return (
+            f"✅ <b>Заявка #{request_id} принята!</b>\n\n"
+            f"📦 Оборудование: {equipment_name}\n"
+            f"🔢 Количество: {quantity}\n"
+            f"✅ Статус изменен на 'Принято'\n"
+            f"📅 Дата принятия: {now}\n"
+            f"👤 Принял: {actor}"
+        )
+    if action == 'cancel':
+        return (
+            f"❌ <b>Заявка #{request_id} отменена</b>\n\n"
+            f"📦 Оборудование: {equipment_name}\n"
+            f"🔢 Количество: {quantity}\n"
+            f"❌ Статус изменен на 'Отменено'\n"
+            f"📅 Дата отмены: {now}\n"
+            f"👤 Отменил: {actor}"
+        )
+    if action in ('restore_cancelled', 'restore_completed'):
+        return (
+            f"🔄 <b>Заявка #{request_id} восстановлена</b>\n\n"
+            f"📦 Оборудование: {equipment_name}\n"
+            f"🔢 Количество: {quantity}\n"
+            f"🆕 Статус изменен на 'Новые'\n"
+            f"📅 Дата восстановления: {now}"
+        )
+    title = "Выполненная заявка" if action == 'delete_completed' else "Заявка"
+    return (
+        f"🗑 <b>{title} #{request_id} удалена</b>\n\n"
+        f"📦 Оборудование: {equipment_name}\n"
+        f"🗑 Заявка удалена навсегда из системы\n"
+        f"📅 Дата удаления: {now}"
+    )
+
+# Длительность в виде "2 д 3 ч 15 мин"
+def format_duration(seconds):
+    minutes = int(seconds) // 60
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    parts = []
+    if days:
+        parts.append(f"{days} д")
+    if hours:
+        parts.append(f"{hours} ч")
+    if minutes or not parts:
+        parts.append(f"{minutes} мин")
+    return ' '.join(parts)
+
+# Сводная статистика для /stats: число заявок по статусам и приоритетам,
+# среднее время до принятия и лучшие сотрудники. Считается по хранимым заявкам
+def format_request_stats(stats, retention_days):
+    by_status = stats.get('status', {})
+    by_priority = stats.get('priority', {})
+    accept = stats.get('accept', {})
+
+    lines = ["📊 <b>Статистика заявок</b>", "", "<b>По статусам:</b>"]
+    for status, label in STATUS_LABELS.items():
+        lines.append(f"{get_status_emoji(status)} {label}: {by_status.get(status, 0)}")
+    lines += ["", "<b>По приоритетам:</b>"]
+    for priority, label in PRIORITY_LABELS.items():
+        lines.append(f"{get_priority_emoji(priority)} {label}: {by_priority.get(priority, 0)}")
+
+    lines.append("")
+    if accept.get('count'):
+        lines.append(f"⏱ <b>Среднее время до принятия:</b> {format_duration(accept['seconds'] / accept['count'])}")
+    else:
+        lines.append("⏱ <b>Среднее время до принятия:</b> нет данных")
+
+    lines += ["", "<b>Принято сотрудниками:</b>"]
+    if stats.get('workers'):
+        for user, count in stats['workers']:
+            lines.append(f"👤 {escape_html(format_actor(user))}: {count}")
+    else:
+        lines.append("Пока никто не принял ни одной заявки")
+
+    lines += ["", f"Выполненные и отменённые заявки учитываются за последние {retention_days} дней."]
+    return '\n'.join(lines)
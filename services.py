@@ -0,0 +1,941 @@
+import functools
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta, timezone
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy import select, insert, update, delete, tuple_, literal, literal_column, and_, or_, table, column
+from sqlalchemy.orm import aliased, joinedload
+from sqlalchemy.sql import func
+
+from callbacks import request_callback, page_callback, search_callback
+from database import Session
+from export import export_requests
+from models import (
+    User, Request, RequestStat, NotificationDelivery, NotificationFanout, RequestCard,
+    STATS_COLUMNS, StatsRow, stats_delta, apply_stats_delta, compute_request_stats, read_users_version, bump_users_version,
+)
+from rendering import (
+    format_request_details, format_completed_request, format_cancelled_request,
+    format_transition_conflict, format_transition_result, escape_html,
+)
+
+# Операции с заявками и пользователями. Функции синхронные и вызываются в потоке БД (через run_db)
+
+# Сколько дней хранятся выполненные и отмененные заявки перед автоудалением
+RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', '30'))
+# Как часто запускать очистку и через сколько секунд после старта (в секундах)
+RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', '3600'))
+RETENTION_FIRST_RUN = int(os.getenv('RETENTION_FIRST_RUN', '60'))
+# Сколько заявок удалять одним запросом
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '500'))
+
+# Как часто сверять сводную статистику с таблицей заявок (секунды) и сколько сотрудников показывать в /stats
+STATS_RECONCILE_INTERVAL = int(os.getenv('STATS_RECONCILE_INTERVAL', '3600'))
+STATS_TOP_WORKERS = int(os.getenv('STATS_TOP_WORKERS', '10'))
+
+# Сколько строк выгрузки /export читать из БД за раз
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '1000'))
+
+# Сколько заявок показывать на одной странице списка
+PAGE_SIZE = int(os.getenv('PAGE_SIZE', '5'))
+# Количество результатов поиска на странице и максимум слов в поисковом запросе
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '5'))
+SEARCH_MAX_TERMS = 10
+# Сколько самых новых совпадений полнотекстового поиска ранжировать по релевантности:
+# bm25 по всем совпадениям частого слова занимал десятки миллисекунд на миллионе заявок
+SEARCH_CANDIDATES = int(os.getenv('SEARCH_CANDIDATES', '1000'))
+
+# Максимум результатов в ответе на inline-запрос
+INLINE_RESULTS_LIMIT = 20
+# Сколько часов помнить отправленные карточки для обновления на месте
+CARD_TTL_HOURS = int(os.getenv('CARD_TTL_HOURS', '48'))
+# Максимальная длина сообщения в Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+# Заголовки и тексты пустых страниц для списков заявок
+VIEW_TITLES = {
+    'active': "📋 <b>Активные заявки</b>",
+    'completed': f"✅ <b>Выполненные заявки за {RETENTION_DAYS} дней</b>",
+    'cancelled': f"❌ <b>Отмененные заявки за {RETENTION_DAYS} дней</b>",
+}
+
+VIEW_EMPTY_TEXTS = {
+    'active': "Активных заявок не найдено. Если вы администратор, это значит, что все заявки выполнены или отменены. Если вы сотрудник, у вас пока нет активных заявок.",
+    'completed': f"Выполненных заявок за последние {RETENTION_DAYS} дней не найдено.",
+    'cancelled': f"Отменённых заявок за последние {RETENTION_DAYS} дней не найдено.",
+}
+
+# Разделитель карточек заявок внутри одного сообщения
+CARD_SEPARATOR = "\n\n➖➖➖➖➖\n\n"
+
+# Список, кнопки которого показываются для заявки в данном статусе
+STATUS_VIEWS = {
+    'new': 'active',
+    'in_progress': 'active',
+    'completed': 'completed',
+    'cancelled': 'cancelled',
+}
+
+# Снимок пользователя для кэша: только то, что нужно обработчикам
+CachedUser = namedtuple('CachedUser', ['id', 'telegram_id', 'username', 'is_admin'])
+
+# Ограниченный LRU-кэш пользователей по Telegram ID с временем жизни записей.
+# Сбрасывается целиком, если в БД изменилась версия 'users' (например, manage_admins.py)
+class UserCache:
+    def __init__(self, maxsize, ttl, version_check_interval):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # telegram_id -> (CachedUser или None, истекает_в)
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked_at = 0.0
+
+    # Возвращает (найдено_ли, пользователь). None тоже кэшируется - незарегистрированный пользователь
+    def get(self, telegram_id):
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(telegram_id)
+                self.hits += 1
+                return True, entry[0]
+            if entry is not None:
+                del self._entries[telegram_id]
+            self.misses += 1
+            return False, None
+
+    def put(self, telegram_id, user):
+        with self._lock:
+            self._entries[telegram_id] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(telegram_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    # Удаляет одного пользователя или, без аргумента, весь кэш
+    def invalidate(self, telegram_id=None):
+        with self._lock:
+            if telegram_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(telegram_id, None)
+
+    def version_check_due(self):
+        return time.monotonic() - self._version_checked_at >= self.version_check_interval
+
+    # Сравнивает версию из БД с известной и сбрасывает кэш, если она изменилась
+    def sync_version(self, version):
+        with self._lock:
+            if self._version is not None and version != self._version:
+                self._entries.clear()
+            self._version = version
+            self._version_checked_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+user_cache = UserCache(
+    maxsize=int(os.getenv('USER_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('USER_CACHE_TTL', '300')),
+    version_check_interval=float(os.getenv('USER_CACHE_VERSION_CHECK', '5')),
+)
+
+# Кнопки действий для одной заявки в списке
+def get_request_buttons(view, request_id, status, is_admin):
+    if view == 'active':
+        # Кнопки для всех работников (не только для своих заявок)
+        if is_admin:
+            return []
+        if status == 'new':
+            return [
+                InlineKeyboardButton(f"✅ Принять #{request_id}", callback_data=request_callback('complete', request_id)),
+                InlineKeyboardButton(f"❌ Отклонить #{request_id}", callback_data=request_callback('cancel', request_id))
+            ]
+        if status == 'in_progress':
+            return [InlineKeyboardButton(f"✅ Принять #{request_id}", callback_data=request_callback('complete', request_id))]
+        return []
+    if view == 'completed':
+        return [
+            InlineKeyboardButton(f"🔄 Восстановить #{request_id}", callback_data=request_callback('restore_completed', request_id)),
+            InlineKeyboardButton(f"🗑 Удалить #{request_id}", callback_data=request_callback('delete_completed', request_id))
+        ]
+    return [
+        InlineKeyboardButton(f"🔄 Восстановить #{request_id}", callback_data=request_callback('restore_cancelled', request_id)),
+        InlineKeyboardButton(f"🗑 Удалить #{request_id}", callback_data=request_callback('delete_cancelled', request_id))
+    ]
+
+# Добавляет к заголовку карточки заявок, пока они помещаются в одно сообщение.
+# view=None - кнопки выбираются по статусу каждой заявки.
+# Возвращает (текст, кнопки заявок, id показанных заявок, остались ли непоказанные)
+def layout_cards(title, cards, is_admin, view=None):
+    text = title
+    keyboard = []
+    shown_ids = []
+
+    for request_id, status, card in cards:
+        # Не выходим за лимит длины сообщения - остальные карточки уйдут на следующую страницу
+        if shown_ids and len(text) + len(CARD_SEPARATOR) + len(card) > MAX_MESSAGE_LENGTH:
+            return text, keyboard, shown_ids, True
+        text += CARD_SEPARATOR + card
+        shown_ids.append(request_id)
+        buttons = get_request_buttons(view or STATUS_VIEWS.get(status, 'active'), request_id, status, is_admin)
+        if buttons:
+            keyboard.append(buttons)
+    return text, keyboard, shown_ids, False
+
+# Собирает сообщение одной страницы списка: текст карточек, кнопки заявок и навигацию ◀/▶.
+# Возвращает (текст, клавиатура, id показанных заявок)
+def build_page_message(view, page, is_admin):
+    cards, has_prev, has_next = page
+    text, keyboard, shown_ids, overflow = layout_cards(VIEW_TITLES[view], cards, is_admin, view)
+    has_next = has_next or overflow
+
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("◀", callback_data=page_callback(view, True, shown_ids[0])))
+    if has_next:
+        navigation.append(InlineKeyboardButton("▶", callback_data=page_callback(view, False, shown_ids[-1])))
+    if navigation:
+        keyboard.append(navigation)
+
+    return text, InlineKeyboardMarkup(keyboard) if keyboard else None, shown_ids
+
+# Собирает страницу результатов поиска. offset - сколько результатов пропущено.
+# Навигация ◀/▶ передаёт смещение соседней страницы, сам запрос хранится в user_data
+def build_search_message(query_text, offset, page, is_admin):
+    cards, has_prev, has_next = page
+    title = f"🔍 <b>Поиск:</b> {escape_html(query_text)}"
+    text, keyboard, shown_ids, overflow = layout_cards(title, cards, is_admin)
+    has_next = has_next or overflow
+
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("◀", callback_data=search_callback(max(0, offset - SEARCH_PAGE_SIZE))))
+    if has_next:
+        navigation.append(InlineKeyboardButton("▶", callback_data=search_callback(offset + len(shown_ids))))
+    if navigation:
+        keyboard.append(navigation)
+
+    return text, InlineKeyboardMarkup(keyboard) if keyboard else None
+
+# Ищет пользователя по Telegram ID. Возвращает CachedUser или None
+def get_user(telegram_id):
+    if user_cache.version_check_due():
+        session = Session()
+        try:
+            user_cache.sync_version(read_users_version(session))
+        finally:
+            session.close()
+
+    found, user = user_cache.get(telegram_id)
+    if found:
+        return user
+
+    session = Session()
+    try:
+        user = session.query(User).filter(User.telegram_id == telegram_id).first()
+        cached = CachedUser(user.id, user.telegram_id, user.username, user.is_admin) if user else None
+        user_cache.put(telegram_id, cached)
+        return cached
+    finally:
+        session.close()
+
+# Регистрирует пользователя, если его ещё нет. Возвращает (пользователь, создан_ли)
+def register_user(telegram_id, username):
+    user = get_user(telegram_id)
+    if user:
+        return user, False
+
+    session = Session()
+    try:
+        user = User(telegram_id=telegram_id, username=username, is_admin=False)
+        session.add(user)
+        bump_users_version(session)
+        session.commit()
+        user_cache.invalidate(telegram_id)
+        return user, True
+    finally:
+        session.close()
+
+# Сохраняет новую заявку от пользователя. Возвращает (пользователь, id заявки) или (None, None),
+# если пользователь не найден
+def save_request(telegram_id, data):
+    user = get_user(telegram_id)
+    if not user:
+        return None, None
+
+    session = Session()
+    try:
+        request = Request(
+            user_id=user.id,
+            equipment_name=data['equipment'],
+            quantity=data['quantity'],
+            description=data['description'],
+            priority=data['priority'],
+            status='new'
+        )
+        session.add(request)
+        apply_stats_delta(session, stats_delta(added=[StatsRow('new', data['priority'], None, None, None)]))
+        # Рассылка о заявке сохраняется вместе с ней и после перезапуска не потеряется
+        session.flush()
+        session.add(NotificationFanout(request_id=request.id))
+        session.commit()
+        return user, request.id
+    finally:
+        session.close()
+
+# Сохраняет проверенные заявки из таблицы одним пакетным INSERT в одной транзакции.
+# Возвращает id созданных заявок или None, если пользователь не найден
+def import_requests(telegram_id, requests):
+    user = get_user(telegram_id)
+    if not user:
+        return None
+
+    session = Session()
+    try:
+        request_ids = session.scalars(insert(Request).returning(Request.id), [
+            {
+                'user_id': user.id,
+                'equipment_name': request['equipment'],
+                'quantity': request['quantity'],
+                'description': request['description'],
+                'priority': request['priority'],
+                'notes': request['notes'],
+                'status': 'new',
+            }
+            for request in requests
+        ]).all()
+        apply_stats_delta(session, stats_delta(added=[
+            StatsRow('new', request['priority'], None, None, None) for request in requests
+        ]))
+        session.execute(insert(NotificationFanout), [{'request_id': request_id} for request_id in request_ids])
+        session.commit()
+        return request_ids
+    finally:
+        session.close()
+
+# Условия выборки, колонка сортировки и подгрузка связей для каждого списка заявок.
+# Пользователи, принявшие или отменившие заявку, загружаются тем же запросом (без N+1)
+def view_query(view):
+    retention_start = datetime.now(timezone.utc) - timedelta(days=RETENTION_DAYS)
+    if view == 'active':
+        # Активные заявки: не выполненные, не отмененные, не удаленные
+        return Request.created_at, [
+            Request.is_deleted == False,
+            Request.status.in_(['new', 'in_progress'])
+        ], []
+    if view == 'completed':
+        # Выполненные заявки за срок хранения
+        return Request.completed_at, [
+            Request.status == 'completed',
+            Request.is_deleted == False,
+            Request.completed_at >= retention_start
+        ], [joinedload(Request.completed_by)]
+    if view == 'cancelled':
+        # Отменённые заявки за срок хранения
+        return Request.updated_at, [
+            Request.status == 'cancelled',
+            Request.updated_at >= retention_start
+        ], [joinedload(Request.cancelled_by)]
+    raise ValueError(f"Неизвестный список заявок: {view}")
+
+# Загружает одну страницу списка заявок keyset-пагинацией по (колонка сортировки, id).
+# cursor_id - заявка на границе предыдущей страницы, backwards - листаем назад.
+# Возвращает (карточки [(id, статус, текст)], есть_ли_предыдущая, есть_ли_следующая)
+def load_page(view, cursor_id=None, backwards=False):
+    sort_column, conditions, options = view_query(view)
+    session = Session()
+    try:
+        query = session.query(Request).options(*options).filter(*conditions)
+
+        if cursor_id is not None and session.scalar(select(Request.id).where(Request.id == cursor_id, *conditions)) is None:
+            # Граничная заявка исчезла или ушла из списка (восстановлена, удалена) - её колонка
+            # сортировки больше не задаёт место на странице, начинаем с первой страницы
+            cursor_id, backwards = None, False
+
+        if cursor_id is not None:
+            # Значение колонки граничной заявки берём подзапросом, чтобы сравнивать
+            # с тем, что лежит в БД, а не с его Python-представлением
+            cursor_row = aliased(Request)
+            cursor_value = select(getattr(cursor_row, sort_column.key)).where(
+                cursor_row.id == cursor_id
+            ).scalar_subquery()
+            key = tuple_(sort_column, Request.id)
+            cursor = tuple_(cursor_value, literal(cursor_id))
+            query = query.filter(key > cursor if backwards else key < cursor)
+
+        if backwards:
+            query = query.order_by(sort_column.asc(), Request.id.asc())
+        else:
+            query = query.order_by(sort_column.desc(), Request.id.desc())
+
+        # Берём на одну запись больше, чтобы понять, есть ли ещё страница
+        requests = query.limit(PAGE_SIZE + 1).all()
+        has_more = len(requests) > PAGE_SIZE
+        requests = requests[:PAGE_SIZE]
+        if backwards:
+            requests.reverse()
+            has_prev, has_next = has_more, True
+        else:
+            has_prev, has_next = cursor_id is not None, has_more
+
+        formatter = VIEW_FORMATTERS[view]
+        cards = [(req.id, req.status, formatter(req)) for req in requests]
+        return cards, has_prev, has_next
+    finally:
+        session.close()
+
+# Полнотекстовый индекс заявок как таблица для запросов SQLAlchemy
+requests_fts = table('requests_fts', column('rowid'))
+
+# Слова поискового запроса (знаки препинания и операторы FTS5 отбрасываются)
+def search_terms(query_text):
+    return re.findall(r'\w+', query_text.lower())[:SEARCH_MAX_TERMS]
+
+# Заявки, доступные пользователю для поиска: администраторам - все, сотрудникам - активные
+def searchable_requests(session, is_admin):
+    query = session.query(Request).options(
+        joinedload(Request.completed_by), joinedload(Request.cancelled_by)
+    ).filter(Request.is_deleted == False)
+    if not is_admin:
+        query = query.filter(Request.status.in_(['new', 'in_progress']))
+    return query
+
+# Поиск по полнотекстовому индексу SQLite FTS5: фраза в кавычках со звёздочкой - поиск по префиксу.
+# Индекс отдаёт SEARCH_CANDIDATES самых новых совпадений (по rowid, без подсчёта релевантности всех),
+# и только они ранжируются bm25 с повышенным весом названия оборудования (меньше значение - выше в выдаче)
+def fts_search_query(query, terms):
+    match = ' '.join(f'"{term}"*' for term in terms)
+    fts = literal_column('requests_fts')
+    candidates = select(
+        requests_fts.c.rowid, func.bm25(fts, 3.0, 1.0, 1.0).label('score')
+    ).select_from(requests_fts).where(
+        fts.op('MATCH')(match)
+    ).order_by(requests_fts.c.rowid.desc()).limit(SEARCH_CANDIDATES).subquery()
+    return query.join(candidates, candidates.c.rowid == Request.id).order_by(candidates.c.score, Request.id.desc())
+
+# Поиск подстрок через LIKE для СУБД без FTS5: просмотр таблицы, новые заявки первыми
+def like_search_query(query, terms):
+    for term in terms:
+        query = query.filter(or_(*[
+            func.lower(field).contains(term, autoescape=True)
+            for field in (Request.equipment_name, Request.description, Request.notes)
+        ]))
+    return query.order_by(Request.created_at.desc(), Request.id.desc())
+
+# Запрос поиска заявок по оборудованию, описанию и заметкам, отсортированный по релевантности.
+# Все слова должны встретиться, каждое - как начало слова
+def search_query(session, terms, is_admin):
+    query = searchable_requests(session, is_admin)
+    if session.get_bind().dialect.name == 'sqlite':
+        return fts_search_query(query, terms)
+    return like_search_query(query, terms)
+
+# Ищет заявки для /search.
+# Возвращает (карточки [(id, статус, текст)], есть_ли_предыдущая, есть_ли_следующая)
+def search_requests(query_text, is_admin, offset=0):
+    terms = search_terms(query_text)
+    if not terms:
+        return [], False, False
+
+    session = Session()
+    try:
+        query = search_query(session, terms, is_admin)
+        # Берём на одну запись больше, чтобы понять, есть ли ещё страница
+        requests = query.offset(offset).limit(SEARCH_PAGE_SIZE + 1).all()
+        cards = [(req.id, req.status, format_request_details(req)) for req in requests[:SEARCH_PAGE_SIZE]]
+        return cards, offset > 0, len(requests) > SEARCH_PAGE_SIZE
+    finally:
+        session.close()
+
+# Ищет заявки для inline-режима: "#123" или "123" - заявка по номеру, иначе поиск по тексту.
+# Возвращает [(id, статус, оборудование, текст карточки)]
+def inline_lookup(telegram_id, query_text):
+    user = get_user(telegram_id)
+    if user is None:
+        return []
+
+    session = Session()
+    try:
+        number = query_text.strip().lstrip('#')
+        if number.isdigit():
+            requests = searchable_requests(session, user.is_admin).filter(Request.id == int(number)).all()
+        else:
+            terms = search_terms(query_text)
+            if not terms:
+                return []
+            requests = search_query(session, terms, user.is_admin).limit(INLINE_RESULTS_LIMIT).all()
+        return [(req.id, req.status, req.equipment_name, format_request_details(req)) for req in requests]
+    finally:
+        session.close()
+
+# Переходы статусов заявки по кнопкам: действие -> (допустимые исходные статусы, новый статус,
+# только для администраторов). Новый статус None означает удаление заявки
+STATUS_TRANSITIONS = {
+    'complete': (('new', 'in_progress'), 'completed', False),
+    'cancel': (('new', 'in_progress'), 'cancelled', False),
+    'restore_completed': (('completed',), 'new', True),
+    'restore_cancelled': (('cancelled',), 'new', True),
+    'delete_completed': (('completed',), None, True),
+    'delete_cancelled': (('cancelled',), None, True),
+}
+
+# Сообщения об отказе в доступе для действий администратора
+ACCESS_DENIED_TEXTS = {
+    'restore_completed': "🔒 Доступ ограничен\n\nУ вас нет прав для выполнения этого действия.",
+    'restore_cancelled': "🔒 Доступ ограничен\n\nУ вас нет прав для выполнения этого действия.",
+    'delete_completed': "🔒 Доступ ограничен\n\nУдаление доступно только администраторам.",
+    'delete_cancelled': "🔒 Доступ ограничен\n\nУдаление доступно только администраторам.",
+}
+
+# Значения полей заявки после перехода в новый статус
+def transition_values(new_status, user):
+    if new_status == 'completed':
+        return {'status': 'completed', 'completed_at': datetime.now(timezone.utc), 'completed_by_id': user.id}
+    if new_status == 'cancelled':
+        return {'status': 'cancelled', 'cancelled_by_id': user.id}
+    return {'status': 'new', 'completed_at': None, 'completed_by_id': None, 'cancelled_by_id': None}
+
+# Атомарно выполняет переход для прочитанной заявки: UPDATE (или DELETE) ... WHERE id = ? AND status = <прочитанный>.
+# Сводная статистика меняется в той же транзакции. Возвращает True, если переход выполнил именно этот вызов
+def apply_transition(session, request, action, user):
+    from_statuses, new_status, _ = STATUS_TRANSITIONS[action]
+    if request.status not in from_statuses:
+        return False
+    condition = and_(Request.id == request.id, Request.status == request.status)
+    if new_status is None:
+        # Журнал уведомлений ссылается на заявку внешним ключом (PostgreSQL его проверяет) -
+        # удаляем его в той же транзакции до самой заявки
+        session.execute(delete(NotificationDelivery).where(NotificationDelivery.request_id == request.id))
+        statement = delete(Request).where(condition)
+        added = []
+    else:
+        values = transition_values(new_status, user)
+        statement = update(Request).where(condition).values(**values)
+        added = [StatsRow(
+            values['status'], request.priority, request.created_at,
+            values.get('completed_at', request.completed_at), values.get('completed_by_id', request.completed_by_id)
+        )]
+    result = session.execute(statement.execution_options(synchronize_session=False))
+    if result.rowcount != 1:
+        session.rollback()
+        return False
+    apply_stats_delta(session, stats_delta(removed=[request], added=added))
+    session.commit()
+    return True
+
+# Выполняет действие inline-кнопки с заявкой. action - ключ STATUS_TRANSITIONS из проверенной
+# callback_data. Возвращает (текст ответа, parse_mode, id изменённой заявки или None)
+def process_callback(telegram_id, action, request_id):
+    user = get_user(telegram_id)
+    if not user:
+        return "Пользователь не найден в системе.", None, None
+
+    _, _, admin_only = STATUS_TRANSITIONS[action]
+    if admin_only and not user.is_admin:
+        return ACCESS_DENIED_TEXTS[action], None, None
+
+    session = Session()
+    try:
+        request = session.get(Request, request_id)
+        if not request:
+            return "Заявка не найдена в системе.", None, None
+        # Данные для ответа запоминаем до изменения: после удаления строки их уже не прочитать
+        equipment_name, quantity = request.equipment_name, request.quantity
+
+        if not apply_transition(session, request, action, user):
+            # Кто-то успел раньше - показываем актуальное состояние заявки
+            request = session.query(Request).options(
+                joinedload(Request.completed_by), joinedload(Request.cancelled_by)
+            ).filter(Request.id == request_id).populate_existing().first()
+            if not request:
+                return "Заявка уже удалена из системы.", None, None
+            return format_transition_conflict(request), None, None
+
+        return format_transition_result(action, request_id, equipment_name, quantity, user), 'HTML', request_id
+    finally:
+        session.close()
+
+# Читает сводную статистику для /stats. Объём работы не зависит от числа заявок:
+# читаются только счётчики и пользователи из первых STATS_TOP_WORKERS
+def load_request_stats():
+    session = Session()
+    try:
+        totals = {}
+        for metric, key, value in session.query(RequestStat.metric, RequestStat.key, RequestStat.value).filter(
+            RequestStat.metric != 'worker'
+        ):
+            totals.setdefault(metric, {})[key] = value
+
+        top = session.query(RequestStat.key, RequestStat.value).filter(
+            RequestStat.metric == 'worker', RequestStat.value > 0
+        ).order_by(RequestStat.value.desc()).limit(STATS_TOP_WORKERS).all()
+        users = {
+            user.id: user for user in session.query(User).filter(User.id.in_([int(key) for key, _ in top]))
+        } if top else {}
+        totals['workers'] = [(users.get(int(key)), value) for key, value in top]
+        return totals
+    finally:
+        session.close()
+
+# Число заявок по статусам и приоритетам из сводной статистики (для метрик)
+def load_request_totals():
+    session = Session()
+    try:
+        totals = {'status': {}, 'priority': {}}
+        for metric, key, value in session.query(RequestStat.metric, RequestStat.key, RequestStat.value).filter(
+            RequestStat.metric.in_(totals)
+        ):
+            totals[metric][key] = value
+        return totals
+    finally:
+        session.close()
+
+# Строки выгрузки заявок, созданных в [since, until): заявка, её автор и исполнители.
+# Читаются из БД порциями по EXPORT_CHUNK_SIZE, поэтому память не растёт с числом заявок
+def iter_export_rows(since=None, until=None):
+    author, completed_by, cancelled_by = aliased(User), aliased(User), aliased(User)
+    query = (
+        select(
+            Request.id, Request.equipment_name, Request.quantity, Request.description,
+            Request.priority, Request.status, Request.created_at, Request.completed_at,
+            author.username, completed_by.username, cancelled_by.username, Request.notes,
+        )
+        .outerjoin(author, author.id == Request.user_id)
+        .outerjoin(completed_by, completed_by.id == Request.completed_by_id)
+        .outerjoin(cancelled_by, cancelled_by.id == Request.cancelled_by_id)
+        .where(Request.is_deleted == False)
+        .order_by(Request.id)
+    )
+    if since is not None:
+        query = query.where(Request.created_at >= since)
+    if until is not None:
+        query = query.where(Request.created_at < until)
+
+    session = Session()
+    try:
+        yield from session.execute(query.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+    finally:
+        session.close()
+
+# Выгружает заявки в файл. Возвращает число выгруженных заявок
+def export_to_file(path, export_format, since=None, until=None):
+    return export_requests(path, iter_export_rows(since, until), export_format)
+
+# Загружает карточку заявки для уведомления: (статус, текст) или None, если заявки уже нет
+def load_request_card(request_id):
+    session = Session()
+    try:
+        request = session.get(Request, request_id)
+        if not request:
+            return None
+        return request.status, format_request_details(request)
+    finally:
+        session.close()
+
+# Начинает или продолжает рассылку о заявке. Возвращает id пользователя, после которого
+# продолжать (0 - с начала), или None, если рассылка уже завершена. Записи прерванной пачки
+# (созданные, но без сохранённых результатов) удаляются: эта пачка будет разослана заново
+def begin_fan_out(request_id):
+    session = Session()
+    try:
+        fanout = session.query(NotificationFanout).filter(NotificationFanout.request_id == request_id).first()
+        if fanout is None:
+            fanout = NotificationFanout(request_id=request_id, after_user_id=0)
+            session.add(fanout)
+        elif fanout.finished_at is not None:
+            return None
+        session.execute(delete(NotificationDelivery).where(
+            NotificationDelivery.request_id == request_id,
+            NotificationDelivery.status == 'pending',
+            NotificationDelivery.user_id > fanout.after_user_id
+        ))
+        session.commit()
+        return fanout.after_user_id
+    finally:
+        session.close()
+
+# Отмечает рассылку о заявке завершённой
+def finish_fan_out(request_id):
+    session = Session()
+    try:
+        session.execute(
+            update(NotificationFanout).where(NotificationFanout.request_id == request_id)
+            .values(finished_at=datetime.now(timezone.utc))
+        )
+        session.commit()
+    finally:
+        session.close()
+
+# Заявки с незавершённой рассылкой (прерванной перезапуском бота), в порядке создания
+def load_unfinished_fan_outs():
+    session = Session()
+    try:
+        return session.scalars(
+            select(NotificationFanout.request_id)
+            .where(NotificationFanout.finished_at.is_(None))
+            .order_by(NotificationFanout.request_id)
+        ).all()
+    finally:
+        session.close()
+
+# Создаёт записи о доставке для следующей пачки сотрудников (keyset по users.id).
+# Возвращает [(id записи, id пользователя, telegram_id)]; пустой список, если заявку уже удалили
+def create_delivery_batch(request_id, after_user_id, batch_size):
+    session = Session()
+    try:
+        if session.get(Request, request_id) is None:
+            return []
+        recipients = session.query(User.id, User.telegram_id).filter(
+            User.is_admin == False,
+            User.id > after_user_id
+        ).order_by(User.id).limit(batch_size).all()
+        deliveries = [NotificationDelivery(request_id=request_id, user_id=user_id) for user_id, _ in recipients]
+        session.add_all(deliveries)
+        session.commit()
+        return [
+            (delivery.id, user_id, telegram_id)
+            for delivery, (user_id, telegram_id) in zip(deliveries, recipients)
+        ]
+    finally:
+        session.close()
+
+# Сохраняет результаты доставки одной пачкой (UPDATE по первичному ключу для каждой записи),
+# регистрирует доставленные карточки [(chat_id, message_id)] и запоминает последнего
+# получателя пачки after_user_id, с которого рассылка продолжится после перезапуска
+def record_delivery_results(request_id, results, sent_messages, after_user_id):
+    session = Session()
+    try:
+        session.execute(update(NotificationDelivery), results)
+        session.execute(
+            update(NotificationFanout).where(NotificationFanout.request_id == request_id)
+            .values(after_user_id=after_user_id)
+        )
+        # Доставленные карточки запоминаем, чтобы обновлять их при смене статуса
+        session.add_all([
+            RequestCard(request_id=request_id, chat_id=chat_id, message_id=message_id)
+            for chat_id, message_id in sent_messages
+        ])
+        session.commit()
+    finally:
+        session.close()
+
+# Запоминает, какие заявки показаны на странице списка в сообщении (chat_id, message_id)
+def register_page_cards(chat_id, message_id, view, cursor_id, backwards, request_ids):
+    session = Session()
+    try:
+        session.execute(delete(RequestCard).where(
+            RequestCard.chat_id == chat_id,
+            RequestCard.message_id == message_id
+        ))
+        session.add_all([
+            RequestCard(request_id=request_id, chat_id=chat_id, message_id=message_id,
+                        view=view, cursor_id=cursor_id, backwards=backwards)
+            for request_id in request_ids
+        ])
+        session.commit()
+    finally:
+        session.close()
+
+# Забывает сообщение: его содержимое заменено, и заявки в нём больше не показаны
+def forget_cards(chat_id, message_id):
+    session = Session()
+    try:
+        session.execute(delete(RequestCard).where(
+            RequestCard.chat_id == chat_id,
+            RequestCard.message_id == message_id
+        ))
+        session.commit()
+    finally:
+        session.close()
+
+# Одной транзакцией забывает сообщения forgotten [(chat_id, message_id)] и заново запоминает
+# заявки на страницах pages {(chat_id, message_id): (карточка с границей страницы, id показанных заявок)}
+def refresh_message_cards(forgotten, pages):
+    messages = list(forgotten) + list(pages)
+    if not messages:
+        return
+    session = Session()
+    try:
+        session.execute(delete(RequestCard).where(tuple_(RequestCard.chat_id, RequestCard.message_id).in_(messages)))
+        rows = [
+            {'request_id': request_id, 'chat_id': chat_id, 'message_id': message_id,
+             'view': card.view, 'cursor_id': card.cursor_id, 'backwards': card.backwards}
+            for (chat_id, message_id), (card, shown_ids) in pages.items()
+            for request_id in shown_ids
+        ]
+        if rows:
+            session.execute(insert(RequestCard), rows)
+        session.commit()
+    finally:
+        session.close()
+
+# Готовит новое содержимое сообщений, в которых показаны изменённые заявки.
+# Число запросов к БД не зависит от числа сообщений: получатели читаются одним запросом,
+# каждая изменённая заявка рисуется один раз, а страница списка с одной границы строится
+# один раз на все сообщения, где она показана.
+# Возвращает [(chat_id, message_id, текст, клавиатура)] - по одному на сообщение
+def build_card_updates(request_ids):
+    session = Session()
+    try:
+        messages = {}
+        for card in session.query(RequestCard).filter(RequestCard.request_id.in_(request_ids)):
+            messages.setdefault((card.chat_id, card.message_id), card)
+        if not messages:
+            return []
+        viewers = dict(session.query(User.telegram_id, User.is_admin).filter(
+            User.telegram_id.in_({chat_id for chat_id, _ in messages})
+        ))
+        card_ids = {card.request_id for card in messages.values() if card.view is None}
+        requests = session.query(Request).options(
+            joinedload(Request.completed_by), joinedload(Request.cancelled_by)
+        ).filter(Request.id.in_(card_ids)).all() if card_ids else []
+        rendered = {request.id: (request.status, format_request_details(request)) for request in requests}
+    finally:
+        session.close()
+
+    updates = []
+    forgotten = []
+    pages = {}
+    loaded_pages = {}
+    page_messages = {}
+    for (chat_id, message_id), card in messages.items():
+        is_admin = bool(viewers.get(chat_id))
+
+        if card.view is None:
+            # Отдельная карточка заявки
+            if card.request_id not in rendered:
+                forgotten.append((chat_id, message_id))
+                updates.append((chat_id, message_id, f"🗑 Заявка #{card.request_id} удалена", None))
+                continue
+            status, text = rendered[card.request_id]
+            buttons = get_request_buttons('active', card.request_id, status, is_admin)
+            updates.append((chat_id, message_id, text, InlineKeyboardMarkup([buttons]) if buttons else None))
+            continue
+
+        # Страница списка: перестраиваем её с той же границы
+        page_key = (card.view, card.cursor_id, card.backwards)
+        if page_key not in loaded_pages:
+            loaded_pages[page_key] = load_page(*page_key)
+        page = loaded_pages[page_key]
+        if not page[0]:
+            forgotten.append((chat_id, message_id))
+            updates.append((chat_id, message_id, VIEW_EMPTY_TEXTS[card.view], None))
+            continue
+        if page_key + (is_admin,) not in page_messages:
+            page_messages[page_key + (is_admin,)] = build_page_message(card.view, page, is_admin)
+        text, reply_markup, shown_ids = page_messages[page_key + (is_admin,)]
+        pages[(chat_id, message_id)] = (card, shown_ids)
+        updates.append((chat_id, message_id, text, reply_markup))
+
+    refresh_message_cards(forgotten, pages)
+    return updates
+
+# Форматирование карточки для каждого списка заявок
+VIEW_FORMATTERS = {
+    'active': format_request_details,
+    'completed': functools.partial(format_completed_request, retention_days=RETENTION_DAYS),
+    'cancelled': functools.partial(format_cancelled_request, retention_days=RETENTION_DAYS),
+}
+
+# Удаляет строки модели по условию пачками: один DELETE ... WHERE id IN (...) на пачку,
+# каждая пачка в своей короткой транзакции. Возвращает число удалённых строк
+# on_delete(session, rows) получает удалённые строки (DELETE ... RETURNING returning) в той же транзакции.
+# dependents - колонки внешних ключей на модель: ссылающиеся строки удаляются перед пачкой
+def delete_in_batches(model, condition, batch_size, returning=None, on_delete=None, dependents=()):
+    removed = 0
+    while True:
+        session = Session()
+        try:
+            ids = session.scalars(select(model.id).where(condition).limit(batch_size)).all()
+            if not ids:
+                return removed
+            for foreign_key in dependents:
+                session.execute(delete(foreign_key.table).where(foreign_key.in_(ids)))
+            statement = delete(model).where(model.id.in_(ids), condition).execution_options(synchronize_session=False)
+            if on_delete is None:
+                count = session.execute(statement).rowcount
+            else:
+                rows = session.execute(statement.returning(*returning)).all()
+                on_delete(session, rows)
+                count = len(rows)
+            session.commit()
+        finally:
+            session.close()
+        removed += count
+        if len(ids) < batch_size:
+            return removed
+
+# Вычитает удалённые заявки из сводной статистики
+def subtract_request_stats(session, rows):
+    apply_stats_delta(session, stats_delta(removed=rows))
+
+# Удаляет заявки, журнал уведомлений и карточки с истёкшим сроком хранения.
+# Возвращает число удалённых строк по статусам заявок, уведомлениям и карточкам
+def purge_expired_requests(batch_size=None):
+    batch_size = batch_size or RETENTION_BATCH_SIZE
+    cutoff = datetime.now(timezone.utc) - timedelta(days=RETENTION_DAYS)
+    return {
+        # Отмененные заявки старше срока хранения
+        'cancelled': delete_in_batches(
+            Request, and_(Request.status == 'cancelled', Request.updated_at < cutoff), batch_size,
+            STATS_COLUMNS, subtract_request_stats, dependents=[NotificationDelivery.request_id]
+        ),
+        # Выполненные заявки старше срока хранения
+        'completed': delete_in_batches(
+            Request, and_(Request.status == 'completed', Request.completed_at < cutoff), batch_size,
+            STATS_COLUMNS, subtract_request_stats, dependents=[NotificationDelivery.request_id]
+        ),
+        # Записи о доставке уведомлений и завершённые рассылки старше срока хранения
+        'notifications': delete_in_batches(
+            NotificationDelivery, NotificationDelivery.created_at < cutoff, batch_size
+        ) + delete_in_batches(
+            NotificationFanout, NotificationFanout.finished_at < cutoff, batch_size
+        ),
+        # Карточки, которые больше не обновляем (TTL)
+        'cards': delete_in_batches(
+            RequestCard,
+            RequestCard.created_at < datetime.now(timezone.utc) - timedelta(hours=CARD_TTL_HOURS),
+            batch_size
+        ),
+    }
+
+# Пересчитывает сводную статистику по всей таблице заявок и заменяет ею счётчики.
+# Долгий пересчёт идёт вне пишущей транзакции, а замена - короткой транзакцией. Статистика
+# меняется в одной транзакции с заявками, поэтому если счётчики не изменились за время пересчёта,
+# то и пересчитанные заявки те же; иначе пересчёт повторяется (до attempts раз).
+# Возвращает число счётчиков, разошедшихся с пересчитанными значениями, или None,
+# если заявки всё время менялись и сверка отложена до следующего запуска
+def reconcile_request_stats(attempts=3):
+    for _ in range(attempts):
+        session = Session()
+        try:
+            previous = {(stat.metric, stat.key): stat.value for stat in session.query(RequestStat)}
+            totals = compute_request_stats(session.connection())
+        finally:
+            session.close()
+
+        session = Session()
+        try:
+            # DELETE блокирует счётчики до конца транзакции и возвращает их текущие значения
+            current = session.execute(
+                delete(RequestStat).returning(RequestStat.metric, RequestStat.key, RequestStat.value)
+            ).all()
+            if {(metric, key): value for metric, key, value in current} != previous:
+                session.rollback()
+                continue
+            if totals:
+                session.execute(insert(RequestStat), [
+                    {'metric': metric, 'key': key, 'value': value} for (metric, key), value in totals.items()
+                ])
+            session.commit()
+        finally:
+            session.close()
+        return sum(1 for key in previous.keys() | totals.keys() if previous.get(key, 0) != totals.get(key, 0))
+    return None
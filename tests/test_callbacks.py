@@ -0,0 +1,124 @@
+import base64
+import string
+
+import pytest
+
+from callbacks import (
+    CALLBACK_KEY, ENCODED_SIZE, MAX_ARG, OPCODES, PAYLOAD, PROTOCOL_VERSION,
+    Callback, CallbackDataError, current_hour, decode_callback, encode_callback, parse_page_callback, sign,
+)
+
+# Фаззинг разбора callback_data: на любую строку decode_callback возвращает Callback
+# или бросает CallbackDataError, но не другие исключения
+ROUNDS = 2000
+NOW = 1_700_000_000
+ALPHABET = string.ascii_letters + string.digits + '-_'
+
+def decode(data, **kwargs):
+    kwargs.setdefault('now', NOW)
+    try:
+        result = decode_callback(data, **kwargs)
+    except CallbackDataError as e:
+        assert e.reason in ('malformed', 'forged', 'stale')
+        return e
+    assert isinstance(result, Callback)
+    return result
+
+def random_callback(rng):
+    return rng.choice(sorted(OPCODES)), rng.randint(0, MAX_ARG), rng.randint(0, 255)
+
+# Подписанная кнопка с произвольными полями, в том числе недопустимыми для encode_callback
+def signed(version, opcode, arg, aux, issued, key=CALLBACK_KEY):
+    payload = PAYLOAD.pack(version, opcode, arg, aux, issued)
+    return base64.urlsafe_b64encode(payload + sign(payload, key)).rstrip(b'=').decode('ascii')
+
+def test_round_trip(rng):
+    for _ in range(ROUNDS):
+        opcode, arg, aux = random_callback(rng)
+        data = encode_callback(opcode, arg, aux, now=NOW)
+        assert len(data) == ENCODED_SIZE <= 64
+        assert decode(data) == Callback(opcode, arg, aux, current_hour(NOW))
+
+def test_random_strings(rng):
+    alphabets = [ALPHABET, string.printable, ALPHABET + '=+/', 'аяё🔧\x00\n ']
+    for _ in range(ROUNDS):
+        size = rng.choice([0, 1, ENCODED_SIZE - 1, ENCODED_SIZE, ENCODED_SIZE + 1, rng.randint(0, 128)])
+        data = ''.join(rng.choice(rng.choice(alphabets)) for _ in range(size))
+        result = decode(data)
+        # Случайная строка правильной длины почти наверняка не подписана нашим ключом
+        assert isinstance(result, CallbackDataError)
+
+# Повреждённые кнопки: заменённый, удалённый или добавленный символ, перестановка
+def test_mutated_tokens(rng):
+    for _ in range(ROUNDS):
+        data = list(encode_callback(*random_callback(rng), now=NOW))
+        position = rng.randrange(len(data))
+        mutation = rng.choice(['replace', 'delete', 'insert', 'swap'])
+        if mutation == 'replace':
+            data[position] = rng.choice(ALPHABET.replace(data[position], ''))
+        elif mutation == 'delete':
+            del data[position]
+        elif mutation == 'insert':
+            data.insert(position, rng.choice(ALPHABET))
+        else:
+            other = rng.randrange(len(data))
+            if data[other] == data[position]:
+                continue
+            data[position], data[other] = data[other], data[position]
+        result = decode(''.join(data))
+        # Последний символ base64 содержит незначащие биты: его замена может дать ту же кнопку
+        if isinstance(result, Callback):
+            assert mutation == 'replace' and position == len(data) - 1
+        else:
+            assert result.reason in ('malformed', 'forged')
+
+def test_wrong_key(rng):
+    for _ in range(ROUNDS // 10):
+        key = rng.randbytes(32)
+        result = decode(encode_callback(*random_callback(rng), key=key, now=NOW))
+        assert isinstance(result, CallbackDataError) and result.reason == 'forged'
+
+def test_expired_and_future_issued(rng):
+    max_age = 24
+    for _ in range(ROUNDS):
+        opcode, arg, aux = random_callback(rng)
+        age = rng.randint(-1000, 1000)
+        data = signed(PROTOCOL_VERSION, opcode, arg, aux, current_hour(NOW) - age)
+        result = decode(data, max_age_hours=max_age)
+        if age > max_age:
+            assert isinstance(result, CallbackDataError) and result.reason == 'stale'
+        else:
+            assert isinstance(result, Callback)
+        # Без ограничения срока кнопка принимается в любом возрасте
+        assert isinstance(decode(data, max_age_hours=0), Callback)
+
+# Подписанные нашим ключом, но с чужой версией формата или неизвестной операцией
+def test_signed_invalid_fields(rng):
+    for _ in range(ROUNDS):
+        version, opcode = rng.randint(0, 255), rng.randint(0, 255)
+        data = signed(version, opcode, rng.randint(0, MAX_ARG), rng.randint(0, 255), rng.randint(0, 2 ** 32 - 1))
+        result = decode(data, max_age_hours=0)
+        if version != PROTOCOL_VERSION:
+            assert result.reason == 'stale'
+        elif opcode not in OPCODES:
+            assert result.reason == 'malformed'
+        else:
+            assert isinstance(result, Callback)
+            view, backwards = parse_page_callback(result)
+            assert view in (None, 'active', 'completed', 'cancelled') and isinstance(backwards, bool)
+
+# Кнопки из сообщений, отправленных до подписанного формата: restore_5, complete_12, page_active_3
+def test_legacy_strings(rng):
+    actions = ['complete', 'cancel', 'restore', 'restore_completed', 'restore_cancelled',
+               'delete_completed', 'delete_cancelled', 'page_active', 'page_completed', 'search']
+    for _ in range(ROUNDS):
+        data = f"{rng.choice(actions)}_{rng.randint(0, 10 ** rng.randint(1, 12))}"
+        result = decode(data)
+        assert isinstance(result, CallbackDataError)
+        # Старая строка длиной в новую кнопку проходит проверку формата, но не подписи
+        assert result.reason == ('forged' if len(data) == ENCODED_SIZE else 'malformed')
+
+@pytest.mark.parametrize('data', [None, b'restore_5', 5, ['restore_5'], '', ' ' * ENCODED_SIZE, '=' * ENCODED_SIZE])
+def test_non_callback_values(data):
+    result = decode(data)
+    assert isinstance(result, CallbackDataError) and result.reason == 'malformed'
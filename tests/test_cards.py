@@ -0,0 +1,75 @@
+from sqlalchemy import select
+
+from database import Session
+from models import RequestCard
+from services import build_card_updates, process_callback, register_page_cards
+
+def add_cards(request_id, chat_ids, message_id):
+    session = Session()
+    try:
+        session.add_all([
+            RequestCard(request_id=request_id, chat_id=chat_id, message_id=message_id) for chat_id in chat_ids
+        ])
+        session.commit()
+    finally:
+        session.close()
+
+def page_cards(chat_id, message_id):
+    session = Session()
+    try:
+        return session.scalars(select(RequestCard.request_id).where(
+            RequestCard.chat_id == chat_id, RequestCard.message_id == message_id
+        ).order_by(RequestCard.request_id)).all()
+    finally:
+        session.close()
+
+# Смена статуса заявки, разосланной многим сотрудникам: число запросов к БД
+# не растёт с числом сообщений, где она показана
+def test_card_updates_statement_count_is_constant(engine, make_user, make_request, count_statements):
+    make_user(1, is_admin=True)
+    workers = [2 + number for number in range(200)]
+    for telegram_id in workers:
+        make_user(telegram_id)
+    other_id = make_request(1, equipment='Дрель')
+
+    counts = {}
+    for size in (10, 100, 200):
+        request_id = make_request(1, equipment=f'Перфоратор {size}')
+        chat_ids = workers[:size]
+        # Отдельная карточка у каждого сотрудника и страница активных заявок у половины из них
+        add_cards(request_id, chat_ids, message_id=size)
+        for chat_id in chat_ids[::2]:
+            register_page_cards(chat_id, size + 1, 'active', None, False, [request_id, other_id])
+        process_callback(chat_ids[0], 'complete', request_id)
+
+        with count_statements(engine) as statements:
+            updates = build_card_updates([request_id])
+        counts[size] = len(statements)
+
+        assert len(updates) == size + len(chat_ids[::2])
+        cards = {(chat_id, message_id): text for chat_id, message_id, text, _ in updates}
+        assert "Выполнено" in cards[(chat_ids[-1], size)]
+        assert f"@user{chat_ids[0]}" in cards[(chat_ids[-1], size)]
+        # Принятая заявка ушла со страницы активных, страница перерегистрирована без неё
+        assert f"#{request_id}" not in cards[(chat_ids[0], size + 1)]
+        assert request_id not in page_cards(chat_ids[0], size + 1)
+        assert other_id in page_cards(chat_ids[0], size + 1)
+
+    assert counts[10] == counts[100] == counts[200]
+
+def test_card_updates_for_deleted_request(engine, make_user, make_request):
+    make_user(1, is_admin=True)
+    make_user(2)
+    request_id = make_request(1)
+    add_cards(request_id, [1, 2], message_id=5)
+    register_page_cards(2, 6, 'active', None, False, [request_id])
+    process_callback(2, 'cancel', request_id)
+    process_callback(1, 'delete_cancelled', request_id)
+
+    updates = {(chat_id, message_id): (text, markup) for chat_id, message_id, text, markup in build_card_updates([request_id])}
+
+    assert updates[(1, 5)] == (f"🗑 Заявка #{request_id} удалена", None)
+    assert updates[(2, 5)] == (f"🗑 Заявка #{request_id} удалена", None)
+    assert updates[(2, 6)][1] is None
+    # Сообщения без заявок забыты
+    assert page_cards(1, 5) == page_cards(2, 5) == page_cards(2, 6) == []
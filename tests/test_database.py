@@ -0,0 +1,100 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import func, select, update
+
+from database import SQLITE_BUSY_TIMEOUT, Session, run_db
+from models import Request, RequestStat, NotificationDelivery
+from services import RETENTION_DAYS, create_delivery_batch, process_callback, purge_expired_requests, save_request
+
+def count_rows(model, *conditions):
+    session = Session()
+    try:
+        return session.scalar(select(func.count()).select_from(model).where(*conditions))
+    finally:
+        session.close()
+
+def stat_value(metric, key):
+    session = Session()
+    try:
+        return session.scalar(select(RequestStat.value).where(RequestStat.metric == metric, RequestStat.key == key)) or 0
+    finally:
+        session.close()
+
+# Удаление заявки, о которой уже разосланы уведомления: журнал доставки ссылается на неё
+# внешним ключом, который PostgreSQL (и SQLite с foreign_keys=ON) проверяет
+@pytest.mark.parametrize('transition, action', [('cancel', 'delete_cancelled'), ('complete', 'delete_completed')])
+def test_delete_request_with_deliveries(engine, make_user, make_request, transition, action):
+    make_user(1, is_admin=True)
+    make_user(2)
+    make_user(3)
+    request_id = make_request(1)
+    assert len(create_delivery_batch(request_id, 0, 100)) == 2
+    process_callback(2, transition, request_id)
+
+    text, parse_mode, changed_id = process_callback(1, action, request_id)
+
+    assert changed_id == request_id
+    assert 'удалена' in text
+    assert count_rows(Request) == 0
+    assert count_rows(NotificationDelivery) == 0
+
+# Рассылка по удалённой заявке останавливается, а не падает на внешнем ключе
+def test_delivery_batch_for_deleted_request(engine, make_user, make_request):
+    make_user(1, is_admin=True)
+    make_user(2)
+    request_id = make_request(1)
+    process_callback(2, 'cancel', request_id)
+    process_callback(1, 'delete_cancelled', request_id)
+
+    assert create_delivery_batch(request_id, 0, 100) == []
+
+def test_purge_expired_requests_with_deliveries(engine, make_user, make_request):
+    make_user(1, is_admin=True)
+    make_user(2)
+    request_ids = [make_request(1) for _ in range(5)]
+    for request_id in request_ids:
+        create_delivery_batch(request_id, 0, 100)
+        process_callback(2, 'cancel', request_id)
+    fresh_id = make_request(1)
+    create_delivery_batch(fresh_id, 0, 100)
+
+    expired = datetime.now(timezone.utc) - timedelta(days=RETENTION_DAYS + 1)
+    session = Session()
+    try:
+        session.execute(update(Request).where(Request.id.in_(request_ids)).values(updated_at=expired))
+        session.commit()
+    finally:
+        session.close()
+
+    removed = purge_expired_requests(batch_size=2)
+
+    assert removed['cancelled'] == 5
+    assert count_rows(Request) == 1
+    assert count_rows(NotificationDelivery) == 1
+    assert count_rows(NotificationDelivery, NotificationDelivery.request_id == fresh_id) == 1
+    assert stat_value('status', 'cancelled') == 0
+    assert stat_value('status', 'new') == 1
+
+# Одновременные записи из всех потоков БД: без ошибок "database is locked" и без потерь
+def test_concurrent_writes(engine, make_user):
+    make_user(1, is_admin=True)
+    data = {'equipment': 'Дрель', 'quantity': 1, 'description': 'Описание', 'priority': 'high'}
+
+    async def write_all():
+        return await asyncio.gather(*[run_db(save_request, 1, data) for _ in range(200)])
+
+    results = asyncio.run(write_all())
+
+    assert len({request_id for _, request_id in results}) == 200
+    assert count_rows(Request) == 200
+    assert stat_value('status', 'new') == 200
+    assert stat_value('priority', 'high') == 200
+
+def test_sqlite_connection_settings(sqlite_engine):
+    with sqlite_engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == 'wal'
+        # synchronous=NORMAL
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+        assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == SQLITE_BUSY_TIMEOUT
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import os
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from telegram import Bot, Update
+
+import database
+import export
+from database import run_db, run_export
+from export import write_csv
+from handlers import export_command
+from loadtest import FakeBotApi
+from services import iter_export_rows
+
+# Размер таблицы для проверки памяти выгрузки. Миллион строк - около 40 секунд
+EXPORT_ROWS = int(os.getenv('TEST_EXPORT_ROWS', '1000000'))
+
+# Заполняет таблицу заявок count строками одним INSERT ... SELECT, без Python-объектов.
+# Триггер полнотекстового индекса на время вставки снимается: для выгрузки он не нужен
+def generate_requests(engine, count):
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP TRIGGER IF EXISTS requests_fts_insert")
+        connection.exec_driver_sql(
+            """INSERT INTO requests (user_id, equipment_name, quantity, description, priority, status,
+                                     created_at, updated_at, is_deleted, notes)
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+            SELECT 1, 'Перфоратор ' || i, i % 10 + 1, 'Описание заявки номер ' || i, 'medium', 'new',
+                   datetime('2024-01-01', '+' || (i % 100000) || ' minutes'),
+                   datetime('2024-01-01', '+' || (i % 100000) || ' minutes'), 0, NULL
+            FROM n""",
+            (count,)
+        )
+
+# Пиковая память Python при выгрузке всей таблицы в CSV
+def export_peak(path):
+    tracemalloc.start()
+    try:
+        count = write_csv(path, iter_export_rows())
+        return count, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+# Выгрузка читает и пишет строки порциями: пиковая память на миллионе заявок
+# та же, что на тысяче
+def test_export_memory_is_flat(sqlite_engine, make_user, tmp_path):
+    make_user(1, is_admin=True)
+    generate_requests(sqlite_engine, 1000)
+    small_count, small_peak = export_peak(str(tmp_path / 'small.csv'))
+
+    generate_requests(sqlite_engine, EXPORT_ROWS - 1000)
+    count, peak = export_peak(str(tmp_path / 'large.csv'))
+
+    assert small_count == 1000
+    assert count == EXPORT_ROWS
+    assert os.path.getsize(tmp_path / 'large.csv') > EXPORT_ROWS * 50
+    assert peak < small_peak + 2 * 1024 * 1024, (small_peak, peak)
+
+# Пока выгрузка идёт, потоки БД свободны для обработчиков
+def test_export_does_not_hold_db_workers(monkeypatch):
+    monkeypatch.setattr(database, 'db_executor', ThreadPoolExecutor(max_workers=1))
+    release = threading.Event()
+
+    async def run():
+        export = asyncio.create_task(run_export(release.wait, 10))
+        reply = await asyncio.wait_for(run_db(threading.current_thread), 5)
+        release.set()
+        return reply, await export
+
+    reply_thread, exported = asyncio.run(run())
+
+    assert exported is True
+    assert not reply_thread.name.startswith('export')
+    database.db_executor.shutdown()
+
+# Bot API, который отвечает 429 на первую отправку документа и запоминает загруженные файлы
+class ThrottlingBotApi(FakeBotApi):
+    def __init__(self):
+        super().__init__()
+        self.documents = []
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        if url.endswith('/sendDocument'):
+            filename, content, _ = request_data.multipart_data['document']
+            self.documents.append((filename, content, request_data.parameters.get('caption')))
+            if len(self.documents) == 1:
+                return 429, json.dumps({
+                    'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                    'parameters': {'retry_after': 1},
+                }).encode()
+        return await super().do_request(url, method, request_data, **kwargs)
+
+# Выполняет /export с аргументами args от администратора и возвращает загруженные файлы
+def run_export_command(args):
+    async def run():
+        api = ThrottlingBotApi()
+        async with Bot('123456:test', request=api) as bot:
+            update = Update.de_json({
+                'update_id': 1,
+                'message': {
+                    'message_id': 1, 'date': 0, 'text': '/export',
+                    'chat': {'id': 1, 'type': 'private'},
+                    'from': {'id': 1, 'is_bot': False, 'first_name': 'Admin'},
+                },
+            }, bot)
+            await export_command(update, SimpleNamespace(args=args))
+        return api.documents
+    return asyncio.run(run())
+
+# Повтор отправки после 429 загружает файл целиком, а не остаток прочитанного
+def test_export_retry_uploads_whole_file(engine, make_user, make_request):
+    make_user(1, is_admin=True)
+    for number in range(50):
+        make_request(1, equipment=f'Перфоратор {number}')
+
+    documents = run_export_command(['csv'])
+
+    assert len(documents) == 2
+    (filename, first, _), (_, retried, caption) = documents
+    assert filename == 'requests_all.csv'
+    assert retried == first
+    assert len(retried.decode('utf-8-sig').splitlines()) == 51
+    assert caption == "📤 Выгружено заявок: 50"
+
+# Без openpyxl запрос XLSX выгружает CSV и говорит об этом
+def test_export_xlsx_without_openpyxl(engine, make_user, make_request, monkeypatch):
+    monkeypatch.setattr(export, 'Workbook', None)
+    make_user(1, is_admin=True)
+    make_request(1)
+
+    (filename, content, caption), _ = run_export_command(['xlsx'])
+
+    assert filename == 'requests_all.csv'
+    assert content.decode('utf-8-sig').startswith('Номер;')
+    assert caption.startswith("⚠️ XLSX недоступен")
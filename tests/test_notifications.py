@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+from sqlalchemy import select
+
+from database import Session
+from handlers import NotificationPipeline
+from models import NotificationDelivery, NotificationFanout
+from services import create_delivery_batch, record_delivery_results, load_unfinished_fan_outs, process_callback
+
+# Бот, который запоминает, кому отправлены сообщения
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(chat_id)
+        return type('Message', (), {'message_id': len(self.sent)})()
+
+def load_deliveries(request_id):
+    session = Session()
+    try:
+        return session.execute(
+            select(NotificationDelivery.user_id, NotificationDelivery.status)
+            .where(NotificationDelivery.request_id == request_id)
+            .order_by(NotificationDelivery.user_id)
+        ).all()
+    finally:
+        session.close()
+
+def run_pipeline(bot, timeout=10):
+    async def run():
+        pipeline = NotificationPipeline(batch_size=2, concurrency=2)
+        pipeline.start(bot)
+        deadline = time.monotonic() + timeout
+        try:
+            while await asyncio.to_thread(load_unfinished_fan_outs) and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+        finally:
+            await pipeline.stop()
+    asyncio.run(run())
+
+# Бот перезапустился посреди рассылки: первая пачка сохранена, вторая создана, но не разослана.
+# После старта рассылка продолжается со второй пачки, и никто не получает карточку дважды
+def test_fan_out_resumes_after_restart(engine, make_user, make_request):
+    make_user(1, is_admin=True)
+    workers = {telegram_id: make_user(telegram_id) for telegram_id in range(2, 8)}
+    request_id = make_request(1)
+
+    first = create_delivery_batch(request_id, 0, 2)
+    results = [
+        {'id': delivery_id, 'status': 'sent', 'message_id': 1, 'error': None, 'sent_at': None}
+        for delivery_id, _, _ in first
+    ]
+    record_delivery_results(request_id, results, [], first[-1][1])
+    create_delivery_batch(request_id, first[-1][1], 2)
+
+    bot = FakeBot()
+    run_pipeline(bot)
+
+    assert sorted(bot.sent) == list(workers)[2:]
+    deliveries = load_deliveries(request_id)
+    assert [user_id for user_id, _ in deliveries] == sorted(workers.values())
+    assert {status for _, status in deliveries} == {'sent'}
+    assert load_unfinished_fan_outs() == []
+
+    # Завершённая рассылка после следующего перезапуска не повторяется
+    bot = FakeBot()
+    run_pipeline(bot)
+    assert bot.sent == []
+
+# Рассылка по заявке, которую успели принять до перезапуска, просто завершается
+def test_fan_out_for_processed_request_is_finished(engine, make_user, make_request):
+    make_user(1, is_admin=True)
+    make_user(2)
+    request_id = make_request(1)
+    process_callback(2, 'complete', request_id)
+
+    bot = FakeBot()
+    run_pipeline(bot)
+
+    assert bot.sent == []
+    session = Session()
+    try:
+        assert session.scalar(select(NotificationFanout.finished_at).where(NotificationFanout.request_id == request_id))
+    finally:
+        session.close()
@@ -0,0 +1,181 @@
+import asyncio
+import time
+
+import pytest
+from telegram.error import RetryAfter
+
+from outbox import Outbox
+
+# Метод Bot API, который запоминает время каждого вызова
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    async def send_message(self, name):
+        self.calls.append((name, time.monotonic()))
+        return name
+
+# Метод Bot API, который на первые вызовы отвечает 429 (RetryAfter), а потом отправляет
+class Throttled(Recorder):
+    def __init__(self, failures, retry_after=1):
+        super().__init__()
+        self.failures = failures
+        self.retry_after = retry_after
+
+    async def send_message(self, name):
+        self.calls.append((name, time.monotonic()))
+        if self.failures:
+            self.failures -= 1
+            raise RetryAfter(self.retry_after)
+        return name
+
+# Фоновая рассылка по многим чатам не задерживает ответ пользователю: он берёт токен
+# из запаса, который фон не трогает
+def test_background_leaves_reserve_for_interactive():
+    async def run():
+        outbox = Outbox(global_rate=10, chat_rate=100, chat_burst=100, background_reserve=0.5)
+        recorder = Recorder()
+        background = [
+            asyncio.create_task(outbox.send_background(chat_id, recorder.send_message, f'background {chat_id}'))
+            for chat_id in range(20)
+        ]
+        await asyncio.sleep(0.05)
+        started = time.monotonic()
+        await outbox.send(100, recorder.send_message, 'interactive')
+        waited = time.monotonic() - started
+        await asyncio.gather(*background)
+        return recorder.calls, waited
+
+    calls, waited = asyncio.run(run())
+
+    assert waited < 0.1
+    names = [name for name, _ in calls]
+    # Фон сразу забрал только половину ёмкости общего лимита, остальное ждёт пополнения
+    assert names.index('interactive') <= 6
+    assert len(names) == 21
+
+# В одном чате фоновая правка, ждущая токен, не держит очередь обычных сообщений
+def test_background_does_not_block_chat_queue():
+    async def run():
+        outbox = Outbox(global_rate=100, chat_rate=1, chat_burst=3, background_reserve=0.3)
+        recorder = Recorder()
+        background = [
+            asyncio.create_task(outbox.send_background(1, recorder.send_message, f'background {number}'))
+            for number in range(3)
+        ]
+        await asyncio.sleep(0.05)
+        started = time.monotonic()
+        await outbox.send(1, recorder.send_message, 'interactive')
+        waited = time.monotonic() - started
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        return recorder.calls, waited
+
+    calls, waited = asyncio.run(run())
+
+    assert waited < 0.1
+    assert [name for name, _ in calls] == ['background 0', 'background 1', 'interactive']
+
+# Обычная правка того же сообщения поднимает приоритет ждущей фоновой правки
+def test_interactive_edit_upgrades_background_edit():
+    async def run():
+        outbox = Outbox(global_rate=100, chat_rate=1, chat_burst=3, background_reserve=0.3)
+        recorder = Recorder()
+        await outbox.send(1, recorder.send_message, 'first')
+        await outbox.send(1, recorder.send_message, 'second')
+        # Остался один токен: фоновой правке его мало, обычной хватает
+        background = asyncio.create_task(outbox.edit_background(1, 10, recorder.send_message, 'background'))
+        await asyncio.sleep(0.05)
+        started = time.monotonic()
+        result = await outbox.edit(1, 10, recorder.send_message, 'interactive')
+        waited = time.monotonic() - started
+        return recorder.calls, await background, result, waited
+
+    calls, background_result, result, waited = asyncio.run(run())
+
+    assert background_result == result == 'interactive'
+    assert [name for name, _ in calls] == ['first', 'second', 'interactive']
+    assert waited < 0.5
+
+# После 429 отправка повторяется через retry_after, а пауза действует и на другие чаты
+def test_retry_after_pauses_and_retries():
+    async def run():
+        outbox = Outbox(global_rate=100, chat_rate=100, chat_burst=100, max_retries=3)
+        throttled, other = Throttled(failures=1), Recorder()
+        first = asyncio.create_task(outbox.send(1, throttled.send_message, 'throttled'))
+        await asyncio.sleep(0.05)
+        second = await outbox.send(2, other.send_message, 'other chat')
+        return throttled.calls, other.calls, await first, second, outbox.stats()
+
+    throttled_calls, other_calls, result, other_result, stats = asyncio.run(run())
+
+    assert result == 'throttled' and other_result == 'other chat'
+    assert len(throttled_calls) == 2
+    assert throttled_calls[1][1] - throttled_calls[0][1] >= 0.95
+    # Сообщение в другой чат ждало конца паузы
+    assert other_calls[0][1] - throttled_calls[0][1] >= 0.95
+    assert stats['throttled'] == 1 and stats['sent'] == 2
+
+def test_retry_after_gives_up_after_max_retries():
+    async def run():
+        outbox = Outbox(global_rate=100, chat_rate=100, chat_burst=100, max_retries=0)
+        throttled = Throttled(failures=5)
+        with pytest.raises(RetryAfter):
+            await outbox.send(1, throttled.send_message, 'throttled')
+        return throttled.calls, outbox.stats()
+
+    calls, stats = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert stats['throttled'] == 1 and stats['sent'] == 0 and stats['depth'] == 0
+
+# Правки одного сообщения, ждущие токен, схлопываются в одну с последним текстом,
+# и все вызовавшие получают её результат
+def test_edits_are_coalesced():
+    async def run():
+        outbox = Outbox(global_rate=100, chat_rate=10, chat_burst=1)
+        recorder = Recorder()
+        await outbox.send(1, recorder.send_message, 'card')
+        edits = [asyncio.create_task(outbox.edit(1, 10, recorder.send_message, f'edit {number}')) for number in range(3)]
+        other = asyncio.create_task(outbox.edit(1, 11, recorder.send_message, 'other message'))
+        results = await asyncio.gather(*edits, other)
+        return recorder.calls, results, outbox.stats()
+
+    calls, results, stats = asyncio.run(run())
+
+    assert [name for name, _ in calls] == ['card', 'edit 2', 'other message']
+    assert results == ['edit 2', 'edit 2', 'edit 2', 'other message']
+    assert stats['coalesced'] == 2
+
+# Ошибка схлопнутой правки достаётся всем, кто её ждал
+def test_coalesced_edit_error_reaches_all_callers():
+    async def run():
+        outbox = Outbox(global_rate=100, chat_rate=10, chat_burst=1, max_retries=0)
+        recorder, throttled = Recorder(), Throttled(failures=1)
+        await outbox.send(1, recorder.send_message, 'card')
+        edits = [asyncio.create_task(outbox.edit(1, 10, throttled.send_message, f'edit {number}')) for number in range(2)]
+        return await asyncio.gather(*edits, return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(result, RetryAfter) for result in results)
+
+# Сообщения в один чат уходят в порядке вызова и не чаще лимита чата
+def test_per_chat_order_and_rate():
+    async def run():
+        outbox = Outbox(global_rate=1000, chat_rate=20, chat_burst=1)
+        recorder = Recorder()
+        await asyncio.gather(*[
+            outbox.send(chat_id, recorder.send_message, (chat_id, number))
+            for number in range(10) for chat_id in (1, 2)
+        ])
+        return recorder.calls
+
+    calls = asyncio.run(run())
+
+    for chat_id in (1, 2):
+        chat_calls = [(name[1], sent_at) for name, sent_at in calls if name[0] == chat_id]
+        assert [number for number, _ in chat_calls] == list(range(10))
+        gaps = [later - earlier for (_, earlier), (_, later) in zip(chat_calls, chat_calls[1:])]
+        assert min(gaps) >= 0.04
@@ -0,0 +1,59 @@
+import pytest
+
+import services
+from rendering import render_cache
+from services import PAGE_SIZE, load_page, process_callback
+
+# Страница выполненных и отменённых заявок с исполнителями загружается одним и тем же
+# числом запросов при одной заявке и при полной странице (без N+1 на исполнителей)
+@pytest.mark.parametrize('view, action', [('completed', 'complete'), ('cancelled', 'cancel')])
+def test_page_statement_count_is_constant(engine, make_user, make_request, count_statements, view, action):
+    make_user(1, is_admin=True)
+    workers = [2 + number for number in range(PAGE_SIZE)]
+    for telegram_id in workers:
+        make_user(telegram_id)
+
+    counts = {}
+    for size in (1, PAGE_SIZE):
+        while len(load_page(view)[0]) < size:
+            # Каждую заявку обрабатывает другой сотрудник
+            process_callback(workers[len(load_page(view)[0])], action, make_request(1))
+
+        # Карточки уже в кэше после проверок выше - считаем запросы с пустым кэшем
+        render_cache.clear()
+        with count_statements(engine) as statements:
+            cards, _, _ = load_page(view)
+        counts[size] = len(statements)
+
+        assert len(cards) == size
+        assert all(f"@user{telegram_id}" in text for telegram_id, (_, _, text) in zip(reversed(workers[:size]), cards))
+
+    assert counts[1] == counts[PAGE_SIZE]
+
+# Граничная заявка страницы сменила статус и ушла из списка: листание от неё
+# показывает первую страницу, а не пустую или сдвинутую
+@pytest.mark.parametrize('view, action, undo', [
+    ('completed', 'complete', 'restore_completed'),
+    ('completed', 'complete', 'delete_completed'),
+    ('cancelled', 'cancel', 'restore_cancelled'),
+])
+def test_page_cursor_left_view(engine, make_user, make_request, monkeypatch, view, action, undo):
+    monkeypatch.setattr(services, 'PAGE_SIZE', 2)
+    make_user(1, is_admin=True)
+    request_ids = [make_request(1) for _ in range(5)]
+    for request_id in request_ids:
+        process_callback(1, action, request_id)
+
+    first, _, _ = load_page(view)
+    second, has_prev, _ = load_page(view, first[-1][0])
+    assert [card[0] for card in first] == request_ids[:-3:-1]
+    assert [card[0] for card in second] == request_ids[-3:-5:-1]
+    assert has_prev
+
+    cursor_id = first[-1][0]
+    process_callback(1, undo, cursor_id)
+
+    for backwards in (False, True):
+        cards, has_prev, has_next = load_page(view, cursor_id, backwards)
+        assert [card[0] for card in cards] == [request_ids[-1], request_ids[-3]]
+        assert not has_prev and has_next
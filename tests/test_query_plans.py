@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy import event, text
+
+from database import Session, migrate
+from models import SchemaVersion
+from services import load_page, process_callback
+
+VIEW_INDEXES = {
+    'active': 'ix_requests_active_created',
+    'completed': 'ix_requests_status_completed',
+    'cancelled': 'ix_requests_status_updated',
+}
+
+# Планы запросов страницы списка (EXPLAIN QUERY PLAN) для каждого выполненного SELECT ... ORDER BY
+def page_plans(engine, view, cursor_id, backwards):
+    queries = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        if 'ORDER BY' in statement:
+            queries.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        load_page(view, cursor_id, backwards)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+    with engine.connect() as connection:
+        return [
+            [row[-1] for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+            for statement, parameters in queries
+        ]
+
+@pytest.fixture
+def requests_in_all_views(sqlite_engine, make_user, make_request):
+    make_user(1, is_admin=True)
+    make_user(2)
+    request_ids = [make_request(1) for _ in range(12)]
+    for request_id in request_ids[:4]:
+        process_callback(2, 'complete', request_id)
+    for request_id in request_ids[4:8]:
+        process_callback(2, 'cancel', request_id)
+    return {'completed': request_ids[1], 'cancelled': request_ids[5], 'active': request_ids[9]}
+
+# Страницы всех трёх меню (первая, следующая и предыдущая) читаются по индексу в порядке
+# сортировки: без полного просмотра таблицы и без сортировки во временном B-дереве
+@pytest.mark.parametrize('view', list(VIEW_INDEXES))
+@pytest.mark.parametrize('page', ['first', 'next', 'previous'])
+def test_page_uses_index_order(sqlite_engine, requests_in_all_views, view, page):
+    cursor_id = None if page == 'first' else requests_in_all_views[view]
+
+    plans = page_plans(sqlite_engine, view, cursor_id, page == 'previous')
+
+    assert len(plans) == 1
+    plan = plans[0]
+    assert f'SEARCH requests USING INDEX {VIEW_INDEXES[view]} ' in plan[0]
+    assert not any('TEMP B-TREE' in step for step in plan), plan
+    assert not any(step.startswith('SCAN') for step in plan), plan
+
+# Миграция заменяет старые индексы меню на новые
+def test_migration_replaces_menu_indexes(sqlite_engine):
+    with sqlite_engine.begin() as connection:
+        connection.exec_driver_sql("CREATE INDEX ix_requests_active ON requests (is_deleted, status, created_at)")
+        connection.exec_driver_sql("CREATE INDEX ix_requests_completed ON requests (status, completed_at)")
+        connection.exec_driver_sql("CREATE INDEX ix_requests_cancelled ON requests (status, updated_at)")
+        connection.execute(SchemaVersion.__table__.delete().where(SchemaVersion.version == 9))
+
+    migrate(sqlite_engine)
+
+    session = Session()
+    try:
+        indexes = set(session.scalars(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'requests'"
+        )))
+    finally:
+        session.close()
+    assert set(VIEW_INDEXES.values()) <= indexes
+    assert not indexes & {'ix_requests_active', 'ix_requests_completed', 'ix_requests_cancelled'}
@@ -0,0 +1,54 @@
+import html
+
+from rendering import FIELD_SEPARATOR, escape_fields, escape_html
+
+# Свойства экранирования на случайных полях карточки (генератор rng - из conftest.py)
+ROUNDS = 2000
+CHARACTERS = ['<', '>', '&', '"', "'", ';', '#', 'a', 'Я', ' ', '\n', '🔧', '&amp;', '&lt;', '<b>', FIELD_SEPARATOR]
+
+def random_field(rng, separator=True):
+    kind = rng.random()
+    if kind < 0.1:
+        return rng.choice([None, 0, -5, 3.5, True, 10 ** 20])
+    characters = CHARACTERS if separator else CHARACTERS[:-1]
+    return ''.join(rng.choice(characters) for _ in range(rng.randint(0, 20)))
+
+def random_fields(rng, separator=False):
+    return [random_field(rng, separator) for _ in range(rng.randint(0, 12))]
+
+def test_escape_fields_properties(rng):
+    for _ in range(ROUNDS):
+        fields = random_fields(rng)
+        escaped = escape_fields(*fields)
+        assert len(escaped) == len(fields)
+        for field, value in zip(fields, escaped):
+            assert '<' not in value and '>' not in value
+            # Каждый & начинает одну из трёх сущностей
+            assert value.count('&') == value.count('&amp;') + value.count('&lt;') + value.count('&gt;')
+            assert html.unescape(value) == str(field)
+            assert value == escape_html(field)
+
+# Поля с разделителем идут по медленному пути - по одному - с тем же результатом
+def test_fields_with_separator_take_fallback(rng):
+    for _ in range(ROUNDS):
+        fields = random_fields(rng, separator=True)
+        if not any(FIELD_SEPARATOR in str(field) for field in fields):
+            fields.append(FIELD_SEPARATOR.join(['<a>', '&', '']))
+        # Склеенные поля разрезаются на другое число частей: быстрый путь здесь не годится
+        assert len(FIELD_SEPARATOR.join(map(str, fields)).split(FIELD_SEPARATOR)) != len(fields)
+
+        escaped = escape_fields(*fields)
+
+        assert len(escaped) == len(fields)
+        assert escaped == [escape_html(field) for field in fields]
+        assert all(html.unescape(value) == str(field) for field, value in zip(fields, escaped))
+
+def test_escape_html_properties(rng):
+    for _ in range(ROUNDS):
+        field = random_field(rng)
+        value = escape_html(field)
+        assert '<' not in value and '>' not in value
+        assert html.unescape(value) == str(field)
+        # Повторное экранирование не идемпотентно: & экранируется снова
+        if '&' in value:
+            assert escape_html(value) != value
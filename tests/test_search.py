@@ -0,0 +1,19 @@
+import services
+from services import search_requests
+
+# Полнотекстовый поиск: совпадение в названии оборудования выше совпадения в описании,
+# а ранжируются только SEARCH_CANDIDATES самых новых совпадений
+def test_search_ranks_newest_candidates(sqlite_engine, make_user, make_request, monkeypatch):
+    make_user(1, is_admin=True)
+    old_id = make_request(1, equipment='Дрель ударная')
+    in_description_id = make_request(1, equipment='Перфоратор', description='Нужна дрель и перфоратор')
+    in_equipment_id = make_request(1, equipment='Дрель')
+    make_request(1, equipment='Болгарка')
+
+    cards, has_prev, has_next = search_requests('дрел', True)
+    assert [card[0] for card in cards] == [in_equipment_id, old_id, in_description_id]
+    assert not has_prev and not has_next
+
+    monkeypatch.setattr(services, 'SEARCH_CANDIDATES', 2)
+    cards, _, _ = search_requests('дрел', True)
+    assert [card[0] for card in cards] == [in_equipment_id, in_description_id]
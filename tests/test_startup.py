@@ -0,0 +1,45 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from loadtest import parse_importtime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Выполняется в новом интерпретаторе: импорт модулей не должен создавать движок БД,
+# включать логирование в файл или создавать файлы в рабочем каталоге
+IMPORT_SCRIPT = '''
+import json, logging, os, sys
+import {modules}
+import database
+print(json.dumps({{
+    'engine': database._engine is not None,
+    'file_handlers': [type(handler).__name__ for handler in logging.getLogger().handlers],
+    'files': sorted(os.listdir('.')),
+}}))
+'''
+
+# Импорт в чистом каталоге с настройками по умолчанию: БД requests.db, лог bot.log
+# и bot_state.pickle появились бы именно здесь
+def import_in(directory, modules):
+    env = {name: value for name, value in os.environ.items()
+           if name not in ('DATABASE_URL', 'LOG_FILE', 'PERSISTENCE_FILE')}
+    env['PYTHONPATH'] = ROOT
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', IMPORT_SCRIPT.format(modules=', '.join(modules))],
+        cwd=directory, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr, modules)
+
+@pytest.mark.parametrize('modules', [('bot',), ('services',), ('manage_admins',), ('export',)])
+def test_import_has_no_side_effects(tmp_path, modules):
+    state, import_ms = import_in(tmp_path, modules)
+
+    assert not state['engine']
+    assert state['file_handlers'] == []
+    assert state['files'] == []
+    # Время импорта считается так же, как в замере запуска (loadtest.py --startup)
+    assert set(import_ms) == set(modules)
@@ -0,0 +1,86 @@
+from sqlalchemy import select, update
+
+import services
+from database import Session
+from models import RequestStat, apply_stats_delta
+from services import reconcile_request_stats, save_request
+
+def load_stats():
+    session = Session()
+    try:
+        return {(stat.metric, stat.key): stat.value for stat in session.query(RequestStat)}
+    finally:
+        session.close()
+
+# Новые и существующие счётчики меняются одним запросом INSERT ... ON CONFLICT DO UPDATE
+def test_apply_stats_delta_upserts(engine, count_statements):
+    session = Session()
+    try:
+        apply_stats_delta(session, {('status', 'new'): 2, ('priority', 'high'): 1})
+        session.commit()
+        with count_statements(engine) as statements:
+            apply_stats_delta(session, {('status', 'new'): -1, ('worker', '7'): 1})
+        session.commit()
+    finally:
+        session.close()
+
+    assert len(statements) == 1
+    assert load_stats() == {('status', 'new'): 1, ('priority', 'high'): 1, ('worker', '7'): 1}
+
+def test_reconcile_fixes_drift(engine, make_user, make_request):
+    make_user(1, is_admin=True)
+    make_request(1)
+    make_request(1, priority='high')
+    session = Session()
+    try:
+        session.execute(update(RequestStat).where(RequestStat.metric == 'status', RequestStat.key == 'new').values(value=7))
+        session.commit()
+    finally:
+        session.close()
+
+    assert reconcile_request_stats() == 1
+    stats = load_stats()
+    assert stats[('status', 'new')] == 2
+    assert stats[('priority', 'high')] == 1
+    assert reconcile_request_stats() == 0
+
+# Заявка, созданная во время пересчёта, не теряется: пересчёт повторяется
+def test_reconcile_retries_after_concurrent_change(engine, make_user, make_request, monkeypatch):
+    make_user(1, is_admin=True)
+    make_request(1)
+    compute = services.compute_request_stats
+    calls = []
+
+    def compute_while_saving(connection):
+        totals = compute(connection)
+        calls.append(totals)
+        if len(calls) == 1:
+            save_request(1, {'equipment': 'Дрель', 'quantity': 1, 'description': 'Описание', 'priority': 'low'})
+        return totals
+
+    monkeypatch.setattr(services, 'compute_request_stats', compute_while_saving)
+
+    assert reconcile_request_stats() == 0
+    assert len(calls) == 2
+    assert load_stats()[('status', 'new')] == 2
+    assert load_stats()[('priority', 'low')] == 1
+
+# Если заявки меняются при каждом пересчёте, счётчики не трогаются
+def test_reconcile_gives_up_when_stats_keep_changing(engine, make_user, make_request, monkeypatch):
+    make_user(1, is_admin=True)
+    make_request(1)
+    compute = services.compute_request_stats
+
+    def compute_while_saving(connection):
+        totals = compute(connection)
+        save_request(1, {'equipment': 'Дрель', 'quantity': 1, 'description': 'Описание', 'priority': 'low'})
+        return totals
+
+    monkeypatch.setattr(services, 'compute_request_stats', compute_while_saving)
+
+    assert reconcile_request_stats(attempts=2) is None
+    session = Session()
+    try:
+        assert session.scalar(select(RequestStat.value).where(RequestStat.metric == 'status', RequestStat.key == 'new')) == 3
+    finally:
+        session.close()
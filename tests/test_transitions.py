@@ -0,0 +1,87 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import database
+from database import Session, run_db
+from models import Request, RequestStat
+from services import process_callback
+
+WORKERS = 32
+
+# Больше потоков, чем DB_WORKERS по умолчанию, но в пределах пула соединений:
+# так одновременных транзакций по одной заявке получается больше
+@pytest.fixture
+def busy_executor(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='db-test')
+    monkeypatch.setattr(database, 'db_executor', executor)
+    yield executor
+    executor.shutdown()
+
+def press_all(presses):
+    async def run():
+        return await asyncio.gather(*[
+            run_db(process_callback, telegram_id, action, request_id) for telegram_id, action, request_id in presses
+        ])
+    return asyncio.run(run())
+
+def load_request(request_id):
+    session = Session()
+    try:
+        return session.get(Request, request_id)
+    finally:
+        session.close()
+
+def load_stats():
+    session = Session()
+    try:
+        return {(stat.metric, stat.key): stat.value for stat in session.query(RequestStat)}
+    finally:
+        session.close()
+
+# Много сотрудников одновременно нажимают "Принять" на одной заявке: выигрывает ровно один,
+# остальные получают ответ, кто её уже принял
+def test_concurrent_complete_has_one_winner(engine, busy_executor, make_user, make_request):
+    make_user(1, is_admin=True)
+    workers = {2 + number: make_user(2 + number) for number in range(WORKERS)}
+    request_id = make_request(1)
+
+    results = press_all([(telegram_id, 'complete', request_id) for telegram_id in workers])
+
+    winners = [telegram_id for telegram_id, (_, _, changed_id) in zip(workers, results) if changed_id == request_id]
+    assert len(winners) == 1
+    winner = winners[0]
+    request = load_request(request_id)
+    assert request.status == 'completed'
+    assert request.completed_by_id == workers[winner]
+
+    conflicts = [text for telegram_id, (text, _, changed_id) in zip(workers, results) if telegram_id != winner]
+    assert len(conflicts) == WORKERS - 1
+    assert all(text == f"⚠️ Заявка #{request_id} уже принята: @user{winner}" for text in conflicts)
+
+    stats = load_stats()
+    assert stats[('status', 'completed')] == 1
+    assert stats[('status', 'new')] == 0
+    assert stats[('worker', str(workers[winner]))] == 1
+
+# "Принять" и "Отклонить" вперемешку: заявка переходит ровно один раз, в статус победителя
+def test_concurrent_complete_and_cancel(engine, busy_executor, make_user, make_request):
+    make_user(1, is_admin=True)
+    workers = [2 + number for number in range(WORKERS)]
+    for telegram_id in workers:
+        make_user(telegram_id)
+    request_id = make_request(1)
+    presses = [(telegram_id, 'complete' if telegram_id % 2 else 'cancel', request_id) for telegram_id in workers]
+
+    results = press_all(presses)
+
+    won = [action for (_, action, _), (_, _, changed_id) in zip(presses, results) if changed_id is not None]
+    assert len(won) == 1
+    request = load_request(request_id)
+    assert request.status == {'complete': 'completed', 'cancel': 'cancelled'}[won[0]]
+    assert sum(1 for text, _, changed_id in results if changed_id is None and text.startswith('⚠️')) == WORKERS - 1
+
+    stats = load_stats()
+    assert stats[('status', request.status)] == 1
+    assert stats[('status', 'new')] == 0
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import socket
+import urllib.error
+import urllib.request
+
+import pytest
+
+import bot
+from loadtest import FakeBotApi
+
+SECRET = 's3cret'
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+# Синтетическое обновление: сообщение /help от пользователя
+def make_update(update_id):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': 42, 'type': 'private'},
+            'from': {'id': 42, 'is_bot': False, 'first_name': 'Test'},
+            'text': '/help',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 5}],
+        },
+    }
+
+# POST обновления на webhook, как это делает Telegram. Возвращает HTTP-статус ответа
+def post_update(url, update, secret=None):
+    headers = {'Content-Type': 'application/json'}
+    if secret is not None:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+    request = urllib.request.Request(url, data=json.dumps(update).encode(), headers=headers, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+# Запускает webhook-сервер с параметрами из main() на свободном порту, отправляет обновления
+# и возвращает статусы ответов и update_id обновлений, попавших в очередь приложения.
+# Обработчики не запускаются: проверяется только приём обновлений
+def receive(updates):
+    async def run():
+        api = FakeBotApi()
+        application = bot.build_application(request=api)
+        options = bot.webhook_options(bot.get_allowed_updates(application))
+        url = f"http://127.0.0.1:{options['port']}/{options['url_path']}"
+        await application.initialize()
+        try:
+            await application.updater.start_webhook(**options)
+            try:
+                statuses = [
+                    await asyncio.to_thread(post_update, url, update, secret) for update, secret in updates
+                ]
+            finally:
+                await application.updater.stop()
+            received = []
+            while not application.update_queue.empty():
+                received.append(application.update_queue.get_nowait().update_id)
+            return statuses, received, api.calls
+        finally:
+            await application.shutdown()
+    return asyncio.run(run())
+
+@pytest.fixture
+def webhook(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, 'PERSISTENCE_FILE', str(tmp_path / 'state.pickle'))
+    monkeypatch.setattr(bot, 'WEBHOOK_URL', 'https://bot.example.com/')
+    monkeypatch.setattr(bot, 'WEBHOOK_LISTEN', '127.0.0.1')
+    monkeypatch.setattr(bot, 'WEBHOOK_PORT', free_port())
+    monkeypatch.setattr(bot, 'WEBHOOK_SECRET', SECRET)
+
+# Обновления без заголовка с секретом или с чужим секретом отклоняются и не доходят до обработчиков
+def test_webhook_checks_secret_token(webhook):
+    statuses, received, calls = receive([
+        (make_update(1), None),
+        (make_update(2), 'wrong'),
+        (make_update(3), SECRET),
+        (make_update(4), ''),
+    ])
+
+    assert statuses == [403, 403, 200, 403]
+    assert received == [3]
+    # При запуске webhook зарегистрирован в Telegram
+    assert calls['setWebhook'] == 1
+
+# Без WEBHOOK_SECRET секрет генерируется случайно: запрос без заголовка не принимается
+def test_webhook_generates_secret(webhook, monkeypatch):
+    monkeypatch.setattr(bot, 'WEBHOOK_SECRET', '')
+    assert bot.webhook_options([])['secret_token'] != bot.webhook_options([])['secret_token']
+
+    statuses, received, _ = receive([(make_update(1), None), (make_update(2), '')])
+
+    assert statuses == [403, 403]
+    assert received == []
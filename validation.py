@@ -0,0 +1,44 @@
+# Проверка полей заявки. Одни и те же правила действуют в диалоге создания заявки
+# и при импорте заявок из таблицы
+
+# Кнопки выбора приоритета в диалоге
+PRIORITY_BUTTONS = {
+    "🔴 Высокий": "high",
+    "🟡 Средний": "medium",
+    "🟢 Низкий": "low"
+}
+
+# Приоритет в таблице можно указать кнопкой, подписью или значением из базы
+PRIORITY_ALIASES = {
+    **{button.lower(): value for button, value in PRIORITY_BUTTONS.items()},
+    **{button.split(' ', 1)[1].lower(): value for button, value in PRIORITY_BUTTONS.items()},
+    **{value: value for value in PRIORITY_BUTTONS.values()},
+}
+
+# Значение поля не прошло проверку. Текст ошибки продолжает фразу "Пожалуйста, ..."
+class ValidationError(ValueError):
+    pass
+
+# Текстовое поле заявки: обязательно и не пустое
+def parse_text(value):
+    text = str(value).strip() if value is not None else ''
+    if not text:
+        raise ValidationError("заполните поле")
+    return text
+
+# Количество: целое число больше нуля
+def parse_quantity(value):
+    try:
+        quantity = int(str(value).strip())
+    except ValueError:
+        raise ValidationError("введите число (например: 5, 10, 100)")
+    if quantity <= 0:
+        raise ValidationError("введите корректное количество (целое число больше нуля)")
+    return quantity
+
+# Приоритет: high, medium или low
+def parse_priority(value):
+    priority = PRIORITY_ALIASES.get(str(value).strip().lower()) if value is not None else None
+    if priority is None:
+        raise ValidationError("выберите приоритет из предложенных вариантов")
+    return priority